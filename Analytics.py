@@ -0,0 +1,139 @@
+import threading
+
+# Revenue analytics over the full order history.
+# The order lines are flattened into a columnar table and aggregated with groupby once; after that
+# the totals by customer, product and period are adjusted per changed order through store events.
+# Archived orders (older partitions, see Storage.py) are not in the order store: their totals are computed
+# once and kept until the archived partitions change, so a rebuild after a reset only aggregates the hot orders.
+# pandas is imported by the functions that build frames, so importing this module does not load it.
+
+LINE_COLUMNS = ['order_id', 'customer_id', 'product_id', 'period', 'quantity', 'price']
+
+
+# Function to get the reporting period (YYYY-MM) of an order
+def order_period(order):
+    created = str(order.get('created_at') or '')
+    return created[:7] if created else 'unknown'
+
+
+# Function to flatten orders into a columnar order-lines table with the amount of every line
+def order_lines_frame(orders):
+    import pandas as pd
+
+    columns = {column: [] for column in LINE_COLUMNS}
+    for order in orders:
+        period = order_period(order)
+        for line in order['products']:
+            columns['order_id'].append(str(order['order_id']))
+            columns['customer_id'].append(str(order['customer_id']))
+            columns['product_id'].append(str(line['product_id']))
+            columns['period'].append(period)
+            columns['quantity'].append(line['quantity'])
+            columns['price'].append(line['price'])
+    frame = pd.DataFrame(columns)
+    frame['amount'] = frame['quantity'].to_numpy(dtype=float) * frame['price'].to_numpy(dtype=float)
+    return frame
+
+
+# Function to add up two {key: amount} totals
+def merged_totals(first, second):
+    totals = dict(first)
+    for key, amount in second.items():
+        totals[key] = totals.get(key, 0.0) + amount
+    return totals
+
+
+# Function to get the totals (by customer, by product, by period) of an order-lines frame
+def frame_totals(frame):
+    return tuple(frame.groupby(column)['amount'].sum().to_dict() for column in ('customer_id', 'product_id', 'period'))
+
+
+# Function to get what one order adds to the totals: (customer_id, period, {product_id: amount})
+def order_contribution(order):
+    amounts = {}
+    for line in order['products']:
+        product_id = str(line['product_id'])
+        amounts[product_id] = amounts.get(product_id, 0.0) + line['quantity'] * line['price']
+    return str(order['customer_id']), order_period(order), amounts
+
+
+class OrderAnalytics:
+    def __init__(self, order_store, archived=None, archived_signature=None):
+        self.order_store = order_store
+        # Function returning the archived orders, which the order store does not hold
+        self.archived = archived
+        # Function returning a value that changes with the archived orders (without it they are read every rebuild)
+        self.archived_signature = archived_signature
+        # (signature, totals) of the archived orders
+        self._archived_totals = None
+        self._lock = threading.Lock()
+        self.rebuild()
+        order_store.subscribe(self.on_change)
+
+    # Function to recompute every aggregate from the order store with vectorized groupby, on top of the
+    # totals of the archived orders
+    def rebuild(self):
+        with self._lock:
+            archived_totals = self._archived()
+            frame = order_lines_frame(self.order_store)
+            hot_totals = frame_totals(frame)
+            self.by_customer, self.by_product, self.by_period = (
+                merged_totals(archived, hot) for archived, hot in zip(archived_totals, hot_totals))
+            # What each hot order currently adds, so a change can be subtracted again
+            self._contributions = {}
+            per_order = frame.groupby(['order_id', 'customer_id', 'period', 'product_id'], sort=False)['amount'].sum()
+            for (order_id, customer_id, period, product_id), amount in per_order.items():
+                self._contributions.setdefault(order_id, (customer_id, period, {}))[2][product_id] = amount
+
+    # Function to get the totals of the archived orders, reading them again only once they have changed
+    def _archived(self):
+        if self.archived is None:
+            return {}, {}, {}
+        signature = self.archived_signature() if self.archived_signature else None
+        if self._archived_totals is None or self.archived_signature is None or self._archived_totals[0] != signature:
+            self._archived_totals = (signature, frame_totals(order_lines_frame(self.archived())))
+        return self._archived_totals[1]
+
+    # Store listener keeping the aggregates in step with add_order/update_order/delete_order
+    def on_change(self, event, order):
+        if event == 'reset':
+            self.rebuild()
+            return
+        with self._lock:
+            order_id = str(order['order_id'])
+            old = self._contributions.pop(order_id, None)
+            if old is not None:
+                self._add(old, -1)
+            if event != 'remove':
+                new = order_contribution(order)
+                self._contributions[order_id] = new
+                self._add(new, 1)
+
+    def _add(self, contribution, sign):
+        customer_id, period, amounts = contribution
+        for product_id, amount in amounts.items():
+            for totals, key in ((self.by_customer, customer_id), (self.by_product, product_id),
+                                (self.by_period, period)):
+                totals[key] = totals.get(key, 0.0) + sign * amount
+                if abs(totals[key]) < 1e-9:
+                    del totals[key]
+
+    def _frame(self, totals, label):
+        import pandas as pd
+
+        with self._lock:
+            frame = pd.DataFrame(list(totals.items()), columns=[label, 'Total Amount'])
+        return frame.sort_values('Total Amount', ascending=False, ignore_index=True)
+
+    # Function to get the revenue of one customer over the full history, or None without orders
+    def customer_total(self, customer_id):
+        return self.by_customer.get(str(customer_id))
+
+    def revenue_by_customer(self):
+        return self._frame(self.by_customer, 'Customer ID')
+
+    def revenue_by_product(self):
+        return self._frame(self.by_product, 'Product ID')
+
+    def revenue_by_period(self):
+        return self._frame(self.by_period, 'Period').sort_values('Period', ignore_index=True)
@@ -0,0 +1,266 @@
+import argparse
+import io
+import json
+from concurrent.futures import ThreadPoolExecutor
+import tornado.ioloop
+import tornado.web
+from DataStore import VersionConflict
+from Ingest import IMPORT_FORMATS, read_rows, order_specs
+from Inventory import OutOfStock
+from Jobs import JobLimit
+from Records import record_json
+from Metrics import metrics, observe
+from OrderCore import get_core
+from Settings import API_PORT, API_THREADS, LOW_STOCK_THRESHOLD
+
+# Lightweight asynchronous HTTP API over the headless core, run with:
+#   python Api.py [--port 8502]
+# One event loop accepts many concurrent clients; the blocking core calls (file locks, disk writes,
+# PDF rendering) run on a thread pool so a slow request never holds up the others.
+#
+#   GET  /products/<id>             GET  /customers/<id>            GET /customers/<id>/orders
+#   GET  /products/low-stock?threshold=5&offset=0&limit=100
+#   GET  /customers/search?q=ram+ghaziabad&limit=20&fuzzy=1         GET /customers/duplicates
+#   GET  /orders/<id>  (archived months included)                  POST /orders {"customer_id"}
+#   POST /orders/<id>/lines {"product_id", "quantity", "expected_version"?, "replace"?}
+#   GET  /orders/<id>/invoice       (application/pdf)
+#   POST /orders/import?format=jsonl|csv|xlsx  (body: the file, see Ingest.py)
+#   GET  /metrics                   (Prometheus text format)
+#   POST /jobs {"kind": "export"|"invoices", "params"}   GET /jobs   GET|DELETE /jobs/<id>   GET /jobs/<id>/result
+#   Jobs belong to the user named in the X-User header (default: the client address), see Jobs.py
+
+executor = ThreadPoolExecutor(API_THREADS, thread_name_prefix='orderm-api')
+
+
+class BaseHandler(tornado.web.RequestHandler):
+    def initialize(self, core):
+        self.core = core
+
+    # Function to run a blocking core call on the thread pool
+    def run(self, fn, *args):
+        return tornado.ioloop.IOLoop.current().run_in_executor(executor, fn, *args)
+
+    # Function to read the JSON request body, answering 400 when it is not a JSON object
+    def json_body(self):
+        try:
+            body = json.loads(self.request.body or b'{}')
+        except ValueError:
+            raise tornado.web.HTTPError(400, reason='Request body is not valid JSON')
+        if not isinstance(body, dict):
+            raise tornado.web.HTTPError(400, reason='Request body must be a JSON object')
+        return body
+
+    def send_json(self, data, status=200):
+        self.set_status(status)
+        self.set_header('Content-Type', 'application/json')
+        self.finish(json.dumps(data, default=record_json))
+
+    def write_error(self, status_code, **kwargs):
+        self.send_json({'error': self._reason}, status_code)
+
+    def on_finish(self):
+        observe(f'api {self.request.method} {type(self).__name__}', self.request.request_time())
+
+
+class MetricsHandler(BaseHandler):
+    async def get(self):
+        self.set_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.finish(metrics.prometheus())
+
+
+class RecordHandler(BaseHandler):
+    def initialize(self, core, dataset):
+        super().initialize(core)
+        self.dataset = dataset
+
+    async def get(self, record_id):
+        record = await self.run(lambda: getattr(self.core, f'{self.dataset}_store').get(record_id))
+        if record is None:
+            raise tornado.web.HTTPError(404, reason=f'{self.dataset.capitalize()} {record_id} not found')
+        self.send_json(record)
+
+
+class OrderHandler(BaseHandler):
+    async def get(self, order_id):
+        order = await self.run(self.core.find_order, order_id)
+        if order is None:
+            raise tornado.web.HTTPError(404, reason=f'Order {order_id} not found')
+        self.send_json(order)
+
+
+class LowStockHandler(BaseHandler):
+    async def get(self):
+        try:
+            threshold = float(self.get_query_argument('threshold', str(LOW_STOCK_THRESHOLD)))
+            offset = int(self.get_query_argument('offset', '0'))
+            limit = int(self.get_query_argument('limit', '100'))
+        except ValueError:
+            raise tornado.web.HTTPError(400, reason='threshold, offset and limit must be numbers')
+        products, total = await self.run(self.core.low_stock, threshold, offset, limit)
+        self.send_json({'products': products, 'total': total})
+
+
+class CustomerSearchHandler(BaseHandler):
+    async def get(self):
+        query = self.get_query_argument('q', '')
+        try:
+            limit = int(self.get_query_argument('limit', '20'))
+        except ValueError:
+            raise tornado.web.HTTPError(400, reason='limit must be a number')
+        fuzzy = self.get_query_argument('fuzzy', '1') not in ('0', 'false')
+        matches = await self.run(lambda: self.core.customer_search.search(query, limit, fuzzy))
+        self.send_json([{'customer': customer, 'score': score} for customer, score in matches])
+
+
+class DuplicateCustomersHandler(BaseHandler):
+    async def get(self):
+        self.send_json(await self.run(lambda: self.core.customer_search.duplicates()))
+
+
+class CustomerOrdersHandler(BaseHandler):
+    async def get(self, customer_id):
+        self.send_json(await self.run(lambda: self.core.order_store.for_customer(customer_id)))
+
+
+class OrdersHandler(BaseHandler):
+    async def post(self):
+        customer_id = self.json_body().get('customer_id')
+        if customer_id is None:
+            raise tornado.web.HTTPError(400, reason='customer_id is required')
+        if await self.run(lambda: self.core.customer_store.get(customer_id)) is None:
+            raise tornado.web.HTTPError(404, reason=f'Customer {customer_id} not found')
+        order = await self.run(self.core.add_order, customer_id)
+        self.send_json(order, 201)
+
+
+class ImportHandler(BaseHandler):
+    async def post(self):
+        fmt = self.get_query_argument('format', 'jsonl')
+        if fmt not in IMPORT_FORMATS:
+            raise tornado.web.HTTPError(400, reason=f'format must be one of {", ".join(IMPORT_FORMATS)}')
+        specs = order_specs(read_rows(io.BytesIO(self.request.body), fmt))
+        result = await self.run(self.core.import_orders, specs)
+        self.send_json(result, 201 if result['created'] else 200)
+
+
+class OrderLinesHandler(BaseHandler):
+    async def post(self, order_id):
+        body = self.json_body()
+        quantity = body.get('quantity')
+        if body.get('product_id') is None or not isinstance(quantity, int) or quantity < 1:
+            raise tornado.web.HTTPError(400, reason='product_id and a positive integer quantity are required')
+        try:
+            updated = await self.run(self.core.update_order, order_id, body['product_id'], quantity,
+                                     body.get('expected_version'), bool(body.get('replace')))
+        except (VersionConflict, OutOfStock) as e:
+            raise tornado.web.HTTPError(409, reason=str(e))
+        if not updated:
+            raise tornado.web.HTTPError(404, reason='Order ID or Product ID not found')
+        self.send_json(self.core.order_store.get(order_id))
+
+
+class InvoiceHandler(BaseHandler):
+    async def get(self, order_id):
+        pdf = await self.run(self.core.get_invoice, order_id)
+        if pdf is None:
+            raise tornado.web.HTTPError(404, reason=f'Order {order_id} or its customer not found')
+        self.set_header('Content-Type', 'application/pdf')
+        self.set_header('Content-Disposition', f'attachment; filename="bill_order_{order_id}.pdf"')
+        self.finish(pdf)
+
+
+class JobBaseHandler(BaseHandler):
+    # Function to get the owner of the jobs a request sees
+    def owner(self):
+        return self.request.headers.get('X-User') or self.request.remote_ip
+
+    # Function to get one of the owner's jobs, answering 404 for anyone else's
+    async def job(self, job_id):
+        job = await self.run(self.core.jobs.get, job_id)
+        if job is None or job['owner'] != self.owner():
+            raise tornado.web.HTTPError(404, reason=f'Job {job_id} not found')
+        return job
+
+
+class JobsHandler(JobBaseHandler):
+    async def get(self):
+        self.send_json(await self.run(self.core.jobs.list, self.owner()))
+
+    async def post(self):
+        body = self.json_body()
+        params = body.get('params') or {}
+        if not isinstance(params, dict):
+            raise tornado.web.HTTPError(400, reason='params must be a JSON object')
+        try:
+            job_id = await self.run(self.core.jobs.submit, body.get('kind'), params, self.owner())
+        except ValueError as e:
+            raise tornado.web.HTTPError(400, reason=str(e))
+        except JobLimit as e:
+            raise tornado.web.HTTPError(429, reason=str(e))
+        self.send_json(await self.run(self.core.jobs.get, job_id), 202)
+
+
+class JobHandler(JobBaseHandler):
+    async def get(self, job_id):
+        self.send_json(await self.job(job_id))
+
+    async def delete(self, job_id):
+        await self.job(job_id)
+        if not await self.run(self.core.jobs.cancel, job_id, self.owner()):
+            raise tornado.web.HTTPError(409, reason=f'Job {job_id} has already finished')
+        self.send_json(await self.job(job_id))
+
+
+class JobResultHandler(JobBaseHandler):
+    async def get(self, job_id):
+        await self.job(job_id)
+        result = await self.run(self.core.jobs.result, job_id)
+        if result is None:
+            raise tornado.web.HTTPError(404, reason=f'Job {job_id} has no result (not finished, failed or expired)')
+        path, file_name, mime = result
+        self.set_header('Content-Type', mime)
+        self.set_header('Content-Disposition', f'attachment; filename="{file_name}"')
+        with open(path, 'rb') as f:
+            while True:
+                chunk = await self.run(f.read, 1024 * 1024)
+                if not chunk:
+                    break
+                self.write(chunk)
+                await self.flush()
+        self.finish()
+
+
+# Function to build the API application on top of a core
+def make_app(core=None):
+    core = core or get_core()
+    return tornado.web.Application([
+        (r'/metrics', MetricsHandler, {'core': core}),
+        (r'/products/low-stock', LowStockHandler, {'core': core}),
+        (r'/products/([^/]+)', RecordHandler, {'core': core, 'dataset': 'product'}),
+        (r'/customers/search', CustomerSearchHandler, {'core': core}),
+        (r'/customers/duplicates', DuplicateCustomersHandler, {'core': core}),
+        (r'/customers/([^/]+)', RecordHandler, {'core': core, 'dataset': 'customer'}),
+        (r'/customers/([^/]+)/orders', CustomerOrdersHandler, {'core': core}),
+        (r'/orders', OrdersHandler, {'core': core}),
+        (r'/orders/import', ImportHandler, {'core': core}),
+        (r'/orders/([^/]+)', OrderHandler, {'core': core}),
+        (r'/orders/([^/]+)/lines', OrderLinesHandler, {'core': core}),
+        (r'/orders/([^/]+)/invoice', InvoiceHandler, {'core': core}),
+        (r'/jobs', JobsHandler, {'core': core}),
+        (r'/jobs/([^/]+)', JobHandler, {'core': core}),
+        (r'/jobs/([^/]+)/result', JobResultHandler, {'core': core}),
+    ])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Order management HTTP API')
+    parser.add_argument('--port', type=int, default=API_PORT, help='port to listen on')
+    args = parser.parse_args()
+
+    make_app().listen(args.port)
+    print(f'Order management API listening on port {args.port}')
+    tornado.ioloop.IOLoop.current().start()
+
+
+if __name__ == '__main__':
+    main()
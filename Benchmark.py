@@ -0,0 +1,330 @@
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import date, datetime, timedelta
+
+# Reproducible benchmark of the hot paths on synthetic datasets, run with:
+#   python Benchmark.py [--sizes 10000 100000 1000000] [--storage json|journal|sqlite|partitioned|arrow]
+#                       [--output results.json]
+#   python Benchmark.py --compare baseline.json results.json
+# A size is the number of order lines; the dataset also has size/10 products and size/10 customers, and
+# orders of 3 lines. Every size runs in its own temporary directory, so the real data files are never touched.
+# Each operation reports throughput, latency percentiles (ms) and the peak memory Python allocated for one call.
+# 'cold start' is a fresh interpreter importing the core and loading every dataset; its p50 is checked
+# against --startup-target, and the heavy libraries it loaded are listed (they should only load on use).
+
+DEFAULT_SIZES = [10000, 100000]
+LINES_PER_ORDER = 3
+# Cold start target in seconds
+STARTUP_TARGET = 2.0
+HEAVY_MODULES = ['pandas', 'reportlab', 'openpyxl', 'pyarrow', 'numpy']
+STORAGE_ENV = {
+    'json': {'ORDERM_STORAGE': 'json', 'ORDERM_PERSISTENCE': 'snapshot'},
+    'journal': {'ORDERM_STORAGE': 'json', 'ORDERM_PERSISTENCE': 'journal'},
+    'sqlite': {'ORDERM_STORAGE': 'sqlite', 'ORDERM_SQLITE_PATH': 'bench.db'},
+    'partitioned': {'ORDERM_STORAGE': 'json', 'ORDERM_PERSISTENCE': 'snapshot', 'ORDERM_ORDER_PARTITIONS': '1'},
+    'arrow': {'ORDERM_STORAGE': 'arrow'},
+}
+COLD_START_SCRIPT = '''
+import json, sys
+from OrderCore import get_core
+core = get_core()
+core.product_store, core.customer_store, core.order_store
+print(json.dumps([name for name in %r if name in sys.modules]))
+''' % (HEAVY_MODULES,)
+
+
+# Function to build synthetic products, customers and orders in the on-disk format
+def synthetic_data(size, seed=0):
+    rng = random.Random(seed)
+    product_count = max(size // 10, 1)
+    customer_count = max(size // 10, 1)
+    products = [{'id': f'P{n:08d}', 'name': f'Product {n % 5000}', 'price': round(rng.uniform(1, 500), 2),
+                 'quantity': 10 ** 9, 'version': 1} for n in range(product_count)]
+    customers = [{'id': f'C{n:08d}', 'name': f'Customer {n}', 'address': f'{n} Main Street',
+                  'mobile': f'{rng.randrange(10 ** 9, 10 ** 10)}', 'email': f'customer{n}@example.com', 'version': 1}
+                 for n in range(customer_count)]
+    orders = []
+    for n in range(max(size // LINES_PER_ORDER, 1)):
+        lines = {}
+        for _ in range(LINES_PER_ORDER):
+            product = products[rng.randrange(product_count)]
+            lines.setdefault(product['id'], {'product_id': product['id'], 'quantity': 0, 'price': product['price']})
+            lines[product['id']]['quantity'] += rng.randint(1, 5)
+        total_amount = round(sum(line['quantity'] * line['price'] for line in lines.values()), 2)
+        orders.append({'order_id': f'O{n:08d}', 'customer_id': customers[rng.randrange(customer_count)]['id'],
+                       'products': list(lines.values()), 'total_amount': total_amount,
+                       'created_at': f'{date.today() - timedelta(days=rng.randrange(365))}T12:00:00',
+                       'version': 1})
+    return {'products.json': products, 'customers.json': customers, 'orders.json': orders}
+
+
+# Function to get the value at a percentile of sorted samples
+def percentile(samples, pct):
+    if not samples:
+        return None
+    index = min(len(samples) - 1, max(0, int(round(pct / 100 * (len(samples) - 1)))))
+    return samples[index]
+
+
+# Function to time calls of fn(i) for i in range(count) and summarize them; one extra call under
+# tracemalloc measures the peak memory of a single call
+def run_timed(fn, count, memory=True):
+    samples = []
+    started = time.perf_counter()
+    for i in range(count):
+        start = time.perf_counter()
+        fn(i)
+        samples.append(time.perf_counter() - start)
+    elapsed = time.perf_counter() - started
+    samples.sort()
+    result = {
+        'calls': count,
+        'seconds': round(elapsed, 6),
+        'throughput': round(count / elapsed, 2) if elapsed else None,
+        'mean_ms': round(statistics.fmean(samples) * 1000, 4),
+        'p50_ms': round(percentile(samples, 50) * 1000, 4),
+        'p95_ms': round(percentile(samples, 95) * 1000, 4),
+        'p99_ms': round(percentile(samples, 99) * 1000, 4),
+        'max_ms': round(samples[-1] * 1000, 4),
+    }
+    if memory:
+        tracemalloc.start()
+        try:
+            fn(count)
+            result['peak_bytes'] = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return result
+
+
+# Function to create the storage backend to benchmark inside the current directory
+def make_storage(kind):
+    from Storage import ArrowStorage, JournalStorage, PartitionedStorage, SnapshotStorage, SqliteStorage
+
+    if kind == 'sqlite':
+        return SqliteStorage('bench.db')
+    if kind == 'journal':
+        return JournalStorage()
+    if kind == 'json':
+        return SnapshotStorage()
+    if kind == 'partitioned':
+        return PartitionedStorage(SnapshotStorage())
+    if kind == 'arrow':
+        return ArrowStorage()
+    raise ValueError(f'Unknown storage: {kind}')
+
+
+# Function to time cold starts of the core on the data in the current directory
+def bench_cold_start(args):
+    env = dict(os.environ, ORDERM_METRICS_PORT='0', ORDERM_METRICS_FILE='', **STORAGE_ENV[args.storage])
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [os.path.dirname(os.path.abspath(__file__)),
+                                                      env.get('PYTHONPATH')]))
+    loaded = []
+
+    def start(i):
+        process = subprocess.run([sys.executable, '-c', COLD_START_SCRIPT], env=env, capture_output=True, text=True,
+                                 check=True)
+        loaded[:] = json.loads(process.stdout.strip().splitlines()[-1])
+    stats = run_timed(start, args.repeat, False)
+    stats['heavy_modules'] = list(loaded)
+    stats['target_ms'] = args.startup_target * 1000
+    stats['within_target'] = stats['p50_ms'] <= stats['target_ms']
+    return stats
+
+
+# Function to benchmark every hot path at one dataset size; returns {operation: stats}
+def bench_size(size, args):
+    from Analytics import OrderAnalytics
+    from Export import ORDER_COLUMNS, export_rows, order_rows
+    from Invoice import generate_invoice
+    from OrderCore import OrderCore
+    from Records import to_records
+
+    rng = random.Random(size)
+    data = synthetic_data(size)
+    storage = make_storage(args.storage)
+    for filename, records in data.items():
+        storage.save(filename, records)
+    core = OrderCore(storage)
+    results = {}
+
+    def report(name, stats):
+        results[name] = stats
+        print(f'  {name:<24} {stats["throughput"] or 0:>12.1f}/s  p50 {stats["p50_ms"]:>10.3f} ms  '
+              f'p95 {stats["p95_ms"]:>10.3f} ms  p99 {stats["p99_ms"]:>10.3f} ms'
+              + (f'  peak {stats["peak_bytes"] / 2 ** 20:>8.1f} MiB' if 'peak_bytes' in stats else ''))
+
+    report('cold start', bench_cold_start(args))
+    cold_start = results['cold start']
+    if not cold_start['within_target']:
+        print(f'  cold start is over the {args.startup_target:.2f} s target')
+    if cold_start['heavy_modules']:
+        print(f'  cold start loaded {", ".join(cold_start["heavy_modules"])}')
+
+    for filename in data:
+        report(f'load_data {filename}',
+               run_timed(lambda i: core.load_data(filename, []), args.repeat, args.memory))
+    # Loading as the stores do, with the records built, so backends returning dicts or records compare fairly
+    for filename in data:
+        report(f'load records {filename}',
+               run_timed(lambda i: to_records(filename, core.load_data(filename, [])), args.repeat, args.memory))
+    for filename in data:
+        records = core.load_data(filename, [])
+        report(f'save_data {filename}',
+               run_timed(lambda i: core.storage.save(filename, records), args.repeat, args.memory))
+
+    product_store, customer_store, order_store = core.product_store, core.customer_store, core.order_store
+    product_ids, customer_ids, order_ids = product_store.ids(), customer_store.ids(), order_store.ids()
+    report('get product', run_timed(lambda i: product_store.get(rng.choice(product_ids)), args.lookups, False))
+    report('get customer', run_timed(lambda i: customer_store.get(rng.choice(customer_ids)), args.lookups, False))
+    report('orders for customer',
+           run_timed(lambda i: order_store.for_customer(rng.choice(customer_ids)), args.lookups, False))
+    report('customer search index', run_timed(lambda i: core.customer_search.rebuild(), args.repeat, args.memory))
+
+    # Function to search by a street, a misspelled email or the start of a mobile number, in turn
+    def search(i):
+        customer = customer_store.get(rng.choice(customer_ids))
+        query = [customer['address'], customer['email'].replace('tom', 'otm'), customer['mobile'][:6]][i % 3]
+        core.customer_search.search(query)
+    report('customer search', run_timed(search, args.lookups, False))
+    report('update_order', run_timed(
+        lambda i: core.update_order(rng.choice(order_ids), rng.choice(product_ids), 1), args.operations, args.memory))
+
+    # View Orders: revenue aggregates built from scratch, then the tables the page shows
+    def aggregate(i):
+        analytics = OrderAnalytics(order_store)
+        order_store.listeners.remove(analytics.on_change)
+        analytics.revenue_by_customer()
+        analytics.revenue_by_product()
+        analytics.revenue_by_period()
+    report('view orders aggregation', run_timed(aggregate, args.repeat, args.memory))
+
+    def invoice(i):
+        order = order_store.get(order_ids[i % len(order_ids)])
+        generate_invoice(order, customer_store.get(order['customer_id']), product_store)
+    report('generate_invoice', run_timed(invoice, args.operations, args.memory))
+
+    for export_format in args.export_formats:
+        def export(i):
+            with export_rows(order_rows(order_store.records, product_store), ORDER_COLUMNS, export_format):
+                pass
+        try:
+            report(f'download_orders {export_format}', run_timed(export, args.repeat, args.memory))
+        except RuntimeError as e:
+            print(f'  download_orders {export_format}: skipped ({e})')
+
+    # Deletes go last; each run removes different records
+    deletable_orders = rng.sample(order_ids, min(args.operations + 1, len(order_ids)))
+    report('delete_order', run_timed(lambda i: core.delete_order(deletable_orders[i]),
+                                     len(deletable_orders) - 1, args.memory))
+    deletable_customers = rng.sample(customer_ids, min(args.operations + 1, len(customer_ids)))
+    report('delete_customer', run_timed(lambda i: core.delete_customer(deletable_customers[i]),
+                                        len(deletable_customers) - 1, args.memory))
+    deletable_products = rng.sample(product_ids, min(args.operations + 1, len(product_ids)))
+    report('delete_product', run_timed(lambda i: core.delete_product(deletable_products[i]),
+                                       len(deletable_products) - 1, args.memory))
+    return results
+
+
+# Function to get the current git commit, so results can be matched to a version
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args):
+    report = {
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'commit': git_commit(),
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'storage': args.storage,
+        'sizes': {},
+    }
+    # The modules under test are imported relative to this file, while the data lives in a scratch directory
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    home = os.getcwd()
+    for size in args.sizes:
+        print(f'Size {size} ({args.storage} storage)')
+        directory = tempfile.mkdtemp(prefix=f'orderm-bench-{size}-')
+        os.chdir(directory)
+        try:
+            report['sizes'][str(size)] = bench_size(size, args)
+        finally:
+            os.chdir(home)
+            shutil.rmtree(directory, ignore_errors=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=4)
+        print(f'Results written to {args.output}')
+    return report
+
+
+# Function to tell whether every size started within the startup target
+def startup_ok(report):
+    return all(operations['cold start']['within_target'] for operations in report['sizes'].values())
+
+
+# Function to print how every operation moved between two result files; returns the regressions
+def compare(baseline_path, current_path, threshold=0.1):
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    with open(current_path) as f:
+        current = json.load(f)
+    print(f'{baseline_path} ({baseline.get("commit")}) -> {current_path} ({current.get("commit")})')
+    regressions = []
+    for size, operations in current['sizes'].items():
+        before_operations = baseline['sizes'].get(size, {})
+        for name, stats in operations.items():
+            before = before_operations.get(name)
+            if not before:
+                continue
+            change = stats['p50_ms'] / before['p50_ms'] - 1 if before['p50_ms'] else 0.0
+            flag = ''
+            # Differences of a few microseconds are timer noise
+            if change > threshold and stats['p50_ms'] - before['p50_ms'] > 0.01:
+                flag = '  REGRESSION'
+                regressions.append((size, name, change))
+            print(f'{size:>9} {name:<32} p50 {before["p50_ms"]:>10.3f} -> {stats["p50_ms"]:>10.3f} ms '
+                  f'({change * 100:+6.1f}%){flag}')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the order management hot paths')
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES, help='order lines per dataset')
+    parser.add_argument('--storage', choices=list(STORAGE_ENV), default='json', help='storage backend')
+    parser.add_argument('--repeat', type=int, default=3, help='runs of whole-dataset operations')
+    parser.add_argument('--operations', type=int, default=20, help='calls of each single-record write and render')
+    parser.add_argument('--lookups', type=int, default=10000, help='calls of each index lookup')
+    parser.add_argument('--export-formats', nargs='*', default=['csv', 'xlsx'], help='download_orders formats')
+    parser.add_argument('--no-memory', dest='memory', action='store_false', help='skip peak memory measurement')
+    parser.add_argument('--output', help='JSON file receiving the results')
+    parser.add_argument('--compare', nargs=2, metavar=('BASELINE', 'CURRENT'), help='compare two result files')
+    parser.add_argument('--threshold', type=float, default=0.1, help='p50 slowdown reported as a regression')
+    parser.add_argument('--startup-target', type=float, default=STARTUP_TARGET,
+                        help='cold start p50 limit in seconds; the run exits non-zero above it')
+    args = parser.parse_args()
+
+    if args.compare:
+        regressions = compare(*args.compare, args.threshold)
+        sys.exit(1 if regressions else 0)
+    if not startup_ok(run(args)):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+import argparse
+import json
+import os
+from Export import (PRODUCT_COLUMNS, CUSTOMER_COLUMNS, ORDER_COLUMNS, customer_rows, order_rows, product_rows,
+                    write_export)
+from Ingest import xlsx_rows
+from Journal import atomic_write
+from Records import record_json, to_records
+from Storage import dataset_of, read_arrow, write_arrow
+
+# Round-trip converters between the JSON data files, the Arrow snapshots of ORDERM_STORAGE=arrow and the
+# Excel downloads (products.xlsx, customers.xlsx, orders.xlsx), picked by file extension:
+#   python Convert.py orders.json orders.arrow
+#   python Convert.py orders.arrow orders.xlsx [--products products.arrow]
+#   python Convert.py customers.xlsx customers.json
+# The dataset comes from the file name (or --dataset). Excel files only hold the exported columns, so
+# timestamps, versions and extra fields do not survive a trip through them.
+
+CONVERT_FORMATS = ['json', 'arrow', 'xlsx']
+
+
+# Function to get the format of a file from its extension
+def file_format(path):
+    fmt = os.path.splitext(path)[1].lower().lstrip('.')
+    if fmt not in CONVERT_FORMATS:
+        raise ValueError(f'Unsupported file {path}: expected one of {", ".join(CONVERT_FORMATS)}')
+    return fmt
+
+
+def _text(value):
+    return None if value is None else str(value)
+
+
+# Function to rebuild records from the rows of an Excel download
+def xlsx_records(dataset, path):
+    with open(path, 'rb') as f:
+        rows = [row for _, row in xlsx_rows(f)]
+    if dataset == 'products':
+        return [{'id': _text(row.get('id')), 'name': _text(row.get('name')), 'price': row.get('price'),
+                 'quantity': row.get('quantity')} for row in rows]
+    if dataset == 'customers':
+        return [{column: _text(row.get(column)) for column in CUSTOMER_COLUMNS} for row in rows]
+    # One row per order line; the rows of an order share its Order ID
+    orders = {}
+    for row in rows:
+        order_id = _text(row.get('Order ID'))
+        order = orders.setdefault(order_id, {'order_id': order_id, 'customer_id': _text(row.get('Customer ID')),
+                                             'products': [], 'total_amount': row.get('Total Amount')})
+        if row.get('Product ID') is not None:
+            order['products'].append({'product_id': _text(row.get('Product ID')),
+                                      'quantity': row.get('Product Quantity'), 'price': row.get('Product Price')})
+    return list(orders.values())
+
+
+# Function to read the records of a data file in any of the formats
+def read_records(dataset, path):
+    fmt = file_format(path)
+    if fmt == 'json':
+        with open(path, 'r') as f:
+            return json.load(f)
+    if fmt == 'arrow':
+        return read_arrow(path, f'{dataset}.json')
+    return xlsx_records(dataset, path)
+
+
+# Function to write records in any of the formats; order downloads take product names from products
+def write_records(dataset, records, path, products=()):
+    fmt = file_format(path)
+    if fmt == 'json':
+        atomic_write(path, json.dumps(records, indent=4, default=record_json))
+    elif fmt == 'arrow':
+        write_arrow(path, f'{dataset}.json', records)
+    elif dataset == 'products':
+        with open(path, 'wb') as out:
+            write_export(product_rows(records), PRODUCT_COLUMNS, 'xlsx', out)
+    elif dataset == 'customers':
+        with open(path, 'wb') as out:
+            write_export(customer_rows(records), CUSTOMER_COLUMNS, 'xlsx', out)
+    else:
+        product_names = {str(product['id']): product for product in products}
+        with open(path, 'wb') as out:
+            write_export(order_rows(records, product_names), ORDER_COLUMNS, 'xlsx', out)
+
+
+# Function to convert one data file to another format; returns the number of records converted
+def convert(source, target, dataset=None, products_path=None):
+    dataset = dataset or dataset_of(source)
+    records = to_records(f'{dataset}.json', read_records(dataset, source))
+    products = ()
+    if dataset == 'orders' and file_format(target) == 'xlsx' and products_path and os.path.exists(products_path):
+        products = read_records('products', products_path)
+    write_records(dataset, records, target, products)
+    return len(records)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Convert data files between JSON, Arrow and Excel')
+    parser.add_argument('source', help='file to convert (.json, .arrow or .xlsx)')
+    parser.add_argument('target', help='file to write (.json, .arrow or .xlsx)')
+    parser.add_argument('--dataset', choices=['products', 'customers', 'orders'],
+                        help='dataset of the files (default: from the source file name)')
+    parser.add_argument('--products', default='products.json',
+                        help='products file naming the order lines of an orders.xlsx (any format)')
+    args = parser.parse_args()
+
+    try:
+        converted = convert(args.source, args.target, args.dataset, args.products)
+    except ValueError as e:
+        parser.error(str(e))
+    print(f'{converted} records converted from {args.source} to {args.target}')
+
+
+if __name__ == '__main__':
+    main()
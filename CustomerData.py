@@ -1,342 +1,234 @@
 import streamlit as st
-import json
-import os
-import pandas as pd
-import base64
-import uuid
-from reportlab.lib.pagesizes import letter
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer, Image
-from reportlab.lib import colors
-from reportlab.pdfgen import canvas
-from reportlab.lib.pagesizes import A4
-from datetime import datetime
-from reportlab.lib.styles import getSampleStyleSheet,ParagraphStyle
-from io import BytesIO
-
-
-# Function to load data from JSON file
-def load_data(filename, default_data):
-    if not os.path.exists(filename):
-        with open(filename, 'w') as f:
-            json.dump(default_data, f, indent=4)
-        return default_data
-    with open(filename, 'r') as f:
-        data = json.load(f)
-    return data
-
-
-# Define default data
-default_products = []
-default_customers = []
-default_orders = []
-
-# Load initial data
-products = load_data('products.json', default_products)
-customers = load_data('customers.json', default_customers)
-orders = load_data('orders.json', default_orders)
-
-
-# Function to save data to JSON file
-def save_data(data, filename):
-    with open(filename, 'w') as f:
-        json.dump(data, f, indent=4)
-
-
-# Function to add a new product
-def add_product(product_id, name, price, quantity):
-    new_product = {
-        'id': product_id,
-        'name': name,
-        'price': price,
-        'quantity': quantity
-    }
-    products.append(new_product)
-    save_data(products, 'products.json')
-
-
-# Function to update an existing product
-def update_product(product_id, name, price, quantity):
-    for product in products:
-        if 'id' in product and str(product['id']) == product_id:
-            product['name'] = name
-            product['price'] = price
-            product['quantity'] = quantity
-            save_data(products, 'products.json')
-            return True
-    return False
-
-
-# Function to delete a product
-def delete_product(product_id):
-    for idx, product in enumerate(products):
-        if 'id' in product and str(product['id']) == product_id:
-            del products[idx]
-            save_data(products, 'products.json')
-            return True
-    return False
-
-
-# Function to add a new customer
-def add_customer(name, address, mobile, email):
-    customer_id = str(uuid.uuid4())[:4]  # Generate a short UUID
-    new_customer = {
-        'id': customer_id,
-        'name': name,
-        'address': address,
-        'mobile': mobile,
-        'email': email
-    }
-    customers.append(new_customer)
-    save_data(customers, 'customers.json')
-
-
-# Function to update an existing customer
-def update_customer(customer_id, name, address, mobile, email):
-    for customer in customers:
-        if 'id' in customer and str(customer['id']) == str(customer_id):  # Check if 'id' key exists
-            # Update customer details
-            customer['name'] = name
-            customer['address'] = address
-            customer['mobile'] = mobile
-            customer['email'] = email
-            # Save updated data to JSON file
-            save_data(customers, 'customers.json')
-            return True
-    return False
-
-
-# Function to delete a customer
-def delete_customer(customer_id):
-    for idx, customer in enumerate(customers):
-        if 'id' in customer and str(customer['id']) == str(customer_id):  # Check if 'id' key exists
-            del customers[idx]
-            save_data(customers, 'customers.json')
-            return True
-    return False
-
-
-# Function to add a new order
-def add_order(customer_id):
-    order_id = str(uuid.uuid4())[:4]  # Generate a short UUID
-    new_order = {
-        'order_id': order_id,
-        'customer_id': customer_id,
-        'products': [],
-        'total_amount': 0.0
-    }
-    orders.append(new_order)
-    save_data(orders, 'orders.json')
-    return new_order
-
-
-# Function to update an existing order
-def update_order(order_id, product_id, quantity):
-    for order in orders:
-        if order['order_id'] == order_id:
-            for product in products:
-                if product['id'] == product_id:
-                    order['products'].append({'product_id': product_id, 'name': product['name'], 'quantity': quantity,
-                                              'price': product['price']})
-                    order['total_amount'] += quantity * product['price']
-                    save_data(orders, 'orders.json')
-                    return True
-    return False
-
-
-# Function to delete an order
-def delete_order(order_id):
-    for idx, order in enumerate(orders):
-        if order['order_id'] == order_id:
-            del orders[idx]
-            save_data(orders, 'orders.json')
-            return True
-    return False
-
-
-# Function to download products as Excel file
+from DataStore import VersionConflict
+from OrderCore import get_core
+from InvoiceCache import invoice_cache
+from Ingest import IMPORT_FORMATS, import_format, read_rows, order_specs
+from Inventory import OutOfStock
+from Jobs import JobLimit, QUEUED, RUNNING, DONE, FAILED
+from Metrics import metrics, timed
+from Settings import (IMPORT_BATCH_SIZE, LOW_STOCK_THRESHOLD, JOB_INLINE_RECORDS, JOB_POLL_SECONDS, JOB_RESULT_TTL,
+                      CUSTOMER_SEARCH_RESULTS)
+from Export import (EXPORT_FORMATS, EXPORT_MIME_TYPES, PRODUCT_COLUMNS, CUSTOMER_COLUMNS, ORDER_COLUMNS, export_rows,
+                    product_rows, customer_rows, order_rows)
+
+
+# Data and CRUD live in the headless core, shared across reruns and sessions; this script is only the UI
+core = get_core()
+dataset_cache = core.dataset_cache
+
+# Load initial data, with id indexes built over it
+product_store = core.product_store
+customer_store = core.customer_store
+order_store = core.order_store
+products = product_store.records
+customers = customer_store.records
+orders = order_store.records
+
+
+# Function to build a table; pandas is only imported once a page shows one
+def data_frame(*args, **kwargs):
+    import pandas as pd
+
+    return pd.DataFrame(*args, **kwargs)
+
+
+# Function to get the owner of this browser's background jobs; it is kept in the URL (?user=) across reloads
+def job_owner():
+    owner = st.query_params.get('user')
+    if not owner:
+        owner = st.session_state.setdefault('job_owner', core.id_generator.new_id())
+        st.query_params['user'] = owner
+    return owner
+
+
+# Function to queue a background job and point the user to the Jobs page
+def submit_job(kind, params, label):
+    try:
+        job_id = core.jobs.submit(kind, params, job_owner())
+    except (JobLimit, ValueError) as e:
+        st.warning(str(e))
+    else:
+        st.success(f'{label} queued as job {job_id}; follow its progress and download it from the Jobs page.')
+
+
+# Function to offer a dataset as a downloadable Excel, CSV or Parquet file; large datasets are exported
+# by a background job instead of inside this script run
+def offer_download(label, basename, rows, columns, record_count):
+    export_format = st.selectbox('File Format', EXPORT_FORMATS, key=f'{basename}_export_format')
+    if record_count > JOB_INLINE_RECORDS:
+        st.caption(f'{record_count} records are exported in the background.')
+        if st.button(f'Export {label}'):
+            submit_job('export', {'dataset': basename, 'format': export_format}, f'{label} export')
+        return
+    if st.button(f'Export {label}'):
+        try:
+            with export_rows(rows, columns, export_format) as exported:
+                data = exported.read()
+        except RuntimeError as e:
+            st.warning(str(e))
+            return
+        st.success(f'{label} data exported successfully!')
+        st.download_button(
+            label=f'Download {label} File',
+            data=data,
+            file_name=f'{basename}.{export_format}',
+            mime=EXPORT_MIME_TYPES[export_format]
+        )
+
+
+# Function to download products
 def download_products():
-    df = pd.DataFrame(products)
-    df['Total Price'] = df['price'] * df['quantity']  # Calculate total price for each product
-    df.to_excel('products.xlsx', index=False)
-    st.success('Products data downloaded successfully!')
-    # Provide a download link for the Excel file
-    st.markdown(get_download_link('products.xlsx', 'Download Products Excel File'), unsafe_allow_html=True)
+    offer_download('Products', 'products', product_rows(products), PRODUCT_COLUMNS, len(products))
 
 
-# Function to download customers as Excel file
+# Function to download customers
 def download_customers():
-    df = pd.DataFrame(customers)
-    df.to_excel('customers.xlsx', index=False)
-    st.success('Customers data downloaded successfully!')
-    # Provide a download link for the Excel file
-    st.markdown(get_download_link('customers.xlsx', 'Download Customers Excel File'), unsafe_allow_html=True)
+    offer_download('Customers', 'customers', customer_rows(customers), CUSTOMER_COLUMNS, len(customers))
 
 
-# Function to download orders as Excel file
+# Function to download orders, one row per order line, archived orders included
 def download_orders():
+    offer_download('Orders', 'orders', order_rows(core.order_history(), product_store), ORDER_COLUMNS,
+                   core.order_count())
+
+
+# Function to remember a record's version when its edit form is first shown, for compare-and-swap on save
+def edit_version(kind, record_id, record):
+    version_key = f'{kind}_version_{record_id}'
+    if record is not None and version_key not in st.session_state:
+        st.session_state[version_key] = record.get('version', 0)
+    return st.session_state.get(version_key)
+
+
+# Function to forget a remembered version once the edit is saved or rejected
+def clear_edit_version(kind, record_id):
+    st.session_state.pop(f'{kind}_version_{record_id}', None)
+
+
+PAGE_SIZES = [10, 25, 50, 100]
+
+
+# Function to fetch only the requested page through run_query(offset, limit) and show it with page controls
+def show_page(key, run_query, to_frame, empty_text):
+    page_size = st.selectbox('Rows per Page', PAGE_SIZES, key=f'{key}_page_size')
+    page = st.session_state.get(f'{key}_page', 1)
+    with timed(f'view {key}'):
+        records, total = run_query((page - 1) * page_size, page_size)
+        pages = max(1, -(-total // page_size))
+        if page > pages:
+            # The filters changed and the old page no longer exists
+            page = pages
+            records, total = run_query((page - 1) * page_size, page_size)
+        frame = to_frame(records) if records else None
+    st.session_state[f'{key}_page'] = page
+    if records:
+        st.dataframe(frame, hide_index=True, use_container_width=True)
+    else:
+        st.write(empty_text)
+    st.number_input(f'Page (of {pages}, {total} records)', min_value=1, max_value=pages, key=f'{key}_page')
+
+
+# Function to build the products table, with the total price of each product
+def product_table(records):
+    product_df = data_frame(records, columns=['id', 'name', 'quantity', 'price'])
+    product_df['Total Price'] = product_df['price'] * product_df['quantity']  # Calculate total price
+    return product_df
+
+
+# Function to build the customers table
+def customer_table(records):
+    return data_frame(records, columns=['id', 'name', 'address', 'mobile', 'email'])
+
+
+# Function to describe a customer in one line
+def customer_label(customer):
+    if customer is None:
+        return ''
+    details = ' · '.join(str(customer.get(field)) for field in ('mobile', 'email') if customer.get(field))
+    return f'{customer.get("name", "")} ({customer["id"]})' + (f' · {details}' if details else '')
+
+
+# Function to pick a customer by searching their name, mobile, email, address or id; returns the id or None
+def customer_picker(label, key):
+    query = st.text_input(f'Search {label} by name, mobile, email or address', key=f'{key}_search')
+    if not query.strip():
+        return None
+    matches = core.customer_search.search(query, CUSTOMER_SEARCH_RESULTS)
+    if not matches:
+        st.warning('No matching customers found!')
+        return None
+    return st.selectbox(label, [customer['id'] for customer, _ in matches], key=f'{key}_select',
+                        format_func=lambda customer_id: customer_label(customer_store.get(customer_id)))
+
+
+# Function to build the order lines table of some orders
+def order_lines_table(records):
     order_data = []
-    for order in orders:
+    for order in records:
         for product in order['products']:
+            product_info = product_store.get(product['product_id'])
+            product_name = product_info.get('name', 'N/A') if product_info else 'N/A'
+
             order_data.append({
                 'Order ID': order['order_id'],
                 'Customer ID': order['customer_id'],
                 'Product ID': product['product_id'],
-                'Product Name': product['name'],
+                'Product Name': product_name,
                 'Product Quantity': product['quantity'],
-                'Product Price': product['price'],
-                'Total Amount': order['total_amount']
+                'Product Price': format(product['price'], '.2f').rstrip('0').rstrip('.')
             })
-    df = pd.DataFrame(order_data)
-    df.to_excel('orders.xlsx', index=False)
-    st.success('Orders data downloaded successfully!')
-    # Provide a download link for the Excel file
-    st.markdown(get_download_link('orders.xlsx', 'Download Orders Excel File'), unsafe_allow_html=True)
-
-
-# Function to generate a download link for a file
-def get_download_link(file_path, link_text):
-    with open(file_path, 'rb') as f:
-        data = f.read()
-    b64_data = base64.b64encode(data).decode('utf-8')
-    href = f'<a href="data:application/octet-stream;base64,{b64_data}" download="{file_path}">{link_text}</a>'
-    return href
-
-
-def generate_invoice(order, customer, products):
-    buffer = BytesIO()
-    doc = SimpleDocTemplate(buffer, pagesize=A4)
-    styles = getSampleStyleSheet()
-
-    # Define custom styles
-    style_heading = ParagraphStyle(
-        name='Heading1',
-        parent=styles['Heading1'],
-        alignment=1,  # Center alignment for heading
-        fontSize=20,
-        leading=22,
-        spaceAfter=20,
-        textColor=colors.darkblue
-    )
-
-    style_subheading = ParagraphStyle(
-        name='SubHeading',
-        parent=styles['Heading2'],
-        fontSize=14,
-        textColor=colors.darkblue
-    )
-
-    style_body = ParagraphStyle(
-        name='Normal',
-        parent=styles['Normal'],
-        alignment=0,  # Left alignment for body text
-        fontSize=12,
-        leading=14
-    )
-
-    style_customer_info = ParagraphStyle(
-        name='CustomerInfo',
-        parent=styles['Normal'],
-        fontSize=12,
-        leading=18,
-        spaceAfter=20
-    )
-
-    style_table_header = ParagraphStyle(
-        name='TableHeader',
-        parent=styles['Normal'],
-        fontSize=12,
-        leading=14,
-        textColor=colors.white
-    )
-
-
-    # Heading
-    heading_text = "<b>INVOICE</b>"
-    heading = Paragraph(heading_text, style_heading)
-
-    # Company information
-    company_name = Paragraph("<b>RevivingIndia</b>", style_subheading)
-    company_address = "123 Street, City, Country, Zip Code"
-    company_contact = "Phone: (000) 000-0000"
-    company_address_para = Paragraph(company_address, style_body)
-    company_contact_para = Paragraph(company_contact, style_body)
-
-
-    # Current date
-    current_date = datetime.now().strftime('%d-%m-%Y')
-
-    # Customer information
-    customer_info = f"""
-        <b>Customer Name:</b> {customer.get('name', 'N/A')}<br/>
-        <b>Customer ID:</b> {customer['id']}<br/>
-        <b>Order ID:</b> {order['order_id']}<br/>
-        <b>Date:</b> {current_date}
-    """
-    customer_info_para = Paragraph(customer_info, style_customer_info)
-
-    # Table data
-    data = [
-        [Paragraph("DESCRIPTION", style_table_header), Paragraph("QTY", style_table_header),
-         Paragraph("UNIT PRICE", style_table_header), Paragraph("AMOUNT", style_table_header)]
-    ]
-    for product in order['products']:
-        product_info = next((p for p in products if p['id'] == product['product_id']), None)
-        product_name = product_info.get('name', 'N/A') if product_info else 'N/A'
-        qty = product['quantity']
-        unit_price = product['price']
-        amount = qty * unit_price
-        data.append([product_name, qty, f" {unit_price:.2f}", f" {amount:.2f}"])
-
-    # Subtotals and totals
-    subtotal = sum(p['price'] * p['quantity'] for p in order['products'])
-    tax_rate = 0.0425  # Example tax rate
-    tax_amount = subtotal * tax_rate
-    total_amount = subtotal + tax_amount
-
-    data.append(["", "", "Subtotal", f" {subtotal:.2f}"])
-    data.append(["", "", "Tax Rate", f"{tax_rate * 100:.2f}%"])
-    data.append(["", "", "Tax", f" {tax_amount:.2f}"])
-    data.append(["", "", "Total", f" {total_amount:.2f}"])
-
-    # Table
-    table = Table(data, hAlign='LEFT', colWidths=[200, 50, 100, 100])
-    table.setStyle(TableStyle([
-        ('BACKGROUND', (0, 0), (-1, 0), colors.darkblue),
-        ('TEXTCOLOR', (0, 0), (-1, 0), colors.white),
-        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-        ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
-        ('INNERGRID', (0, 0), (-1, -1), 0.25, colors.black),
-        ('BOX', (0, 0), (-1, -1), 0.25, colors.black),
-        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-        ('FONTNAME', (0, 1), (-1, -1), 'Helvetica'),
-        ('BACKGROUND', (-1, -1), (-1, -1), colors.lightblue),
-    ]))
-
-    # Build story
-    elements = [
-        heading,
-        # logo,
-        Spacer(1, 12),
-        company_name,
-        company_address_para,
-        company_contact_para,
-        Spacer(1, 24),
-
-        Spacer(1, 12),
-        customer_info_para,
-        Spacer(1, 12),
-        table
-    ]
-
-    doc.build(elements)
-
-    buffer.seek(0)
-    return buffer
+    return data_frame(order_data)
+
+# Function to describe what a job produces
+def job_label(job):
+    params = job['params']
+    if job['kind'] == 'export':
+        return f'{params["dataset"].capitalize()} export ({params["format"]})'
+    selected = f'{len(params["order_ids"])} orders' if params.get('order_ids') else 'all orders'
+    if params.get('since') or params.get('until'):
+        selected += f' created {params.get("since") or "..."} to {params.get("until") or "..."}'
+    return f'Invoices for {selected} ({params.get("format", "zip")})'
+
+
+# Function to list this user's jobs with their progress, results and cancel buttons
+def show_jobs():
+    jobs = core.jobs.list(job_owner())
+    if not jobs:
+        st.write('No jobs yet.')
+        return
+    for job in jobs:
+        with st.container(border=True):
+            st.write(f'**{job_label(job)}** - {job["status"]}')
+            if job['status'] in (QUEUED, RUNNING):
+                done = f'{job["done"]} of {job["total"]}' if job['total'] is not None else 'waiting'
+                st.progress(job['progress'], text=done)
+                if st.button('Cancel', key=f'cancel_job_{job["id"]}'):
+                    core.jobs.cancel(job['id'], job_owner())
+            elif job['status'] == DONE:
+                st.caption(job['message'])
+                result = core.jobs.result(job['id'])
+                if result is not None:
+                    path, file_name, mime = result
+                    with open(path, 'rb') as f:
+                        st.download_button(label=f'Download {file_name}', data=f.read(), file_name=file_name,
+                                           mime=mime, key=f'download_job_{job["id"]}')
+            elif job['status'] == FAILED:
+                st.warning(job['message'])
+
+
+# Refresh only the job list while the Jobs page is open, where this Streamlit version has fragments
+job_fragment = getattr(st, 'fragment', None) or getattr(st, 'experimental_fragment', None)
+if job_fragment is not None:
+    show_jobs = job_fragment(run_every=JOB_POLL_SECONDS)(show_jobs)
 
 # Streamlit UI
 st.title('Product, Customer, and Order Management')
 
-menu = st.sidebar.selectbox('Menu', [ 'Home','Customers','Products','Orders' ])
+# The Admin page is only listed when the app is opened with ?admin=1
+menu = st.sidebar.selectbox('Menu', [ 'Home','Customers','Products','Orders','Jobs' ] +
+                            (['Admin'] if st.query_params.get('admin') == '1' else []))
+st.sidebar.caption(f'Data cache: {dataset_cache.hits} hits / {dataset_cache.misses} misses '
+                   f'(generation {dataset_cache.generation})')
 
 if menu == 'Home':
     st.subheader('Home')
@@ -345,21 +237,30 @@ if menu == 'Home':
 if menu == 'Products':
     st.sidebar.subheader('Manage Products')
     action = st.sidebar.selectbox('Select Action',
-                          ['View Products', 'Add Product', 'Update Product', 'Delete Product', 'Download Products'])
+                          ['View Products', 'Low Stock', 'Add Product', 'Update Product', 'Delete Product',
+                           'Download Products'])
 
     if action == 'View Products':
-        # Display products
-        st.subheader('Latest Products (Newest 5)')
-        latest_products = products[-5:]  # Get the latest 5 products
-        if len(latest_products) > 0:
-            product_df = pd.DataFrame(latest_products)
-            product_df['Total Price'] = product_df['price'] * product_df['quantity']  # Calculate total price
-            product_df = product_df[['id', 'name', 'quantity', 'price', 'Total Price']]  # Reorder columns
-            st.table(
-                product_df.style.set_properties(**{'border': '1px solid black', 'border-collapse': 'collapse'}).format(
-                    {'price': '{:.0f}', 'Total Price': '{:.0f}', 'quantity': '{:.0f}'}))
-        else:
-            st.write('No products available.')
+        # Display products, one page at a time
+        st.subheader('Products')
+        col1, col2 = st.columns(2)
+        name_prefix = col1.text_input('Search by Name')
+        id_prefix = col2.text_input('Search by Product ID')
+        col1, col2, col3 = st.columns(3)
+        min_price = col1.number_input('Min Price', min_value=0.0)
+        max_price = col2.number_input('Max Price (0 for no limit)', min_value=0.0)
+        sort_by = col3.selectbox('Sort By', ['Newest', 'name', 'price'])
+        show_page('products', lambda offset, limit: product_store.query(
+            prefixes={'name': name_prefix.strip(), 'id': id_prefix.strip()},
+            ranges={'price': (min_price or None, max_price or None)},
+            sort_by=None if sort_by == 'Newest' else sort_by, descending=sort_by == 'Newest',
+            offset=offset, limit=limit), product_table, 'No products available.')
+    elif action == 'Low Stock':
+        # Products running out, lowest stock first
+        st.subheader('Low Stock')
+        threshold = st.number_input('Show Products with Stock at or below', min_value=0, value=LOW_STOCK_THRESHOLD)
+        show_page('low_stock', lambda offset, limit: core.low_stock(threshold, offset, limit), product_table,
+                  'No products are low on stock.')
     elif action == 'Add Product':
         # Add product
         st.subheader('Add Product')
@@ -368,49 +269,64 @@ if menu == 'Products':
         price = st.number_input('Enter Product Price', min_value=0.0)
         quantity = st.number_input('Enter Product Quantity', min_value=1)
         if st.button('Add Product'):
-            add_product(product_id, name, price, quantity)
+            core.add_product(product_id, name, price, quantity)
             st.success('Product Added Successfully!')
     elif action == 'Update Product':
         # Update product
         st.subheader('Update Product')
         product_id = st.text_input('Enter Product ID to Update')
         if product_id:
+            version = edit_version('product', product_id, product_store.get(product_id))
             name = st.text_input('Enter New Name')
             price = st.number_input('Enter New Price', min_value=0.0)
             quantity = st.number_input('Enter New Quantity', min_value=1)
             if st.button('Update Product'):
-                if update_product(str(product_id), name, price, quantity):
-                    st.success('Product Updated Successfully!')
-                else:
-                    st.warning('Product ID not found!')
+                try:
+                    if core.update_product(str(product_id), name, price, quantity, version):
+                        st.success('Product Updated Successfully!')
+                    else:
+                        st.warning('Product ID not found!')
+                except VersionConflict:
+                    st.warning('Product was changed by someone else in the meantime, please try again!')
+                clear_edit_version('product', product_id)
     elif action == 'Delete Product':
         # Delete product
         st.subheader('Delete Product')
         product_id = st.text_input('Enter Product ID to Delete')
         if product_id:
-            if delete_product(product_id):
+            if core.delete_product(product_id):
                 st.success('Product Deleted Successfully!')
             else:
                 st.warning('Product ID not found!')
     elif action == 'Download Products':
-        # Download products as Excel file
+        # Download products as Excel, CSV or Parquet file
         download_products()
 
 
 if menu == 'Customers':
     st.subheader('Manage Customers')
     action = st.selectbox('Select Action', ['View Customers', 'Add Customer', 'Update Customer', 'Delete Customer',
-                                            'Download Customers'])
+                                            'Duplicate Customers', 'Download Customers'])
 
     if action == 'View Customers':
-        # Display customers
-        st.subheader('Latest Customers (Newest 5)')
-        latest_customers = customers[-5:]  # Get the latest 5 customers
-        if len(latest_customers) > 0:
-            customer_df = pd.DataFrame(latest_customers)
-            st.table(customer_df.style.set_properties(**{'border': '1px solid black', 'border-collapse': 'collapse'}))
-        else:
-            st.write('No customers available.')
+        # Display customers, one page at a time, or the best matches of a search
+        st.subheader('Customers')
+        query = st.text_input('Search by name, mobile, email or address (typos allowed)')
+        if query.strip():
+            matches = core.customer_search.search(query, CUSTOMER_SEARCH_RESULTS)
+            if matches:
+                st.dataframe(customer_table([customer for customer, _ in matches]), hide_index=True,
+                             use_container_width=True)
+            else:
+                st.write('No matching customers found.')
+        col1, col2, col3 = st.columns(3)
+        name_prefix = col1.text_input('Search by Name')
+        id_prefix = col2.text_input('Search by Customer ID')
+        sort_by = col3.selectbox('Sort By', ['Newest', 'name'])
+        show_page('customers', lambda offset, limit: customer_store.query(
+            prefixes={'name': name_prefix.strip(), 'id': id_prefix.strip()},
+            sort_by=None if sort_by == 'Newest' else sort_by, descending=sort_by == 'Newest',
+            offset=offset, limit=limit), customer_table, 'No customers available.')
     elif action == 'Add Customer':
         # Add customer
         st.subheader('Add Customer')
@@ -419,46 +335,62 @@ if menu == 'Customers':
         mobile = st.text_input('Enter Customer Mobile')
         email = st.text_input('Enter Customer Email')
         if st.button('Add Customer'):
-            add_customer(name, address, mobile, email)
+            core.add_customer(name, address, mobile, email)
             st.success('Customer Added Successfully!')
     elif action == 'Update Customer':
         # Update customer
         st.subheader('Update Customer')
-        customer_id = st.text_input('Enter Customer ID to Update')
+        customer_id = customer_picker('Customer to Update', 'update_customer')
         if customer_id:
+            version = edit_version('customer', customer_id, customer_store.get(customer_id))
             name = st.text_input('Enter New Name')
             address = st.text_input('Enter New Address')
             mobile = st.text_input('Enter New Mobile')
             email = st.text_input('Enter New Email')
             if st.button('Update Customer'):
-                if update_customer(customer_id, name, address, mobile, email):
-                    st.success('Customer Updated Successfully!')
-                else:
-                    st.warning('Customer ID not found!')
+                try:
+                    if core.update_customer(customer_id, name, address, mobile, email, version):
+                        st.success('Customer Updated Successfully!')
+                    else:
+                        st.warning('Customer ID not found!')
+                except VersionConflict:
+                    st.warning('Customer was changed by someone else in the meantime, please try again!')
+                clear_edit_version('customer', customer_id)
     elif action == 'Delete Customer':
         # Delete customer
         st.subheader('Delete Customer')
-        customer_id = st.text_input('Enter Customer ID to Delete')
-        if customer_id:
-            if delete_customer(customer_id):
+        customer_id = customer_picker('Customer to Delete', 'delete_customer')
+        if customer_id and st.button('Delete Customer'):
+            if core.delete_customer(customer_id):
                 st.success('Customer Deleted Successfully!')
             else:
                 st.warning('Customer ID not found!')
+    elif action == 'Duplicate Customers':
+        # Customers that are probably entered more than once
+        st.subheader('Duplicate Customers')
+        st.caption('Customers sharing an email or mobile number, or with the same name at a similar address.')
+        groups = core.customer_search.duplicates()
+        if not groups:
+            st.write('No duplicate customers found.')
+        for group in groups:
+            st.write(f'Same {", ".join(group["reasons"])}:')
+            st.dataframe(customer_table(group['customers']), hide_index=True, use_container_width=True)
     elif action == 'Download Customers':
-        # Download customers as Excel file
+        # Download customers as Excel, CSV or Parquet file
         download_customers()
 
 if menu == 'Orders':
     st.subheader('Manage Orders')
     action = st.selectbox('Select Action',
-                          ['View Orders', 'Add Order', 'Update Order', 'Delete Order', 'Download Orders'])
+                          ['View Orders', 'Add Order', 'Update Order', 'Delete Order', 'Download Orders',
+                           'Batch Invoices', 'Import Orders'])
 
     if action == 'View Orders':
         customer_id_filter = st.text_input("Enter Customer ID to filter (leave blank to show all)")
         order_id_filter = st.text_input("Enter Order ID to generate bill")
 
         if st.button("Generate Bill"):
-            order_to_bill = next((o for o in orders if o['order_id'] == order_id_filter), None)
+            order_to_bill = core.find_order(order_id_filter)
             print(order_to_bill)
 
             if order_to_bill:
@@ -468,13 +400,13 @@ if menu == 'Orders':
                     else:
                         customer_id = order_to_bill['customer_id']
                         print(customer_id)
-                        customer_info = next((c for c in customers if c['id'] == customer_id), None)
+                        customer_info = customer_store.get(customer_id)
                         print(customer_info)
                         if customer_info:
-                            pdf_buffer = generate_invoice(order_to_bill, customer_info, products,)
+                            pdf_data = invoice_cache.get_invoice(order_to_bill, customer_info, product_store)
                             st.download_button(
                                 label="Download Bill",
-                                data=pdf_buffer,
+                                data=pdf_data,
                                 file_name=f"bill_order_{order_id_filter}.pdf",
                                 mime="application/pdf"
                             )
@@ -486,99 +418,147 @@ if menu == 'Orders':
                     st.write("Customers:", customers)
             else:
                 st.write("Order ID not found.")
-        st.subheader('Latest Orders (Newest 5)')
-        latest_orders = orders[-10:]
-
-        if len(latest_orders) > 0:
-            order_data = []
-            total_amount_by_customer = {}
-            for order in latest_orders:
-                if customer_id_filter.strip() == '' or order['customer_id'] == customer_id_filter.strip():
-                    total_price = sum(product['price'] * product['quantity'] for product in order['products'])
-
-                    for product in order['products']:
-                        product_name = 'N/A'
-                        for p in products:
-                            if p['id'] == product['product_id']:
-                                product_name = p.get('name', 'N/A')
-                                break
-
-                        order_data.append({
-                            'Order ID': order['order_id'],
-                            'Customer ID': order['customer_id'],
-                            'Product ID': product['product_id'],
-                            'Product Name': product_name,
-                            'Product Quantity': product['quantity'],
-                            'Product Price': format(product['price'], '.2f').rstrip('0').rstrip('.')
-                        })
-
-                    if order['customer_id'] in total_amount_by_customer:
-                        total_amount_by_customer[order['customer_id']] += total_price
-                    else:
-                        total_amount_by_customer[order['customer_id']] = total_price
-
-            filtered_order_data = [order for order in order_data if
-                                   customer_id_filter.strip() == '' or order[
-                                       'Customer ID'] == customer_id_filter.strip()]
-            order_df = pd.DataFrame(filtered_order_data)
-
-            if len(filtered_order_data) > 0:
-                st.table(order_df.style.set_properties(**{'border': '1px solid black', 'border-collapse': 'collapse'}))
-            else:
-                st.write('No orders available for the specified customer ID.')
-
+        st.subheader('Orders')
+        order_id_prefix = st.text_input('Search by Order ID')
+        show_page('orders', lambda offset, limit: order_store.query(
+            prefixes={'order_id': order_id_prefix.strip()},
+            equals={'customer_id': customer_id_filter.strip()} if customer_id_filter.strip() else None,
+            descending=True, offset=offset, limit=limit), order_lines_table,
+            'No orders available for the specified customer ID.' if customer_id_filter.strip() else
+            'No orders available.')
+
+        if len(orders) > 0:
+            # Totals cover the full order history, not just the orders listed above
+            order_analytics = core.order_analytics
             st.subheader('Total Amount by Customer ID')
             if customer_id_filter.strip() != '':
-                if total_amount_by_customer and customer_id_filter.strip() in total_amount_by_customer:
-                    total_amount = total_amount_by_customer[customer_id_filter.strip()]
-                    customer_df = pd.DataFrame([{
+                total_amount = order_analytics.customer_total(customer_id_filter.strip())
+                if total_amount is not None:
+                    customer_df = data_frame([{
                         'Customer ID': customer_id_filter.strip(),
                         'Total Amount': format(total_amount, '.2f').rstrip('0').rstrip('.')
                     }])
-                    st.table(customer_df.style.set_properties(
-                        **{'border': '1px solid black', 'border-collapse': 'collapse'}))
+                    st.dataframe(customer_df, hide_index=True)
                 else:
                     st.write('No orders available for the specified customer ID.')
-        else:
-            st.write('No orders available.')
+            else:
+                with timed('view order totals'):
+                    by_customer = order_analytics.revenue_by_customer()
+                    by_product = order_analytics.revenue_by_product()
+                    by_period = order_analytics.revenue_by_period()
+                st.dataframe(by_customer, hide_index=True)
+                st.subheader('Total Amount by Product ID')
+                st.dataframe(by_product, hide_index=True)
+                st.subheader('Total Amount by Month')
+                st.dataframe(by_period, hide_index=True)
 
     elif action == 'Add Order':
         # Add order
         st.subheader('Add Order')
-        customer_id = st.selectbox('Select Customer ID', [c['id'] for c in customers])
-        if st.button('Create Order'):
-            new_order = add_order(customer_id)
+        customer_id = customer_picker('Customer', 'add_order_customer')
+        if customer_id and st.button('Create Order'):
+            new_order = core.add_order(customer_id)
             st.success(f'Order {new_order["order_id"]} Created Successfully!')
 
         order_id = st.selectbox('Select Order ID to Add Products',
-                                [o['order_id'] for o in orders if o['customer_id'] == customer_id])
+                                [o['order_id'] for o in order_store.for_customer(customer_id)] if customer_id else [])
         product_id = st.selectbox('Select Product ID', [p['id'] for p in products])
         quantity = st.number_input('Enter Quantity', min_value=1)
         if st.button('Add Product to Order'):
-            if update_order(order_id, product_id, quantity):
-                st.success('Product Added to Order Successfully!')
-            else:
-                st.warning('Order ID or Product ID not found!')
+            try:
+                if core.update_order(order_id, product_id, quantity):
+                    st.success('Product Added to Order Successfully!')
+                else:
+                    st.warning('Order ID or Product ID not found!')
+            except OutOfStock as e:
+                st.warning(str(e))
     elif action == 'Update Order':
         # Update order
         st.subheader('Update Order')
         order_id = st.selectbox('Select Order ID to Update', [o['order_id'] for o in orders])
+        version = edit_version('order', order_id, order_store.get(order_id))
         product_id = st.selectbox('Select Product ID to Update', [p['id'] for p in products])
         quantity = st.number_input('Enter New Quantity', min_value=1)
         if st.button('Update Product Quantity in Order'):
-            if update_order(order_id, product_id, quantity):
-                st.success('Order Updated Successfully!')
-            else:
-                st.warning('Order ID or Product ID not found!')
+            try:
+                if core.update_order(order_id, product_id, quantity, version, replace=True):
+                    st.success('Order Updated Successfully!')
+                else:
+                    st.warning('Order ID or Product ID not found!')
+            except VersionConflict:
+                st.warning('Order was changed by someone else in the meantime, please try again!')
+            except OutOfStock as e:
+                st.warning(str(e))
+            clear_edit_version('order', order_id)
     elif action == 'Delete Order':
         # Delete order
         st.subheader('Delete Order')
         order_id = st.text_input('Enter Order ID to Delete')
         if order_id:
-            if delete_order(order_id):
+            if core.delete_order(order_id):
                 st.success('Order Deleted Successfully!')
             else:
                 st.warning('Order ID not found!')
     elif action == 'Download Orders':
-        # Download orders as Excel file
+        # Download orders as Excel, CSV or Parquet file
         download_orders()
+    elif action == 'Batch Invoices':
+        # Generate invoices for many orders at once
+        st.subheader('Batch Invoices')
+        selected_ids = st.multiselect('Select Order IDs (leave empty for all orders)', order_store.ids())
+        since = until = None
+        if st.checkbox('Only orders created in a date range'):
+            since = st.date_input('From date').isoformat()
+            until = st.date_input('To date').isoformat()
+        output_format = st.radio('Output', ['zip', 'pdf'],
+                                 format_func=lambda f: 'ZIP of PDFs' if f == 'zip' else 'Single merged PDF')
+        if st.button('Generate Invoices'):
+            # Rendering runs as a background job; the archive is downloaded from the Jobs page
+            submit_job('invoices', {'order_ids': selected_ids, 'since': since, 'until': until,
+                                    'format': output_format}, 'Invoice run')
+    elif action == 'Import Orders':
+        # Create many orders at once from a marketplace export
+        st.subheader('Import Orders')
+        st.caption('One row per order line with the columns order_ref, customer_id, product_id and quantity; '
+                   'consecutive rows with the same order_ref become one order.')
+        uploaded = st.file_uploader('Orders File', type=IMPORT_FORMATS + ['json', 'ndjson'])
+        batch_size = st.number_input('Orders per Batch', min_value=1, value=IMPORT_BATCH_SIZE)
+        if uploaded is not None and st.button('Import Orders'):
+            result = core.import_orders(order_specs(read_rows(uploaded, import_format(uploaded.name))), batch_size)
+            st.success(f'{len(result["created"])} Orders Imported Successfully in {result["batches"]} batches!')
+            if result['errors']:
+                st.warning(f'{len(result["errors"])} orders were skipped:')
+                st.dataframe(data_frame(result['errors'], columns=['Row', 'Error']), hide_index=True)
+
+if menu == 'Jobs':
+    st.subheader('Background Jobs')
+    st.caption(f'Results can be downloaded for {JOB_RESULT_TTL / 3600:g} hours after a job finishes.')
+    if job_fragment is None:
+        # Clicking reruns the script, which reads the job table again
+        st.button('Refresh')
+    show_jobs()
+
+if menu == 'Admin':
+    # Latency of the instrumented operations in this server process
+    st.subheader('Operation Latency')
+    summary = metrics.summary()
+    if summary:
+        st.dataframe(data_frame([{
+            'Operation': name,
+            'Calls': stats['count'],
+            'p50 (ms)': round(stats['p50'] * 1000, 2),
+            'p95 (ms)': round(stats['p95'] * 1000, 2),
+            'p99 (ms)': round(stats['p99'] * 1000, 2),
+            'Max (ms)': round(stats['max'] * 1000, 2),
+            'Total (s)': round(stats['total'], 3)
+        } for name, stats in summary.items()]), hide_index=True, use_container_width=True)
+    else:
+        st.write('No operations recorded yet.')
+    st.subheader('Counters')
+    st.dataframe(data_frame(sorted(metrics.counter_values().items()), columns=['Counter', 'Value']), hide_index=True)
+    st.download_button(
+        label='Download Prometheus Metrics',
+        data=metrics.prometheus(),
+        file_name='orderm.prom',
+        mime='text/plain'
+    )
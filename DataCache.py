@@ -0,0 +1,79 @@
+import threading
+from contextlib import contextmanager
+from Metrics import count
+
+# Process-wide cache of loaded datasets, shared by every Streamlit session and rerun.
+# An entry stays valid while the storage signature of its file (mtime/size) is unchanged;
+# our own saves refresh the signature and bump the generation instead of forcing a reload.
+
+
+class DatasetCache:
+    def __init__(self, storage):
+        self.storage = storage
+        self.hits = 0
+        self.misses = 0
+        self.generation = 0
+        self._entries = {}
+        self._lock = threading.RLock()
+
+    # Function to get a cached dataset, calling loader() when it is missing and refresh(value) when it is stale
+    def get(self, filename, loader, refresh=None):
+        with self._lock:
+            entry = self._entries.get(filename)
+            if entry is not None and entry[0] == self.storage.signature(filename):
+                self.hits += 1
+                count('dataset_cache_hits')
+                return entry[1]
+        # Reload under the dataset's write lock so we never read a half-applied change
+        with self.storage.lock(filename), self._lock:
+            entry = self._entries.get(filename)
+            if entry is not None and entry[0] == self.storage.signature(filename):
+                self.hits += 1
+                count('dataset_cache_hits')
+                return entry[1]
+            self.misses += 1
+            count('dataset_cache_misses')
+            if entry is not None and refresh is not None:
+                # Refresh in place so every reference to the cached value sees the new data
+                value = refresh(entry[1])
+            else:
+                value = loader()
+            # Loading may create the file, so take the signature again afterwards
+            self._entries[filename] = (self.storage.signature(filename), value, refresh)
+            return value
+
+    # Context manager holding a dataset's write lock, with the cached value refreshed to the stored data first
+    @contextmanager
+    def locked(self, filename):
+        with self.storage.lock(filename):
+            with self._lock:
+                entry = self._entries.get(filename)
+                if entry is not None and entry[2] is not None and entry[0] != self.storage.signature(filename):
+                    self.misses += 1
+                    count('dataset_cache_misses')
+                    entry[2](entry[1])
+                    self._entries[filename] = (self.storage.signature(filename), entry[1], entry[2])
+            yield
+
+    # Function to run a write of our own and keep the cached values current instead of reloading them
+    def write(self, filename, action):
+        with self.storage.lock(filename):
+            before = self.storage.signature(filename)
+            result = action()
+            after = self.storage.signature(filename)
+            with self._lock:
+                self.generation += 1
+                for name, (signature, value, refresh) in list(self._entries.items()):
+                    # Datasets sharing one file (SQLite) moved to the new signature along with this one
+                    if name == filename or (signature == before and self.storage.signature(name) == after):
+                        self._entries[name] = (after, value, refresh)
+        return result
+
+    # Function to drop one cached dataset, or all of them
+    def invalidate(self, filename=None):
+        with self._lock:
+            self.generation += 1
+            if filename is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(filename, None)
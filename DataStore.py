@@ -0,0 +1,328 @@
+from bisect import bisect_left, insort
+from datetime import datetime
+from decimal import Decimal
+from itertools import islice
+
+# In-memory repository keeping id -> record indexes alongside the record lists
+
+
+# Raised when a record was changed by someone else since the caller read it
+class VersionConflict(Exception):
+    pass
+
+
+# Function to check the version a caller expects (compare-and-swap) and return the record's next version
+def next_version(record, expected_version=None):
+    current = record.get('version', 0)
+    if expected_version is not None and current != expected_version:
+        raise VersionConflict(f'expected version {expected_version}, found {current}')
+    return current + 1
+
+
+# Function to get the current local time as an ISO 8601 timestamp with its UTC offset, e.g. for created_at;
+# these sort by time within a time zone, and their first 7 and 10 characters are the month and the day
+def timestamp(when=None):
+    return (when or datetime.now()).astimezone().isoformat(timespec='seconds')
+
+
+# Function to get a money amount as an exact Decimal, read from its shortest decimal text rather than the binary float
+def money(value):
+    return Decimal(str(value or 0))
+
+
+# Function to find an order's line for a product, or None
+def order_line(order, product_id):
+    product_id = str(product_id)
+    for line in order['products']:
+        if str(line['product_id']) == product_id:
+            return line
+    return None
+
+
+# Function to normalize text for case-insensitive sorting and prefix search
+def text_key(value):
+    return str(value).lower()
+
+
+# Sorted (value, record id) list over one field, for prefix, range and ordered queries
+class SortedIndex:
+    def __init__(self, field, transform=str):
+        self.field = field
+        self.transform = transform
+        self.entries = []
+
+    def _entry(self, record_id, record):
+        value = record.get(self.field)
+        if value is None:
+            return None
+        try:
+            return self.transform(value), record_id
+        except (TypeError, ValueError):
+            return None
+
+    # Function to add a record; bulk adds are only sorted by finish()
+    def add(self, record_id, record, bulk=False):
+        entry = self._entry(record_id, record)
+        if entry is None:
+            return
+        if bulk:
+            self.entries.append(entry)
+        else:
+            insort(self.entries, entry)
+
+    def finish(self):
+        self.entries.sort()
+
+    def discard(self, record_id, record):
+        entry = self._entry(record_id, record)
+        if entry is None:
+            return
+        idx = bisect_left(self.entries, entry)
+        if idx < len(self.entries) and self.entries[idx] == entry:
+            del self.entries[idx]
+
+    # Function to list the ids whose value starts with prefix
+    def prefix(self, prefix):
+        prefix = self.transform(prefix)
+        ids = []
+        for value, record_id in islice(self.entries, bisect_left(self.entries, (prefix,)), None):
+            if not value.startswith(prefix):
+                break
+            ids.append(record_id)
+        return ids
+
+    # Function to list the ids whose value lies in [low, high]; None leaves that side open
+    def between(self, low=None, high=None):
+        start = 0 if low is None else bisect_left(self.entries, (self.transform(low),))
+        high = None if high is None else self.transform(high)
+        ids = []
+        for value, record_id in islice(self.entries, start, None):
+            if high is not None and value > high:
+                break
+            ids.append(record_id)
+        return ids
+
+    # Function to iterate the ids in value order
+    def ordered(self, descending=False):
+        entries = reversed(self.entries) if descending else iter(self.entries)
+        return (record_id for _, record_id in entries)
+
+
+# Store wrapping a list of records with an O(1) lookup index on the key field,
+# plus optional sorted indexes ({field: transform}) for paginated queries
+class IndexedStore:
+    def __init__(self, records, key='id', sorted_fields=None):
+        self.records = records
+        self.key = key
+        self.listeners = []
+        self.sorted_fields = dict(sorted_fields or {})
+        self.sorted_fields.setdefault(key, str)
+        self.rebuild()
+
+    # Function to register a callback(event, record) run after every 'add', 'update', 'remove' or 'reset'
+    def subscribe(self, listener):
+        self.listeners.append(listener)
+
+    def _notify(self, event, record):
+        for listener in self.listeners:
+            listener(event, record)
+
+    # Rebuild every index from the record list
+    def rebuild(self):
+        # Insertion number of every record in the list (by object identity), increasing along the list, so a
+        # record is found by bisection instead of comparing records field by field
+        self._sequence = {id(record): number for number, record in enumerate(self.records)}
+        self._next_sequence = len(self.records)
+        self._index = {}
+        self._duplicates = set()
+        self._sorted = {field: SortedIndex(field, transform) for field, transform in self.sorted_fields.items()}
+        self._bulk = True
+        for record in self.records:
+            self._index_record(record)
+        self._bulk = False
+        for index in self._sorted.values():
+            index.finish()
+
+    def __len__(self):
+        return len(self.records)
+
+    def __iter__(self):
+        return iter(self.records)
+
+    def __contains__(self, record_id):
+        return str(record_id) in self._index
+
+    # Function to replace every record in place, e.g. after another process changed the stored data
+    def replace_all(self, records):
+        self.records[:] = records
+        self.rebuild()
+        self._notify('reset', None)
+        return self
+
+    # Function to get a record by id
+    def get(self, record_id, default=None):
+        return self._index.get(str(record_id), default)
+
+    # Function to list all indexed ids
+    def ids(self):
+        return list(self._index)
+
+    # Function to add a new record
+    def add(self, record):
+        self.records.append(record)
+        self._sequence[id(record)] = self._next_sequence
+        self._next_sequence += 1
+        self._index_record(record)
+        self._notify('add', record)
+        return record
+
+    # Function to update fields of an existing record, keeping the indexes consistent
+    def update(self, record_id, **fields):
+        record = self.get(record_id)
+        if record is None:
+            return None
+        self._unindex_record(record)
+        record.update(fields)
+        self._index_record(record)
+        self._notify('update', record)
+        return record
+
+    # Function to remove a record by id
+    def remove(self, record_id):
+        record = self.get(record_id)
+        if record is None:
+            return None
+        self._unindex_record(record)
+        del self.records[self._position(record)]
+        del self._sequence[id(record)]
+        self._notify('remove', record)
+        return record
+
+    # Function to get the list position of a record held by the store
+    def _position(self, record):
+        sequence = self._sequence[id(record)]
+        low, high = 0, len(self.records)
+        while low < high:
+            middle = (low + high) // 2
+            if self._sequence[id(self.records[middle])] < sequence:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def _index_record(self, record):
+        if self.key not in record:
+            return
+        record_id = str(record[self.key])
+        if record_id in self._index:
+            # Keep the first record for an id, like the old linear scans did
+            self._duplicates.add(record_id)
+            return
+        self._index[record_id] = record
+        for index in self._sorted.values():
+            index.add(record_id, record, self._bulk)
+
+    def _unindex_record(self, record):
+        if self.key not in record:
+            return
+        record_id = str(record[self.key])
+        if self._index.get(record_id) is not record:
+            return
+        del self._index[record_id]
+        for index in self._sorted.values():
+            index.discard(record_id, record)
+        if record_id in self._duplicates:
+            # Promote the next record sharing this id, if any is left
+            self._duplicates.discard(record_id)
+            matches = [r for r in self.records if r is not record and str(r.get(self.key)) == record_id]
+            if matches:
+                self._index[record_id] = matches[0]
+                for index in self._sorted.values():
+                    index.add(record_id, matches[0])
+            if len(matches) > 1:
+                self._duplicates.add(record_id)
+
+    # Function to list the ids of records whose field equals value
+    def _equal_ids(self, field, value):
+        if field in self._sorted:
+            return self._sorted[field].between(value, value)
+        return [record_id for record_id, record in self._index.items() if str(record.get(field)) == str(value)]
+
+    # Function to fetch one page of records; returns (records on the page, total number of matches).
+    # prefixes/ranges/equals map fields to a prefix, a (low, high) pair or a value and are answered from
+    # the indexes. Without sort_by, records come in insertion order (newest first when descending).
+    def query(self, prefixes=None, ranges=None, equals=None, sort_by=None, descending=False, offset=0, limit=None):
+        candidates = None
+        filters = [self._sorted[field].prefix(prefix) for field, prefix in (prefixes or {}).items() if prefix]
+        filters += [self._sorted[field].between(*bounds) for field, bounds in (ranges or {}).items()
+                    if bounds != (None, None)]
+        filters += [self._equal_ids(field, value) for field, value in (equals or {}).items()]
+        for ids in sorted(filters, key=len):
+            candidates = set(ids) if candidates is None else candidates.intersection(ids)
+
+        if sort_by in self._sorted and (candidates is None or len(candidates) * 8 > len(self._index)):
+            # Walk the sorted index itself when most records match
+            matches = (self._index[record_id] for record_id in self._sorted[sort_by].ordered(descending)
+                       if candidates is None or record_id in candidates)
+        elif sort_by is not None:
+            transform = self.sorted_fields.get(sort_by, lambda value: value)
+
+            def sort_key(record):
+                value = record.get(sort_by)
+                return value is None, None if value is None else transform(value)
+
+            pool = self._index.values() if candidates is None else (self._index[i] for i in candidates)
+            matches = iter(sorted(pool, key=sort_key, reverse=descending))
+        elif candidates is not None and len(candidates) * 8 <= len(self._index):
+            # Few matches: put the candidates in insertion order instead of scanning every record
+            pool = (self._index[record_id] for record_id in candidates)
+            matches = iter(sorted(pool, key=lambda record: self._sequence[id(record)], reverse=descending))
+        else:
+            records = reversed(self.records) if descending else iter(self.records)
+            matches = (r for r in records if self.key in r and self._index.get(str(r[self.key])) is r
+                       and (candidates is None or str(r[self.key]) in candidates))
+        total = len(self._index) if candidates is None else len(candidates)
+        stop = None if limit is None else offset + limit
+        return list(islice(matches, offset, stop)), total
+
+
+# Order store with an extra customer_id -> orders index
+class OrderStore(IndexedStore):
+    def __init__(self, records, key='order_id', sorted_fields=None):
+        self._by_customer = {}
+        super().__init__(records, key, sorted_fields)
+
+    def rebuild(self):
+        self._by_customer = {}
+        super().rebuild()
+
+    # Function to list the orders of a customer
+    def for_customer(self, customer_id):
+        return list(self._by_customer.get(str(customer_id), {}).values())
+
+    def _equal_ids(self, field, value):
+        if field == 'customer_id':
+            return list(self._by_customer.get(str(value), {}))
+        return super()._equal_ids(field, value)
+
+    def _index_record(self, record):
+        super()._index_record(record)
+        if self.key in record and 'customer_id' in record:
+            orders = self._by_customer.setdefault(str(record['customer_id']), {})
+            orders.setdefault(str(record[self.key]), record)
+
+    def _unindex_record(self, record):
+        if self.key not in record:
+            return
+        order_id = str(record[self.key])
+        if 'customer_id' in record:
+            customer_id = str(record['customer_id'])
+            orders = self._by_customer.get(customer_id, {})
+            if orders.get(order_id) is record:
+                del orders[order_id]
+                if not orders:
+                    del self._by_customer[customer_id]
+        super()._unindex_record(record)
+        promoted = self._index.get(order_id)
+        if promoted is not None and 'customer_id' in promoted:
+            self._by_customer.setdefault(str(promoted['customer_id']), {}).setdefault(order_id, promoted)
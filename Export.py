@@ -0,0 +1,122 @@
+import codecs
+import csv
+import tempfile
+from Metrics import timed
+
+# Streaming exports of the datasets. Rows are produced one at a time and written straight into
+# a spooled temporary file, which stays in memory while small and moves to disk when it grows.
+# openpyxl and pyarrow are only imported by the writers that need them.
+
+PRODUCT_COLUMNS = ['id', 'name', 'price', 'quantity', 'Total Price']
+CUSTOMER_COLUMNS = ['id', 'name', 'address', 'mobile', 'email']
+ORDER_COLUMNS = ['Order ID', 'Customer ID', 'Product ID', 'Product Name', 'Product Quantity', 'Product Price',
+                 'Total Amount']
+
+EXPORT_FORMATS = ['xlsx', 'csv', 'parquet']
+EXPORT_MIME_TYPES = {
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    'csv': 'text/csv',
+    'parquet': 'application/octet-stream',
+}
+
+# Exports smaller than this are kept in memory
+SPOOL_BYTES = 16 * 1024 * 1024
+PARQUET_BATCH_ROWS = 65536
+
+
+# Function to generate product rows, with the total price of each product
+def product_rows(products):
+    for product in products:
+        row = [product.get(column) for column in PRODUCT_COLUMNS[:-1]]
+        row.append((product.get('price') or 0) * (product.get('quantity') or 0))
+        yield row
+
+
+# Function to generate customer rows
+def customer_rows(customers):
+    for customer in customers:
+        yield [customer.get(column) for column in CUSTOMER_COLUMNS]
+
+
+# Function to generate one row per order line, with product names looked up in product_store
+def order_rows(orders, product_store):
+    for order in orders:
+        for line in order['products']:
+            product = product_store.get(line['product_id'])
+            name = product.get('name', 'N/A') if product else line.get('name', 'N/A')
+            yield [order['order_id'], order['customer_id'], line['product_id'], name, line['quantity'],
+                   line['price'], order['total_amount']]
+
+
+def write_xlsx(rows, columns, out):
+    from openpyxl import Workbook
+
+    # Write-only workbooks stream rows out instead of keeping every cell object in memory
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    sheet.append(columns)
+    for row in rows:
+        sheet.append(row)
+    workbook.save(out)
+
+
+def write_csv(rows, columns, out):
+    text = codecs.getwriter('utf-8')(out)
+    writer = csv.writer(text)
+    writer.writerow(columns)
+    writer.writerows(rows)
+
+
+def write_parquet(rows, columns, out):
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise RuntimeError('Parquet export needs the pyarrow package (pip install pyarrow)')
+    writer = None
+    batch = []
+
+    # Function to write the buffered rows as one row group
+    def flush():
+        nonlocal writer
+        records = [dict(zip(columns, row)) for row in batch]
+        if writer is None:
+            # Take the schema from the first batch; columns that are all empty so far become strings
+            schema = pa.Table.from_pylist(records).schema
+            schema = pa.schema([pa.field(f.name, pa.string()) if pa.types.is_null(f.type) else f for f in schema])
+            writer = pq.ParquetWriter(out, schema)
+        writer.write_table(pa.Table.from_pylist(records, schema=writer.schema))
+        batch.clear()
+
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= PARQUET_BATCH_ROWS:
+            flush()
+    if batch or writer is None:
+        if not batch:
+            # An empty export still gets the header
+            writer = pq.ParquetWriter(out, pa.schema([(column, pa.string()) for column in columns]))
+        else:
+            flush()
+    writer.close()
+
+
+EXPORT_WRITERS = {
+    'xlsx': write_xlsx,
+    'csv': write_csv,
+    'parquet': write_parquet,
+}
+
+
+# Function to write rows in the given format to a binary file object
+def write_export(rows, columns, export_format, out):
+    with timed(f'export {export_format}'):
+        EXPORT_WRITERS[export_format](rows, columns, out)
+
+
+# Function to export rows in the given format; returns a binary file object positioned at the start
+def export_rows(rows, columns, export_format):
+    out = tempfile.SpooledTemporaryFile(max_size=SPOOL_BYTES)
+    write_export(rows, columns, export_format, out)
+    out.seek(0)
+    return out
@@ -0,0 +1,114 @@
+import os
+import random
+import threading
+import time
+from Settings import ID_GENERATOR, ID_NODE
+
+# Record id generators. Both produce ids that sort in creation order and are unique without
+# coordination or scanning existing ids:
+#   'ulid'      - 26 characters: 48-bit millisecond timestamp + 80 random bits, incremented within a millisecond
+#   'snowflake' - 13 characters: 41-bit millisecond timestamp + 10-bit node id + 12-bit sequence; give every
+#                 process writing the same data its own node id (ORDERM_NODE_ID)
+
+CROCKFORD = '0123456789ABCDEFGHJKMNPQRSTVWXYZ'
+CROCKFORD_VALUES = {char: value for value, char in enumerate(CROCKFORD)}
+
+
+# Function to encode a number as fixed-width Crockford base32, which keeps numeric order when sorted as text
+def encode_base32(value, length):
+    chars = []
+    for _ in range(length):
+        chars.append(CROCKFORD[value & 31])
+        value >>= 5
+    return ''.join(reversed(chars))
+
+
+# Function to decode fixed-width Crockford base32 text, or None when it is not
+def decode_base32(text):
+    value = 0
+    for char in str(text).upper():
+        digit = CROCKFORD_VALUES.get(char)
+        if digit is None:
+            return None
+        value = (value << 5) | digit
+    return value
+
+
+# Function to get the creation time (Unix milliseconds) embedded in a ULID or Snowflake id, or None for other ids
+def id_timestamp_ms(record_id):
+    record_id = str(record_id)
+    if len(record_id) == 26:
+        value = decode_base32(record_id)
+        return None if value is None else value >> 80
+    if len(record_id) == 13:
+        value = decode_base32(record_id)
+        return None if value is None else (value >> 22) + SnowflakeGenerator.EPOCH_MS
+    return None
+
+
+def _now_ms():
+    return time.time_ns() // 1000000
+
+
+class UlidGenerator:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._last_ms = -1
+        self._last_random = 0
+
+    def new_id(self):
+        with self._lock:
+            now = max(_now_ms(), self._last_ms)
+            if now == self._last_ms:
+                # Same millisecond (or a clock step back): stay monotonic by incrementing the random part
+                self._last_random = (self._last_random + 1) & ((1 << 80) - 1)
+                if self._last_random == 0:
+                    now += 1
+            else:
+                self._last_random = random.SystemRandom().getrandbits(80)
+            self._last_ms = now
+            return encode_base32((now << 80) | self._last_random, 26)
+
+
+class SnowflakeGenerator:
+    # Custom epoch (2024-01-01 UTC) so the 41-bit timestamp lasts until about 2093
+    EPOCH_MS = 1704067200000
+
+    def __init__(self, node_id):
+        if not 0 <= node_id < 1024:
+            raise ValueError(f'Snowflake node id must be between 0 and 1023, got {node_id}')
+        self.node_id = node_id
+        self._lock = threading.Lock()
+        self._last_ms = -1
+        self._sequence = 0
+
+    def new_id(self):
+        with self._lock:
+            now = max(_now_ms() - self.EPOCH_MS, self._last_ms)
+            if now == self._last_ms:
+                self._sequence = (self._sequence + 1) & 4095
+                if self._sequence == 0:
+                    # 4096 ids in this millisecond already; borrow the next one
+                    now += 1
+            else:
+                self._sequence = 0
+            self._last_ms = now
+            return encode_base32((now << 22) | (self.node_id << 12) | self._sequence, 13)
+
+
+_generator = None
+_generator_lock = threading.Lock()
+
+
+# Function to get the id generator selected in Settings
+def get_id_generator():
+    global _generator
+    with _generator_lock:
+        if _generator is None:
+            if ID_GENERATOR == 'ulid':
+                _generator = UlidGenerator()
+            elif ID_GENERATOR == 'snowflake':
+                _generator = SnowflakeGenerator(ID_NODE if ID_NODE is not None else os.getpid() % 1024)
+            else:
+                raise ValueError(f'Unknown id generator: {ID_GENERATOR}')
+        return _generator
@@ -0,0 +1,140 @@
+import argparse
+import csv
+import io
+import json
+import os
+
+# Bulk order import from marketplace files (JSON lines, CSV or Excel), parsed one row at a time.
+# Each row is one order line with the columns order_ref, customer_id, product_id and quantity;
+# consecutive rows sharing an order_ref make up one order, and a row without order_ref is an order
+# of its own. A JSON-lines row may also carry a whole order:
+#   {"order_ref": "A-1", "customer_id": "c1", "lines": [{"product_id": "p1", "quantity": 2}, ...]}
+#
+#   python Ingest.py orders.csv [--format csv] [--batch-size 1000]
+
+IMPORT_FORMATS = ['jsonl', 'csv', 'xlsx']
+
+
+# Function to read JSON-lines rows as (row number, row), with None for a line that is not a JSON object
+def jsonl_rows(f):
+    for number, line in enumerate(f, 1):
+        if isinstance(line, bytes):
+            line = line.decode('utf-8-sig' if number == 1 else 'utf-8')
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            row = None
+        yield number, row if isinstance(row, dict) else None
+
+
+# Function to read CSV rows as (row number, row); the first line holds the column names
+def csv_rows(f):
+    text = io.TextIOWrapper(f, encoding='utf-8-sig', newline='')
+    try:
+        for number, row in enumerate(csv.DictReader(text), 2):
+            yield number, row
+    finally:
+        text.detach()
+
+
+# Function to read the rows of the first sheet as (row number, row); the first row holds the column names
+def xlsx_rows(f):
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(f, read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        header = [str(name).strip() if name is not None else '' for name in next(rows, ())]
+        for number, values in enumerate(rows, 2):
+            if any(value is not None for value in values):
+                yield number, dict(zip(header, values))
+    finally:
+        workbook.close()
+
+
+IMPORT_READERS = {
+    'jsonl': jsonl_rows,
+    'csv': csv_rows,
+    'xlsx': xlsx_rows,
+}
+
+
+# Function to guess the import format from a file name
+def import_format(filename):
+    extension = os.path.splitext(filename)[1].lower().lstrip('.')
+    return {'json': 'jsonl', 'ndjson': 'jsonl'}.get(extension, extension)
+
+
+# Function to stream the rows of a binary file object in the given format
+def read_rows(f, fmt):
+    if fmt not in IMPORT_READERS:
+        raise ValueError(f'Unknown import format: {fmt}')
+    return IMPORT_READERS[fmt](f)
+
+
+def _text(value):
+    return '' if value is None else str(value).strip()
+
+
+# Function to parse a quantity cell, or None when it is not a positive whole number
+def parse_quantity(value):
+    try:
+        quantity = float(value)
+    except (TypeError, ValueError):
+        return None
+    return int(quantity) if quantity.is_integer() and quantity >= 1 else None
+
+
+# Function to group rows into order specs:
+# {'row', 'order_ref', 'customer_id', 'lines': [{'row', 'product_id', 'quantity'}]}, plus 'error': (row, message)
+# when the rows themselves are unusable
+def order_specs(rows):
+    spec = None
+    for number, row in rows:
+        if row is None:
+            yield {'row': number, 'error': (number, 'Row is not a JSON object')}
+            continue
+        order_ref = _text(row.get('order_ref'))
+        if 'lines' in row:
+            lines = row['lines'] if isinstance(row['lines'], list) else []
+            if spec is not None:
+                yield spec
+                spec = None
+            yield {'row': number, 'order_ref': order_ref, 'customer_id': _text(row.get('customer_id')),
+                   'lines': [{'row': number, 'product_id': _text(line.get('product_id')),
+                              'quantity': line.get('quantity')} for line in lines if isinstance(line, dict)]}
+            continue
+        if spec is None or not order_ref or order_ref != spec['order_ref']:
+            if spec is not None:
+                yield spec
+            spec = {'row': number, 'order_ref': order_ref, 'customer_id': _text(row.get('customer_id')), 'lines': []}
+        elif _text(row.get('customer_id')) not in ('', spec['customer_id']):
+            spec['error'] = (number, f'Order {order_ref} has more than one customer_id')
+        spec['lines'].append({'row': number, 'product_id': _text(row.get('product_id')),
+                              'quantity': row.get('quantity')})
+    if spec is not None:
+        yield spec
+
+
+def main():
+    from OrderCore import get_core
+    from Settings import IMPORT_BATCH_SIZE
+
+    parser = argparse.ArgumentParser(description='Import orders in bulk')
+    parser.add_argument('file', help='JSON-lines, CSV or Excel file of order lines')
+    parser.add_argument('--format', choices=IMPORT_FORMATS, help='input format (default: from the file name)')
+    parser.add_argument('--batch-size', type=int, default=IMPORT_BATCH_SIZE, help='orders committed per batch')
+    args = parser.parse_args()
+
+    with open(args.file, 'rb') as f:
+        result = get_core().import_orders(order_specs(read_rows(f, args.format or import_format(args.file))),
+                                          args.batch_size)
+    print(f'{len(result["created"])} orders imported in {result["batches"]} batches')
+    for number, message in result['errors']:
+        print(f'Row {number}: {message}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+from DataStore import next_version
+
+# Stock reservation for order lines. Adding a line takes its quantity out of the product's stock, recorded
+# as the line's 'reserved' quantity, and deleting an order puts back what its lines reserved (nothing for
+# orders from before reservations existed, which never took stock).
+# Reservations are serialized: the check-and-decrement and its write run under the products dataset lock,
+# which is what keeps stock consistent across processes, and order changes already hold the orders
+# dataset lock around them. Lock order: orders dataset lock, then the products dataset lock.
+
+
+# Raised when a product does not have enough stock left for a line
+class OutOfStock(Exception):
+    pass
+
+
+class Inventory:
+    def __init__(self, core):
+        self.core = core
+
+    # Context manager holding the products dataset lock, with the stock refreshed from storage
+    def locked(self):
+        return self.core.dataset_cache.locked('products.json')
+
+    # Function to apply stock changes ({product_id: quantity to take, negative to give back}) all or nothing;
+    # returns the changed products, which are saved unless save is False (the caller then saves them in a batch)
+    def adjust(self, demands, save=True):
+        demands = {str(product_id): quantity for product_id, quantity in demands.items() if quantity}
+        if not demands:
+            return []
+        with self.locked():
+            product_store = self.core.product_store
+            for product_id, quantity in demands.items():
+                product = product_store.get(product_id)
+                if product is not None and quantity > 0 and (product.get('quantity') or 0) < quantity:
+                    raise OutOfStock(f'Only {product.get("quantity") or 0} of product {product_id} left in stock, '
+                                     f'{quantity} requested')
+            changed = []
+            for product_id, quantity in demands.items():
+                product = product_store.get(product_id)
+                # Stock of a deleted product cannot be given back
+                if product is None:
+                    continue
+                product_store.update(product_id, quantity=(product.get('quantity') or 0) - quantity,
+                                     version=next_version(product))
+                changed.append(product)
+            if save and changed:
+                self.core.save_changes(product_store.records, 'products.json', [('put', p) for p in changed])
+        return changed
+
+    # Function to take stock for new order lines
+    def reserve(self, demands, save=True):
+        return self.adjust(demands, save)
+
+    # Function to give back the stock reserved by an order's lines
+    def release(self, order, save=True):
+        demands = {}
+        for line in order['products']:
+            product_id = str(line['product_id'])
+            demands[product_id] = demands.get(product_id, 0) - (line.get('reserved') or 0)
+        return self.adjust(demands, save)
+
+    # Function to list products whose stock is at or below threshold, lowest first, from the quantity index
+    def low_stock(self, threshold, offset=0, limit=None):
+        return self.core.product_store.query(ranges={'quantity': (None, threshold)}, sort_by='quantity',
+                                             offset=offset, limit=limit)
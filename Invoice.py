@@ -0,0 +1,412 @@
+import argparse
+import hashlib
+import json
+import os
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from io import BytesIO
+from datetime import datetime
+from decimal import Decimal
+from DataStore import money
+from Metrics import timed
+from Settings import INVOICE_WORKERS
+
+# Invoice rendering, for a single order and in bulk across a process pool.
+# ReportLab is imported inside the rendering functions, so importing this module does not load it.
+
+
+# Function to build the invoice paragraph styles, once per process
+@lru_cache(maxsize=None)
+def invoice_styles():
+    from reportlab.lib import colors
+    from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+
+    styles = getSampleStyleSheet()
+
+    # Define custom styles
+    style_heading = ParagraphStyle(
+        name='Heading1',
+        parent=styles['Heading1'],
+        alignment=1,  # Center alignment for heading
+        fontSize=20,
+        leading=22,
+        spaceAfter=20,
+        textColor=colors.darkblue
+    )
+
+    style_subheading = ParagraphStyle(
+        name='SubHeading',
+        parent=styles['Heading2'],
+        fontSize=14,
+        textColor=colors.darkblue
+    )
+
+    style_body = ParagraphStyle(
+        name='Normal',
+        parent=styles['Normal'],
+        alignment=0,  # Left alignment for body text
+        fontSize=12,
+        leading=14
+    )
+
+    style_customer_info = ParagraphStyle(
+        name='CustomerInfo',
+        parent=styles['Normal'],
+        fontSize=12,
+        leading=18,
+        spaceAfter=20
+    )
+
+    style_table_header = ParagraphStyle(
+        name='TableHeader',
+        parent=styles['Normal'],
+        fontSize=12,
+        leading=14,
+        textColor=colors.white
+    )
+
+    return style_heading, style_subheading, style_body, style_customer_info, style_table_header
+
+
+# Function to get the date printed on an order's invoice: the day the order was created, or today for orders
+# from before creation times were recorded
+def invoice_date(order):
+    try:
+        created = datetime.fromisoformat(str(order.get('created_at')))
+    except ValueError:
+        created = datetime.now()
+    return created.strftime('%d-%m-%Y')
+
+
+# Function to render the invoice PDF of an order; product_store is anything with get(product_id)
+@timed('generate_invoice')
+def generate_invoice(order, customer, product_store):
+    from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
+    from reportlab.lib import colors
+    from reportlab.lib.pagesizes import A4
+
+    buffer = BytesIO()
+    doc = SimpleDocTemplate(buffer, pagesize=A4)
+    style_heading, style_subheading, style_body, style_customer_info, style_table_header = invoice_styles()
+
+    # Heading
+    heading_text = "<b>INVOICE</b>"
+    heading = Paragraph(heading_text, style_heading)
+
+    # Company information
+    company_name = Paragraph("<b>RevivingIndia</b>", style_subheading)
+    company_address = "123 Street, City, Country, Zip Code"
+    company_contact = "Phone: (000) 000-0000"
+    company_address_para = Paragraph(company_address, style_body)
+    company_contact_para = Paragraph(company_contact, style_body)
+
+
+    # Order date
+    current_date = invoice_date(order)
+
+    # Customer information
+    customer_info = f"""
+        <b>Customer Name:</b> {customer.get('name', 'N/A')}<br/>
+        <b>Customer ID:</b> {customer['id']}<br/>
+        <b>Order ID:</b> {order['order_id']}<br/>
+        <b>Date:</b> {current_date}
+    """
+    customer_info_para = Paragraph(customer_info, style_customer_info)
+
+    # Table data
+    data = [
+        [Paragraph("DESCRIPTION", style_table_header), Paragraph("QTY", style_table_header),
+         Paragraph("UNIT PRICE", style_table_header), Paragraph("AMOUNT", style_table_header)]
+    ]
+    for product in order['products']:
+        product_info = product_store.get(product['product_id'])
+        product_name = product_info.get('name', 'N/A') if product_info else 'N/A'
+        qty = product['quantity']
+        unit_price = product['price']
+        amount = qty * unit_price
+        data.append([product_name, qty, f" {unit_price:.2f}", f" {amount:.2f}"])
+
+    # Subtotals and totals
+    subtotal = money(order['total_amount'])  # Kept up to date with every line change
+    tax_rate = Decimal('0.0425')  # Example tax rate
+    tax_amount = subtotal * tax_rate
+    total_amount = subtotal + tax_amount
+
+    data.append(["", "", "Subtotal", f" {subtotal:.2f}"])
+    data.append(["", "", "Tax Rate", f"{tax_rate * 100:.2f}%"])
+    data.append(["", "", "Tax", f" {tax_amount:.2f}"])
+    data.append(["", "", "Total", f" {total_amount:.2f}"])
+
+    # Table
+    table = Table(data, hAlign='LEFT', colWidths=[200, 50, 100, 100])
+    table.setStyle(TableStyle([
+        ('BACKGROUND', (0, 0), (-1, 0), colors.darkblue),
+        ('TEXTCOLOR', (0, 0), (-1, 0), colors.white),
+        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+        ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+        ('INNERGRID', (0, 0), (-1, -1), 0.25, colors.black),
+        ('BOX', (0, 0), (-1, -1), 0.25, colors.black),
+        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+        ('FONTNAME', (0, 1), (-1, -1), 'Helvetica'),
+        ('BACKGROUND', (-1, -1), (-1, -1), colors.lightblue),
+    ]))
+
+    # Build story
+    elements = [
+        heading,
+        # logo,
+        Spacer(1, 12),
+        company_name,
+        company_address_para,
+        company_contact_para,
+        Spacer(1, 24),
+
+        Spacer(1, 12),
+        customer_info_para,
+        Spacer(1, 12),
+        table
+    ]
+
+    doc.build(elements)
+
+    buffer.seek(0)
+    return buffer
+
+
+# Function to hash everything generate_invoice() prints for an order, to key cached PDFs by content
+def invoice_key(order, customer, product_store):
+    lines = []
+    for product in order['products']:
+        product_info = product_store.get(product['product_id'])
+        product_name = product_info.get('name', 'N/A') if product_info else 'N/A'
+        lines.append([product['product_id'], product_name, product['quantity'], product['price']])
+    payload = [order['order_id'], customer['id'], customer.get('name', 'N/A'), lines,
+               order['total_amount'], invoice_date(order)]
+    return hashlib.sha256(json.dumps(payload, default=str).encode('utf-8')).hexdigest()
+
+
+# Function to select the orders to invoice, by id and/or by creation date (inclusive 'YYYY-MM-DD' bounds)
+def select_orders(orders, order_ids=None, since=None, until=None):
+    wanted = set(str(order_id) for order_id in order_ids) if order_ids else None
+    for order in orders:
+        if wanted is not None and str(order['order_id']) not in wanted:
+            continue
+        if since or until:
+            # Orders without a creation date cannot match a date range
+            created = str(order.get('created_at', ''))[:10]
+            if not created or (since and created < since) or (until and created > until):
+                continue
+        yield order
+
+
+# Function to pair each order with the customer and products its invoice needs
+def invoice_jobs(orders, customer_store, product_store):
+    for order in orders:
+        customer = customer_store.get(order.get('customer_id'))
+        products = {}
+        for line in order['products']:
+            product = product_store.get(line['product_id'])
+            if product is not None:
+                products[line['product_id']] = product
+        yield order, customer, products
+
+
+# Function run in the pool workers: render one job to (order_id, pdf bytes), or (order_id, None) without a customer
+def render_invoice_job(job):
+    order, customer, products = job
+    if customer is None:
+        return order['order_id'], None
+    return order['order_id'], generate_invoice(order, customer, products).getvalue()
+
+
+# Function to render jobs across a process pool, yielding results in order with a bounded number in flight
+def render_invoices(jobs, workers=None):
+    workers = workers or INVOICE_WORKERS or os.cpu_count() or 1
+    if workers == 1:
+        for job in jobs:
+            yield render_invoice_job(job)
+        return
+    with ProcessPoolExecutor(max_workers=workers, initializer=invoice_styles) as pool:
+        pending = []
+        for job in jobs:
+            pending.append(pool.submit(render_invoice_job, job))
+            if len(pending) >= workers * 4:
+                yield pending.pop(0).result()
+        for future in pending:
+            yield future.result()
+
+
+# Function to import pypdf, which only the merged PDF output needs
+def import_pypdf():
+    try:
+        import pypdf
+        import pypdf.generic
+    except ImportError:
+        raise RuntimeError('Merged PDF output needs the pypdf package (pip install pypdf)')
+    return pypdf
+
+
+# One PDF merged from many invoices, written invoice by invoice: the objects of each invoice are renumbered
+# and written out as soon as it arrives, and only their file offsets and the page numbers are kept until the
+# page tree and cross-reference table close the file
+class MergedPdf:
+    # Object number of the page tree, which is written last
+    PAGES = 1
+
+    def __init__(self, out):
+        self.pypdf = import_pypdf()
+        self.out = out
+        self.position = 0
+        # Object number -> offset in the file (object 0 is the head of the free list)
+        self.offsets = [0, None]
+        self.pages = []
+        self._write(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
+
+    def _write(self, data):
+        self.out.write(data)
+        self.position += len(data)
+
+    def _new_number(self):
+        self.offsets.append(None)
+        return len(self.offsets) - 1
+
+    def _write_object(self, number, obj):
+        buffer = BytesIO()
+        buffer.write(f'{number} 0 obj\n'.encode('ascii'))
+        obj.write_to_stream(buffer)
+        buffer.write(b'\nendobj\n')
+        self.offsets[number] = self.position
+        self._write(buffer.getvalue())
+
+    # Function to add the pages of one rendered invoice (PDF bytes)
+    def append(self, pdf):
+        generic = self.pypdf.generic
+        reader = self.pypdf.PdfReader(BytesIO(pdf))
+        # (object number, generation) in the invoice -> object number in the merged file
+        numbers = {}
+        pending = []
+
+        # Function to copy an object with its references renumbered, queueing the objects they point to
+        def copy(obj):
+            if isinstance(obj, generic.IndirectObject):
+                key = (obj.idnum, obj.generation)
+                if key not in numbers:
+                    numbers[key] = self._new_number()
+                    pending.append(obj)
+                return generic.IndirectObject(numbers[key], 0, None)
+            if isinstance(obj, generic.StreamObject):
+                copied = type(obj)()
+                # The stream data is copied as stored, still encoded by its /Filter
+                copied._data = obj._data
+                copied.update({key: copy(value) for key, value in obj.items()})
+                return copied
+            if isinstance(obj, generic.DictionaryObject):
+                return generic.DictionaryObject({key: copy(value) for key, value in obj.items()})
+            if isinstance(obj, generic.ArrayObject):
+                return generic.ArrayObject(copy(value) for value in obj)
+            return obj
+
+        pages = list(reader.pages)
+        # Pages are numbered first, so references between them never pull in the invoice's own page tree
+        for page in pages:
+            reference = page.indirect_reference
+            numbers[(reference.idnum, reference.generation)] = self._new_number()
+        for page in pages:
+            reference = page.indirect_reference
+            copied = generic.DictionaryObject({key: copy(value) for key, value in page.items() if key != '/Parent'})
+            copied[generic.NameObject('/Parent')] = generic.IndirectObject(self.PAGES, 0, None)
+            number = numbers[(reference.idnum, reference.generation)]
+            self._write_object(number, copied)
+            self.pages.append(number)
+        while pending:
+            obj = pending.pop()
+            self._write_object(numbers[(obj.idnum, obj.generation)], copy(obj.get_object()))
+
+    # Function to write the page tree, catalog and cross-reference table that complete the file
+    def finish(self):
+        generic = self.pypdf.generic
+        self._write_object(self.PAGES, generic.DictionaryObject({
+            generic.NameObject('/Type'): generic.NameObject('/Pages'),
+            generic.NameObject('/Kids'): generic.ArrayObject(generic.IndirectObject(number, 0, None)
+                                                             for number in self.pages),
+            generic.NameObject('/Count'): generic.NumberObject(len(self.pages)),
+        }))
+        catalog = self._new_number()
+        self._write_object(catalog, generic.DictionaryObject({
+            generic.NameObject('/Type'): generic.NameObject('/Catalog'),
+            generic.NameObject('/Pages'): generic.IndirectObject(self.PAGES, 0, None),
+        }))
+        xref = self.position
+        entries = ['0000000000 65535 f \n'] + [f'{offset:010d} 00000 n \n' for offset in self.offsets[1:]]
+        self._write(f'xref\n0 {len(self.offsets)}\n{"".join(entries)}'
+                    f'trailer\n<< /Size {len(self.offsets)} /Root {catalog} 0 R >>\n'
+                    f'startxref\n{xref}\n%%EOF\n'.encode('ascii'))
+
+
+# Function to render invoices for many orders into a ZIP archive or one merged PDF written to output
+# (a path or a binary file object); returns the rendered and skipped order ids
+@timed('generate_invoices')
+def generate_invoices(jobs, output, output_format='zip', workers=None, progress=None):
+    rendered, skipped = [], []
+    results = render_invoices(jobs, workers)
+    if output_format == 'zip':
+        # Each PDF is written to the archive as soon as it arrives and then dropped
+        with zipfile.ZipFile(output, 'w', zipfile.ZIP_DEFLATED) as archive:
+            for order_id, pdf in results:
+                if pdf is None:
+                    skipped.append(order_id)
+                else:
+                    archive.writestr(f'bill_order_{order_id}.pdf', pdf)
+                    rendered.append(order_id)
+                if progress:
+                    progress(len(rendered) + len(skipped))
+    elif output_format == 'pdf':
+        # Each PDF is copied into the merged file as soon as it arrives and then dropped
+        out = open(output, 'wb') if isinstance(output, (str, os.PathLike)) else output
+        try:
+            merged = MergedPdf(out)
+            for order_id, pdf in results:
+                if pdf is None:
+                    skipped.append(order_id)
+                else:
+                    merged.append(pdf)
+                    rendered.append(order_id)
+                if progress:
+                    progress(len(rendered) + len(skipped))
+            merged.finish()
+        finally:
+            if out is not output:
+                out.close()
+    else:
+        raise ValueError(f'Unknown invoice output format: {output_format}')
+    return rendered, skipped
+
+
+def main():
+    from OrderCore import get_core
+
+    parser = argparse.ArgumentParser(description='Generate invoices for many orders at once')
+    parser.add_argument('--orders', nargs='*', help='order ids to invoice (default: all orders)')
+    parser.add_argument('--since', help='first creation date to include, YYYY-MM-DD')
+    parser.add_argument('--until', help='last creation date to include, YYYY-MM-DD')
+    parser.add_argument('--format', choices=['zip', 'pdf'], default='zip', help='one ZIP of PDFs or one merged PDF')
+    parser.add_argument('--output', help='output file (default: invoices.zip / invoices.pdf)')
+    parser.add_argument('--workers', type=int, help='number of worker processes')
+    args = parser.parse_args()
+
+    core = get_core()
+    customer_store = core.customer_store
+    product_store = core.product_store
+    # Archived months are included, for old order ids and date ranges alike
+    selected = select_orders(core.order_history(args.since, args.until), args.orders)
+    output = args.output or f'invoices.{args.format}'
+    rendered, skipped = generate_invoices(invoice_jobs(selected, customer_store, product_store), output,
+                                          args.format, args.workers)
+    print(f'{len(rendered)} invoices written to {output}')
+    if skipped:
+        print(f'Skipped orders without a customer: {", ".join(skipped)}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,147 @@
+import os
+import threading
+from collections import OrderedDict
+from Invoice import generate_invoice, invoice_key
+from Journal import atomic_write
+from Metrics import count
+from Settings import INVOICE_CACHE_BYTES, INVOICE_CACHE_DIR, INVOICE_CACHE_DISK_BYTES
+
+# Cache of rendered invoice PDFs, keyed by a hash of the order, customer and product fields on the invoice.
+# Memory tier: LRU bounded by a byte budget. Disk tier (optional): one '<key>.pdf' file per invoice.
+
+
+class InvoiceCache:
+    def __init__(self, max_bytes, directory=None, max_disk_bytes=0):
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.max_disk_bytes = max_disk_bytes
+        self.hits = 0
+        self.misses = 0
+        self.size = 0
+        self._entries = OrderedDict()
+        # Record id -> cache keys, so changing a record evicts the invoices it appears on
+        self._keys_by_record = {}
+        # Cache key -> record ids, to drop the key from _keys_by_record once the invoice has left both tiers
+        self._records_by_key = {}
+        self._lock = threading.Lock()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    # Function to get the PDF bytes of an order's invoice, rendering it only on a cache miss
+    def get_invoice(self, order, customer, product_store):
+        key = invoice_key(order, customer, product_store)
+        pdf = self._get(key)
+        if pdf is None:
+            pdf = generate_invoice(order, customer, product_store).getvalue()
+            self._put(key, pdf)
+        self._remember(key, order, customer)
+        return pdf
+
+    def _get(self, key):
+        with self._lock:
+            pdf = self._entries.get(key)
+            if pdf is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                count('invoice_cache_hits')
+                return pdf
+        path = self._path(key)
+        if path and os.path.exists(path):
+            with open(path, 'rb') as f:
+                pdf = f.read()
+            self._put(key, pdf, to_disk=False)
+            with self._lock:
+                self.hits += 1
+                count('invoice_cache_hits')
+            return pdf
+        with self._lock:
+            self.misses += 1
+            count('invoice_cache_misses')
+        return None
+
+    def _put(self, key, pdf, to_disk=True):
+        with self._lock:
+            if key not in self._entries and len(pdf) <= self.max_bytes:
+                self._entries[key] = pdf
+                self.size += len(pdf)
+                while self.size > self.max_bytes:
+                    evicted_key, evicted = self._entries.popitem(last=False)
+                    self.size -= len(evicted)
+                    if not self._stored(evicted_key):
+                        self._forget(evicted_key)
+        path = self._path(key)
+        if to_disk and path:
+            atomic_write(path, pdf)
+            self._prune_disk()
+
+    def _remember(self, key, order, customer):
+        with self._lock:
+            # An invoice too large for either tier was never stored
+            if not self._stored(key):
+                return
+            records = [('order', order['order_id']), ('customer', customer['id'])]
+            records += [('product', line['product_id']) for line in order['products']]
+            records = set((kind, str(record_id)) for kind, record_id in records)
+            for record in records:
+                self._keys_by_record.setdefault(record, set()).add(key)
+            self._records_by_key.setdefault(key, set()).update(records)
+
+    # Function to tell whether an invoice is still held in memory or on disk
+    def _stored(self, key):
+        path = self._path(key)
+        return key in self._entries or bool(path and os.path.exists(path))
+
+    # Function to drop a key that has left both tiers from the reverse index (called with the lock held)
+    def _forget(self, key):
+        for record in self._records_by_key.pop(key, ()):
+            keys = self._keys_by_record.get(record)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._keys_by_record[record]
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.pdf') if self.directory else None
+
+    # Function to keep the disk tier within its byte budget, dropping the least recently written files
+    def _prune_disk(self):
+        if not self.max_disk_bytes:
+            return
+        files = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.pdf'):
+                stat = entry.stat()
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            key = os.path.basename(path)[:-len('.pdf')]
+            with self._lock:
+                if key not in self._entries:
+                    self._forget(key)
+
+    # Function to drop every cached invoice showing a record ('order', 'customer' or 'product')
+    def invalidate(self, kind, record_id):
+        with self._lock:
+            keys = self._keys_by_record.pop((kind, str(record_id)), set())
+            for key in keys:
+                pdf = self._entries.pop(key, None)
+                if pdf is not None:
+                    self.size -= len(pdf)
+                self._forget(key)
+        for key in keys:
+            path = self._path(key)
+            if path and os.path.exists(path):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+
+invoice_cache = InvoiceCache(INVOICE_CACHE_BYTES, INVOICE_CACHE_DIR or None, INVOICE_CACHE_DISK_BYTES)
@@ -0,0 +1,369 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from Export import (EXPORT_FORMATS, EXPORT_MIME_TYPES, PRODUCT_COLUMNS, CUSTOMER_COLUMNS, ORDER_COLUMNS, write_export,
+                    product_rows, customer_rows, order_rows)
+from Invoice import select_orders, invoice_jobs, generate_invoices
+from Metrics import count, timed
+from Settings import JOB_DIR, JOB_WORKERS, JOB_USER_RUNNING, JOB_USER_PENDING, JOB_RESULT_TTL, INVOICE_WORKERS
+
+# Background jobs for long exports and batch invoice runs. Jobs are rows in a SQLite table (JOB_DIR/jobs.db)
+# and run on a small thread pool; the result of each job is one file next to the table, kept for JOB_RESULT_TTL
+# seconds after the job finishes. A user runs at most JOB_USER_RUNNING jobs at once, so one huge export does
+# not hold every worker, and has at most JOB_USER_PENDING jobs queued or running.
+# Jobs left running by a process that has since exited are queued again at startup. Cancelling a running job
+# sets its cancel_requested flag in the table, so the process running it stops the job whichever process asked.
+
+JOB_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    owner TEXT NOT NULL,
+    params TEXT NOT NULL,
+    status TEXT NOT NULL,
+    done INTEGER NOT NULL DEFAULT 0,
+    total INTEGER,
+    message TEXT,
+    file_name TEXT,
+    mime TEXT,
+    pid INTEGER,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    expires_at REAL,
+    cancel_requested INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_owner ON jobs(owner, created_at);
+CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status, created_at);
+'''
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+FINISHED_STATUSES = (DONE, FAILED, CANCELLED)
+
+# Seconds between progress writes to the job table, and between checks of a running job's cancel_requested flag
+PROGRESS_INTERVAL = 0.5
+
+
+# Raised when a user already has as many jobs queued or running as allowed
+class JobLimit(Exception):
+    pass
+
+
+class JobCancelled(Exception):
+    pass
+
+
+# Records (as they are now; later changes do not shift the rows being written), record count, columns and
+# row generator of each exportable dataset; order exports stream the archived orders month by month
+EXPORT_DATASETS = {
+    'products': (lambda core: list(core.product_store.records), lambda core: len(core.product_store.records),
+                 PRODUCT_COLUMNS, lambda core, records: product_rows(records)),
+    'customers': (lambda core: list(core.customer_store.records), lambda core: len(core.customer_store.records),
+                  CUSTOMER_COLUMNS, lambda core, records: customer_rows(records)),
+    'orders': (lambda core: core.order_history(), lambda core: core.order_count(),
+               ORDER_COLUMNS, lambda core, records: order_rows(records, core.product_store)),
+}
+
+
+# Function to pass records through while reporting how many have been consumed
+def counted(records, progress):
+    done = 0
+    for record in records:
+        yield record
+        done += 1
+        progress(done)
+
+
+# Job: export a dataset; params {'dataset', 'format'}
+def run_export(core, params, out, progress):
+    get_records, count_records, columns, make_rows = EXPORT_DATASETS[params['dataset']]
+    export_format = params['format']
+    # Counted first for the progress total, then streamed into the file without holding every record
+    progress(0, count_records(core))
+    exported = 0
+
+    # Function to report progress, remembering how many records have been written
+    def written(done):
+        nonlocal exported
+        exported = done
+        progress(done)
+
+    write_export(make_rows(core, counted(get_records(core), written)), columns, export_format, out)
+    return f'{params["dataset"]}.{export_format}', EXPORT_MIME_TYPES[export_format], f'{exported} records'
+
+
+# Job: render invoices into a ZIP or merged PDF; params {'order_ids'?, 'since'?, 'until'?, 'format'}
+def run_invoices(core, params, out, progress):
+    output_format = params.get('format', 'zip')
+    # Orders are picked from the whole history, so ids and dates may reach back into the archived months
+    orders = core.order_history(params.get('since'), params.get('until'))
+    selected = list(select_orders(orders, params.get('order_ids')))
+    progress(0, len(selected))
+    # Several invoice jobs can run at once, so each gets its share of the worker processes
+    workers = max(1, (INVOICE_WORKERS or os.cpu_count() or 1) // JOB_WORKERS)
+    rendered, skipped = generate_invoices(invoice_jobs(selected, core.customer_store, core.product_store), out,
+                                          output_format, workers, progress)
+    message = f'{len(rendered)} invoices'
+    if skipped:
+        message += f'; customer information not found for orders: {", ".join(skipped)}'
+    return f'invoices.{output_format}', 'application/zip' if output_format == 'zip' else 'application/pdf', message
+
+
+JOB_KINDS = {
+    'export': run_export,
+    'invoices': run_invoices,
+}
+
+
+# Function to check the parameters of a new job, raising ValueError when they cannot run
+def check_params(kind, params):
+    if kind not in JOB_KINDS:
+        raise ValueError(f'Unknown job kind: {kind}')
+    if kind == 'export':
+        if params.get('dataset') not in EXPORT_DATASETS:
+            raise ValueError(f'dataset must be one of {", ".join(EXPORT_DATASETS)}')
+        if params.get('format') not in EXPORT_FORMATS:
+            raise ValueError(f'format must be one of {", ".join(EXPORT_FORMATS)}')
+    elif params.get('format', 'zip') not in ('zip', 'pdf'):
+        raise ValueError('format must be zip or pdf')
+
+
+# Function to add the columns that job tables created by older versions lack
+def upgrade_job_table(conn):
+    columns = [row[1] for row in conn.execute('PRAGMA table_info(jobs)')]
+    if 'cancel_requested' not in columns:
+        with conn:
+            conn.execute('ALTER TABLE jobs ADD COLUMN cancel_requested INTEGER NOT NULL DEFAULT 0')
+
+
+# Function to tell whether a process id belongs to a running process
+def process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except (PermissionError, OSError):
+        return True
+    return True
+
+
+class JobQueue:
+    def __init__(self, core, directory=JOB_DIR, workers=JOB_WORKERS, user_running=JOB_USER_RUNNING,
+                 user_pending=JOB_USER_PENDING, ttl=JOB_RESULT_TTL):
+        self.core = core
+        self.directory = directory
+        self.workers = workers
+        self.user_running = user_running
+        self.user_pending = user_pending
+        self.ttl = ttl
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, 'jobs.db')
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        # Jobs running in this process, and the ones asked to stop from this process (others set cancel_requested)
+        self._running = set()
+        self._cancelled = set()
+        self._pool = ThreadPoolExecutor(workers, thread_name_prefix='orderm-job')
+        self._recover()
+        self._dispatch()
+
+    def connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.executescript(JOB_SCHEMA)
+            upgrade_job_table(conn)
+            self._local.conn = conn
+        return conn
+
+    # Function to get the path of a job's result file
+    def result_path(self, job_id):
+        return os.path.join(self.directory, f'{job_id}.result')
+
+    # Function to queue a job for owner; returns its id
+    def submit(self, kind, params, owner):
+        check_params(kind, params)
+        self.purge_expired()
+        conn = self.connection()
+        with conn:
+            pending = conn.execute('SELECT COUNT(*) FROM jobs WHERE owner = ? AND status IN (?, ?)',
+                                   (owner, QUEUED, RUNNING)).fetchone()[0]
+            if pending >= self.user_pending:
+                raise JobLimit(f'{pending} jobs are already queued or running; wait for one to finish')
+            job_id = self.core.id_generator.new_id()
+            conn.execute('INSERT INTO jobs (id, kind, owner, params, status, created_at) VALUES (?, ?, ?, ?, ?, ?)',
+                         (job_id, kind, owner, json.dumps(params), QUEUED, time.time()))
+        count('jobs_submitted')
+        self._dispatch()
+        return job_id
+
+    def _job(self, row):
+        if row is None:
+            return None
+        job = dict(row)
+        job['params'] = json.loads(job['params'])
+        if job['status'] == DONE:
+            job['progress'] = 1.0
+        else:
+            job['progress'] = min(job['done'] / job['total'], 1.0) if job['total'] else 0.0
+        return job
+
+    # Function to get a job as a dict, with its progress as a fraction
+    def get(self, job_id):
+        return self._job(self.connection().execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone())
+
+    # Function to list the jobs of owner, newest first
+    def list(self, owner):
+        self.purge_expired()
+        rows = self.connection().execute('SELECT * FROM jobs WHERE owner = ? ORDER BY created_at DESC, id DESC',
+                                         (owner,))
+        return [self._job(row) for row in rows]
+
+    # Function to get (path, file name, mime type) of a finished job's result, or None
+    def result(self, job_id):
+        job = self.get(job_id)
+        if job is None or job['status'] != DONE or job['expires_at'] < time.time():
+            return None
+        path = self.result_path(job_id)
+        if not os.path.exists(path):
+            return None
+        return path, job['file_name'], job['mime']
+
+    # Function to cancel a queued or running job of owner; returns False when it has already finished
+    def cancel(self, job_id, owner):
+        conn = self.connection()
+        with conn:
+            cancelled = conn.execute('UPDATE jobs SET status = ?, finished_at = ?, expires_at = ? '
+                                     'WHERE id = ? AND owner = ? AND status = ?',
+                                     (CANCELLED, time.time(), time.time() + self.ttl, job_id, owner, QUEUED)).rowcount
+            if not cancelled:
+                # A running job stops at its next progress report, in whichever process runs it
+                cancelled = conn.execute('UPDATE jobs SET cancel_requested = 1 '
+                                         'WHERE id = ? AND owner = ? AND status = ?',
+                                         (job_id, owner, RUNNING)).rowcount
+                if cancelled:
+                    self._cancelled.add(job_id)
+        return bool(cancelled)
+
+    # Function to delete finished jobs past their TTL, with their result files
+    def purge_expired(self):
+        conn = self.connection()
+        expired = [row[0] for row in conn.execute('SELECT id FROM jobs WHERE status IN (?, ?, ?) AND expires_at < ?',
+                                                  FINISHED_STATUSES + (time.time(),))]
+        for job_id in expired:
+            try:
+                os.remove(self.result_path(job_id))
+            except FileNotFoundError:
+                pass
+        if expired:
+            with conn:
+                conn.executemany('DELETE FROM jobs WHERE id = ?', [(job_id,) for job_id in expired])
+        return len(expired)
+
+    # Function to queue again the jobs left running by processes that have exited (cancelling those asked to stop)
+    def _recover(self):
+        conn = self.connection()
+        rows = conn.execute('SELECT id, pid, cancel_requested FROM jobs WHERE status = ?', (RUNNING,)).fetchall()
+        orphans = [row for row in rows if row['pid'] is None or not process_alive(row['pid'])]
+        if orphans:
+            now = time.time()
+            with conn:
+                conn.executemany('UPDATE jobs SET status = ?, done = 0, pid = NULL WHERE id = ?',
+                                 [(QUEUED, row['id']) for row in orphans if not row['cancel_requested']])
+                conn.executemany('UPDATE jobs SET status = ?, pid = NULL, finished_at = ?, expires_at = ? '
+                                 'WHERE id = ?',
+                                 [(CANCELLED, now, now + self.ttl, row['id']) for row in orphans
+                                  if row['cancel_requested']])
+
+    # Function to start queued jobs while workers are free, oldest first, skipping users at their running limit
+    def _dispatch(self):
+        with self._lock:
+            free = self.workers - len(self._running)
+            if free <= 0:
+                return
+            conn = self.connection()
+            running = dict(conn.execute('SELECT owner, COUNT(*) FROM jobs WHERE status = ? GROUP BY owner',
+                                        (RUNNING,)).fetchall())
+            queued = conn.execute('SELECT id, owner FROM jobs WHERE status = ? ORDER BY created_at, id',
+                                  (QUEUED,)).fetchall()
+            for row in queued:
+                if free <= 0:
+                    break
+                if running.get(row['owner'], 0) >= self.user_running:
+                    continue
+                # Another process sharing the table may claim the same job; only one update wins
+                with conn:
+                    claimed = conn.execute('UPDATE jobs SET status = ?, pid = ?, started_at = ? '
+                                           'WHERE id = ? AND status = ?',
+                                           (RUNNING, os.getpid(), time.time(), row['id'], QUEUED)).rowcount
+                if not claimed:
+                    continue
+                running[row['owner']] = running.get(row['owner'], 0) + 1
+                free -= 1
+                self._running.add(row['id'])
+                self._pool.submit(self._run, row['id'])
+
+    def _update(self, job_id, **fields):
+        conn = self.connection()
+        with conn:
+            conn.execute(f'UPDATE jobs SET {", ".join(f"{name} = ?" for name in fields)} WHERE id = ?',
+                         list(fields.values()) + [job_id])
+
+    def _run(self, job_id):
+        job = self.get(job_id)
+        path = self.result_path(job_id)
+        last_write = 0.0
+        last_check = time.monotonic()
+        last_done = 0
+
+        # Function handed to the job to report progress; also where a cancelled job stops
+        def progress(done, total=None):
+            nonlocal last_write, last_check, last_done
+            if job_id in self._cancelled:
+                raise JobCancelled()
+            last_done = done
+            now = time.monotonic()
+            if now - last_check >= PROGRESS_INTERVAL:
+                last_check = now
+                row = self.connection().execute('SELECT cancel_requested FROM jobs WHERE id = ?', (job_id,)).fetchone()
+                if row is not None and row[0]:
+                    raise JobCancelled()
+            if total is not None:
+                self._update(job_id, done=done, total=total)
+                last_write = now
+            elif now - last_write >= PROGRESS_INTERVAL:
+                self._update(job_id, done=done)
+                last_write = now
+
+        try:
+            with timed(f'job {job["kind"]}'), open(path, 'wb') as out:
+                file_name, mime, message = JOB_KINDS[job['kind']](self.core, job['params'], out, progress)
+        except Exception as e:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            status = CANCELLED if isinstance(e, JobCancelled) else FAILED
+            now = time.time()
+            self._update(job_id, status=status, message=None if status == CANCELLED else str(e) or type(e).__name__,
+                         finished_at=now, expires_at=now + self.ttl)
+            count(f'jobs_{status}')
+        else:
+            now = time.time()
+            self._update(job_id, status=DONE, done=last_done, file_name=file_name, mime=mime, message=message,
+                         finished_at=now, expires_at=now + self.ttl)
+            count('jobs_done')
+        finally:
+            with self._lock:
+                self._running.discard(job_id)
+                self._cancelled.discard(job_id)
+            self._dispatch()
@@ -0,0 +1,184 @@
+import json
+import os
+import tempfile
+import threading
+from Locking import file_lock
+from Metrics import count
+from Records import record_json
+
+# Append-only write-ahead journal for the JSON data files.
+# Every mutation is appended as one compact JSON line to '<file>.log'; the full
+# snapshot is only rewritten when the log is compacted.
+
+
+# Function to write a file atomically: write a temp file next to it, then rename over it
+def atomic_write(filename, data):
+    directory = os.path.dirname(os.path.abspath(filename))
+    fd, tmp_path = tempfile.mkstemp(prefix='.' + os.path.basename(filename) + '.', suffix='.tmp', dir=directory)
+    try:
+        with os.fdopen(fd, 'wb' if isinstance(data, bytes) else 'w') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, filename)
+        # json.dumps output is ASCII, so for text the character count is the byte count
+        count('file_bytes_written', len(data))
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+# Function to apply journal entries on top of a list of records
+def replay(records, entries, key):
+    positions = {}
+    for idx, record in enumerate(records):
+        if key in record:
+            positions.setdefault(str(record[key]), idx)
+    for entry in entries:
+        record_id = str(entry['id'])
+        idx = positions.get(record_id)
+        if entry['op'] == 'put':
+            if idx is None:
+                positions[record_id] = len(records)
+                records.append(entry['record'])
+            else:
+                records[idx] = entry['record']
+        elif entry['op'] == 'delete' and idx is not None:
+            records[idx] = None
+            del positions[record_id]
+    return [record for record in records if record is not None]
+
+
+# Function to find where the last line of a binary file of the given size starts
+def last_line_start(f, end, chunk_size=65536):
+    position = end
+    while position > 0:
+        start = max(0, position - chunk_size)
+        f.seek(start)
+        newline = f.read(position - start).rfind(b'\n')
+        if newline >= 0:
+            return start + newline + 1
+        position = start
+    return 0
+
+
+class Journal:
+    def __init__(self, filename, key, compact_every=500):
+        self.filename = filename
+        self.log_filename = filename + '.log'
+        self.lock_filename = filename + '.lock'
+        self.key = key
+        self.compact_every = compact_every
+        self.entries = 0
+        self._lock = threading.Lock()
+        self._compacting = False
+
+    # Function to load the snapshot and replay the log on top of it
+    def load(self, default_data):
+        if os.path.exists(self.filename):
+            with open(self.filename, 'r') as f:
+                records = json.load(f)
+        else:
+            records = list(default_data)
+            atomic_write(self.filename, json.dumps(records, indent=4, default=record_json))
+        entries = self._read_log()
+        self.entries = len(entries)
+        return replay(records, entries, self.key)
+
+    def _read_log(self):
+        if not os.path.exists(self.log_filename):
+            return []
+        entries = []
+        with open(self.log_filename, 'rb') as f:
+            lines = f.readlines()
+        complete = 0
+        for number, line in enumerate(lines):
+            if line.strip():
+                try:
+                    entries.append(json.loads(line))
+                except ValueError:
+                    # A torn last line is what a crash mid-append leaves behind; anything else is corruption
+                    if number == len(lines) - 1:
+                        self._cut_torn_line(complete, complete + len(line))
+                        break
+                    raise
+            complete += len(line)
+        return entries
+
+    # Function to cut a torn last line off the log, so the next append does not join it and get lost with it;
+    # nothing is cut if the log has grown since it was read
+    def _cut_torn_line(self, complete, size):
+        with file_lock(self.lock_filename):
+            with open(self.log_filename, 'r+b') as f:
+                if os.fstat(f.fileno()).st_size != size:
+                    return
+                f.truncate(complete)
+                f.flush()
+                os.fsync(f.fileno())
+
+    # Function to append one mutation ('put' or 'delete') to the log
+    def append(self, op, record):
+        self.append_many([(op, record)])
+
+    # Function to append a batch of (op, record) mutations with a single write and fsync
+    def append_many(self, changes):
+        lines = []
+        for op, record in changes:
+            entry = {'op': op, 'id': str(record[self.key])}
+            if op == 'put':
+                entry['record'] = record
+            lines.append(json.dumps(entry, separators=(',', ':'), default=record_json) + '\n')
+        if not lines:
+            return
+        data = ''.join(lines).encode('utf-8')
+        with file_lock(self.lock_filename), self._lock:
+            with open(self.log_filename, 'a+b') as f:
+                # Drop a line left unfinished by a crash instead of continuing it; it was never acknowledged
+                end = f.seek(0, os.SEEK_END)
+                if end:
+                    f.seek(end - 1)
+                    if f.read(1) != b'\n':
+                        f.truncate(last_line_start(f, end))
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            self.entries += len(lines)
+        count('file_bytes_written', len(data))
+
+    # Function to start a background compaction once the log has grown large enough
+    def maybe_compact(self):
+        with self._lock:
+            if self._compacting or self.entries < self.compact_every:
+                return
+            self._compacting = True
+        # The in-memory records may miss other processes' entries, so the background run rereads the files
+        thread = threading.Thread(target=self.compact, daemon=True)
+        thread.start()
+
+    # Function to write a fresh snapshot (of records, or of the files on disk) and drop the log
+    def compact(self, records=None):
+        try:
+            # Held for the whole run so no process can append between reading the log and dropping it
+            with file_lock(self.lock_filename):
+                if records is None:
+                    records = self.load([])
+                atomic_write(self.filename, json.dumps(records, separators=(',', ':'), default=record_json))
+                with self._lock:
+                    if os.path.exists(self.log_filename):
+                        os.remove(self.log_filename)
+                    self.entries = 0
+        finally:
+            self._compacting = False
+
+
+_journals = {}
+_journals_lock = threading.Lock()
+
+
+# Function to get the shared journal of a data file
+def get_journal(filename, key, compact_every=500):
+    with _journals_lock:
+        if filename not in _journals:
+            _journals[filename] = Journal(filename, key, compact_every)
+        return _journals[filename]
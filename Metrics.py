@@ -0,0 +1,174 @@
+import threading
+import time
+from collections import deque
+from contextlib import ContextDecorator
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from Settings import METRICS_PORT, METRICS_FILE, METRICS_FILE_INTERVAL
+
+# Lightweight in-process instrumentation: timing histograms per operation and plain counters,
+# exported in the Prometheus text format to a file and/or a local HTTP endpoint.
+#   with timed('load_data'): ...      or      @timed('generate_invoice')
+#   count('file_bytes_written', len(data))
+
+# Upper bounds (seconds) of the histogram buckets
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# Recent samples kept per operation for the percentiles on the admin page
+RECENT_SAMPLES = 2048
+
+
+class Histogram:
+    def __init__(self):
+        self.buckets = [0] * len(BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+        self.recent = deque(maxlen=RECENT_SAMPLES)
+
+    def observe(self, seconds):
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                self.buckets[i] += 1
+                break
+        self.count += 1
+        self.sum += seconds
+        self.recent.append(seconds)
+
+    # Function to get a percentile (0-100) of the recent samples, in seconds
+    def percentile(self, pct):
+        samples = sorted(self.recent)
+        if not samples:
+            return None
+        return samples[min(len(samples) - 1, int(round(pct / 100 * (len(samples) - 1))))]
+
+
+class Registry:
+    def __init__(self):
+        self.histograms = {}
+        self.counters = {}
+        self._lock = threading.Lock()
+
+    def observe(self, name, seconds):
+        with self._lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.observe(seconds)
+
+    def count(self, name, value=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def counter_values(self):
+        with self._lock:
+            return dict(self.counters)
+
+    # Function to summarize every operation as {name: {'count', 'p50', 'p95', 'p99', 'max', 'total'}} (seconds)
+    def summary(self):
+        with self._lock:
+            return {name: {'count': h.count, 'p50': h.percentile(50), 'p95': h.percentile(95),
+                           'p99': h.percentile(99), 'max': max(h.recent) if h.recent else None, 'total': h.sum}
+                    for name, h in sorted(self.histograms.items())}
+
+    # Function to render every metric in the Prometheus text exposition format
+    def prometheus(self):
+        lines = ['# HELP orderm_operation_seconds Time spent per operation.',
+                 '# TYPE orderm_operation_seconds histogram']
+        with self._lock:
+            for name, histogram in sorted(self.histograms.items()):
+                label = _label(name)
+                cumulative = 0
+                for bound, bucket in zip(BUCKETS, histogram.buckets):
+                    cumulative += bucket
+                    lines.append(f'orderm_operation_seconds_bucket{{operation="{label}",le="{bound}"}} {cumulative}')
+                lines.append(f'orderm_operation_seconds_bucket{{operation="{label}",le="+Inf"}} {histogram.count}')
+                lines.append(f'orderm_operation_seconds_sum{{operation="{label}"}} {histogram.sum}')
+                lines.append(f'orderm_operation_seconds_count{{operation="{label}"}} {histogram.count}')
+            for name, value in sorted(self.counters.items()):
+                metric = f'orderm_{name}_total'
+                lines.append(f'# TYPE {metric} counter')
+                lines.append(f'{metric} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+# Process-wide registry
+metrics = Registry()
+
+
+# Context manager and decorator recording the duration of a block or call under an operation name
+class timed(ContextDecorator):
+    def __init__(self, name):
+        self.name = name
+
+    # A decorated function may run in several threads at once, so every call gets its own timer
+    def _recreate_cm(self):
+        return timed(self.name)
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        metrics.observe(self.name, time.perf_counter() - self._start)
+
+
+# Function to record the duration of an operation measured elsewhere
+def observe(name, seconds):
+    metrics.observe(name, seconds)
+
+
+# Function to add to a counter
+def count(name, value=1):
+    metrics.count(name, value)
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = metrics.prometheus().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+# Function to write the metrics to a file in the Prometheus text format (e.g. for node_exporter's textfile collector)
+def write_metrics(path):
+    from Journal import atomic_write
+
+    atomic_write(path, metrics.prometheus())
+
+
+_exporting = False
+_exporting_lock = threading.Lock()
+
+
+# Function to start the exporters configured in Settings, once per process: a local http://127.0.0.1:<port>/metrics
+# endpoint and/or a file rewritten periodically. Another process already holding the port keeps serving it.
+def start_exporters():
+    global _exporting
+    with _exporting_lock:
+        if _exporting:
+            return
+        _exporting = True
+    if METRICS_PORT:
+        try:
+            server = ThreadingHTTPServer(('127.0.0.1', METRICS_PORT), MetricsHandler)
+        except OSError:
+            server = None
+        if server is not None:
+            threading.Thread(target=server.serve_forever, daemon=True, name='orderm-metrics-http').start()
+    if METRICS_FILE:
+        def write_periodically():
+            while True:
+                time.sleep(METRICS_FILE_INTERVAL)
+                write_metrics(METRICS_FILE)
+        threading.Thread(target=write_periodically, daemon=True, name='orderm-metrics-file').start()
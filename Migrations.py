@@ -0,0 +1,200 @@
+import argparse
+import json
+import os
+from DataStore import money
+from Ids import get_id_generator
+from Journal import atomic_write
+from Settings import SQLITE_PATH
+from Storage import (ID_REMAP_FILE, SnapshotStorage, SqliteStorage, PartitionedStorage, backfill_created_at,
+                     get_storage, remapped_order_ids)
+
+# One-shot data migrations, run from the command line:
+#   python Migrations.py json-to-sqlite [--db orderm.db]
+#   python Migrations.py remap-ids [--mapping id-remap.json]
+#   python Migrations.py compact-order-lines
+#   python Migrations.py backfill-order-dates [--mapping id-remap.json]
+#   python Migrations.py archive-orders        (with ORDERM_ORDER_PARTITIONS=1)
+# With partitioned orders, the migrations also rewrite the archived months, which are not loaded with orders.json.
+
+DATA_FILES = ['products.json', 'customers.json', 'orders.json']
+
+
+# Function to copy products.json, customers.json and orders.json into an SQLite database
+def migrate_json_to_sqlite(db_path=SQLITE_PATH):
+    source = SnapshotStorage()
+    target = SqliteStorage(db_path)
+    counts = {}
+    for filename in DATA_FILES:
+        data = source.load(filename, [])
+        target.save(filename, data)
+        counts[filename] = len(target.load(filename, []))
+    return counts
+
+
+# Function to apply update(order) to the orders that are not loaded with orders.json (the archived months of
+# partitioned storage), so a migration covers every order; returns how many update() changed
+def update_archived_orders(storage, update):
+    update_archived = getattr(storage, 'update_archived', None)
+    return update_archived('orders.json', update) if update_archived else 0
+
+
+# Function to give every customer and order with a legacy short id (4 characters or less) a new generated id,
+# rewriting the customer_id of orders to match. Records that shared a duplicate id each get their own new id;
+# orders pointing at a duplicated customer id follow the first such customer, like the id index does.
+# A remapped order keeps its old id as 'legacy_id', which also tells backfill_order_dates() that the time
+# in its new id is the migration's and not the order's.
+# Returns {'customers': {old: new}, 'orders': {old: new}, 'ambiguous': order ids} and saves it to mapping_path.
+def remap_legacy_ids(mapping_path=ID_REMAP_FILE, max_length=4):
+    storage = get_storage()
+    generator = get_id_generator()
+    mapping = {'customers': {}, 'orders': {}, 'ambiguous': []}
+    with storage.lock('customers.json'), storage.lock('orders.json'):
+        customers = storage.load('customers.json', [])
+        orders = storage.load('orders.json', [])
+        duplicated = set()
+        for customer in customers:
+            old_id = str(customer.get('id', ''))
+            if len(old_id) > max_length:
+                continue
+            new_id = generator.new_id()
+            if old_id in mapping['customers']:
+                duplicated.add(old_id)
+            else:
+                mapping['customers'][old_id] = new_id
+            customer['id'] = new_id
+        seen_orders = set()
+
+        # Function to remap the ids of one order; returns whether it changed
+        def remap_order(order):
+            changed = False
+            old_id = str(order.get('order_id', ''))
+            if len(old_id) <= max_length:
+                order['order_id'] = generator.new_id()
+                order['legacy_id'] = old_id
+                if old_id not in seen_orders:
+                    mapping['orders'][old_id] = order['order_id']
+                seen_orders.add(old_id)
+                changed = True
+            customer_id = str(order.get('customer_id', ''))
+            if customer_id in mapping['customers']:
+                order['customer_id'] = mapping['customers'][customer_id]
+                if customer_id in duplicated:
+                    mapping['ambiguous'].append(order['order_id'])
+                changed = True
+            return changed
+
+        for order in orders:
+            remap_order(order)
+        # Save the mapping first so the old ids can always be traced, even if a save below fails;
+        # it is saved again once the archived orders have added theirs
+        atomic_write(mapping_path, json.dumps(mapping, indent=4))
+        if update_archived_orders(storage, remap_order):
+            atomic_write(mapping_path, json.dumps(mapping, indent=4))
+        storage.save('customers.json', customers)
+        storage.save('orders.json', orders)
+    return mapping
+
+
+# Function to rewrite orders to one line per product: lines repeating a product at the same price are merged,
+# the copied product names are dropped and every total is recomputed in exact decimal arithmetic.
+# Returns (orders changed, product ids left on several lines because their prices differ).
+def compact_order_lines():
+    storage = get_storage()
+    mixed_prices = set()
+
+    # Function to compact the lines of one order; returns whether it changed
+    def compact_order(order):
+        lines = {}
+        for line in order.get('products', []):
+            key = (str(line['product_id']), money(line['price']))
+            if key not in lines:
+                lines[key] = {'product_id': line['product_id'], 'quantity': 0, 'price': line['price']}
+            lines[key]['quantity'] += line['quantity']
+            # Merged lines keep the stock they reserved between them
+            if line.get('reserved'):
+                lines[key]['reserved'] = lines[key].get('reserved', 0) + line['reserved']
+        compact = list(lines.values())
+        product_ids = [product_id for product_id, _ in lines]
+        mixed_prices.update(product_id for product_id in product_ids if product_ids.count(product_id) > 1)
+        total_amount = float(sum((money(line['price']) * line['quantity'] for line in compact), money(0)))
+        if compact == order.get('products') and total_amount == order.get('total_amount'):
+            return False
+        order['products'] = compact
+        order['total_amount'] = total_amount
+        return True
+
+    with storage.lock('orders.json'):
+        orders = storage.load('orders.json', [])
+        changed = sum(1 for order in orders if compact_order(order))
+        changed += update_archived_orders(storage, compact_order)
+        storage.save('orders.json', orders)
+    return changed, mixed_prices
+
+
+# Function to give orders without created_at/updated_at the creation time embedded in their generated id.
+# Orders remapped from legacy ids (see remap_legacy_ids) stay undated.
+# Returns (orders dated, orders left undated because their ids carry no time of their own).
+def backfill_order_dates(mapping_path=ID_REMAP_FILE):
+    storage = get_storage()
+    with storage.lock('orders.json'):
+        orders = storage.load('orders.json', [])
+        dated = backfill_created_at(orders, 'order_id', remapped_order_ids(mapping_path))
+        if dated:
+            storage.save('orders.json', orders)
+    return dated, sum(1 for order in orders if not order.get('created_at'))
+
+
+# Function to split orders.json into monthly partitions and archive the months outside the hot window.
+# Returns [(month, archived, size in bytes)] of every partition.
+def archive_orders():
+    storage = get_storage()
+    if not isinstance(storage, PartitionedStorage):
+        raise RuntimeError('Order partitions are off; set ORDERM_ORDER_PARTITIONS=1 with the JSON storage')
+    with storage.lock('orders.json'):
+        storage.load('orders.json', [])
+    return [(month, archived, os.path.getsize(path)) for month, path, archived in storage.partitions('orders.json')]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Order management data migrations')
+    commands = parser.add_subparsers(dest='command', required=True)
+    to_sqlite = commands.add_parser('json-to-sqlite', help='copy the JSON data files into an SQLite database')
+    to_sqlite.add_argument('--db', default=SQLITE_PATH, help='SQLite database path')
+    remap = commands.add_parser('remap-ids', help='replace legacy 4-character customer and order ids')
+    remap.add_argument('--mapping', default=ID_REMAP_FILE, help='file receiving the old -> new id mapping')
+    commands.add_parser('compact-order-lines', help='merge repeated order lines and recompute order totals')
+    backfill = commands.add_parser('backfill-order-dates', help='date orders from the creation time in their ids')
+    backfill.add_argument('--mapping', default=ID_REMAP_FILE,
+                          help='mapping written by remap-ids; the orders it lists are left undated')
+    commands.add_parser('archive-orders', help='partition orders by month and compress the old months')
+    args = parser.parse_args()
+
+    if args.command == 'json-to-sqlite':
+        for filename, count in migrate_json_to_sqlite(args.db).items():
+            print(f'{filename}: {count} records migrated to {args.db}')
+    elif args.command == 'compact-order-lines':
+        changed, mixed_prices = compact_order_lines()
+        print(f'{changed} orders compacted')
+        if mixed_prices:
+            print(f'Kept separate lines for products added at different prices: {", ".join(sorted(mixed_prices))}')
+    elif args.command == 'backfill-order-dates':
+        dated, undated = backfill_order_dates(args.mapping)
+        print(f'{dated} orders dated from their ids, {undated} orders left without a creation date')
+    elif args.command == 'archive-orders':
+        try:
+            partitions = archive_orders()
+        except RuntimeError as e:
+            parser.error(str(e))
+        for month, archived, size in partitions:
+            print(f'{month}: {"archived" if archived else "hot"}, {size} bytes')
+    elif args.command == 'remap-ids':
+        mapping = remap_legacy_ids(args.mapping)
+        print(f'{len(mapping["customers"])} customer ids and {len(mapping["orders"])} order ids remapped, '
+              f'mapping saved to {args.mapping}')
+        if mapping['ambiguous']:
+            print(f'{len(mapping["ambiguous"])} orders referenced a duplicated customer id: '
+                  f'{", ".join(mapping["ambiguous"])}')
+
+
+if __name__ == '__main__':
+    main()
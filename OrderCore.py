@@ -0,0 +1,403 @@
+import threading
+from itertools import chain, islice
+from DataStore import IndexedStore, OrderStore, next_version, text_key, money, order_line, timestamp
+from Storage import get_storage
+from DataCache import DatasetCache
+from Analytics import OrderAnalytics
+from Invoice import select_orders
+from InvoiceCache import invoice_cache
+from Ingest import parse_quantity
+from Inventory import Inventory, OutOfStock
+from Jobs import JobQueue
+from Search import CustomerSearch
+from Ids import get_id_generator
+from Records import Product, Customer, Order, OrderLine, to_records
+from Metrics import timed, start_exporters
+from Settings import IMPORT_BATCH_SIZE
+
+# Headless core of the order management system: data loading, CRUD and invoices.
+# Importing this module loads nothing; the data is read on first use of get_core().
+
+# Sorted indexes kept on each dataset for paginated queries
+PRODUCT_SORTED_FIELDS = {'name': text_key, 'price': float, 'quantity': float}
+CUSTOMER_SORTED_FIELDS = {'name': text_key}
+
+
+class OrderCore:
+    def __init__(self, storage=None):
+        self.storage = storage or get_storage()
+        # Cache of loaded datasets shared by every caller in this process
+        self.dataset_cache = DatasetCache(self.storage)
+        self._analytics = None
+        self._analytics_lock = threading.Lock()
+        self._jobs = None
+        self._jobs_lock = threading.Lock()
+        self._search = None
+        self._search_lock = threading.Lock()
+        # Sortable, collision-free ids for new customers and orders
+        self.id_generator = get_id_generator()
+        # Stock reservation for order lines
+        self.inventory = Inventory(self)
+
+    # Function to load data from the storage backend
+    @timed('load_data')
+    def load_data(self, filename, default_data):
+        return self.storage.load(filename, default_data)
+
+    # Function to save data to the storage backend
+    @timed('save_data')
+    def save_data(self, data, filename):
+        self.dataset_cache.write(filename, lambda: self.storage.save(filename, data))
+
+    # Function to persist a single added, updated or deleted record
+    @timed('save_data')
+    def save_change(self, data, filename, op, record):
+        self.dataset_cache.write(filename, lambda: self.storage.save_change(filename, data, op, record))
+
+    # Function to persist a batch of (op, record) changes with a single write
+    @timed('save_data')
+    def save_changes(self, data, filename, changes):
+        self.dataset_cache.write(filename, lambda: self.storage.save_changes(filename, data, changes))
+
+    # Function to load a dataset as compact records wrapped in its indexed store, reusing the cached one
+    # while the file is unchanged
+    def load_store(self, filename, store_class, key, sorted_fields=None):
+        return self.dataset_cache.get(
+            filename, lambda: store_class(to_records(filename, self.load_data(filename, [])), key, sorted_fields),
+            lambda store: store.replace_all(to_records(filename, self.load_data(filename, []))))
+
+    @property
+    def product_store(self):
+        return self.load_store('products.json', IndexedStore, 'id', PRODUCT_SORTED_FIELDS)
+
+    @property
+    def customer_store(self):
+        return self.load_store('customers.json', IndexedStore, 'id', CUSTOMER_SORTED_FIELDS)
+
+    @property
+    def order_store(self):
+        return self.load_store('orders.json', OrderStore, 'order_id')
+
+    # Revenue aggregates over the full order history, kept up to date by order store events
+    @property
+    def order_analytics(self):
+        order_store = self.order_store
+        with self._analytics_lock:
+            if self._analytics is None:
+                self._analytics = OrderAnalytics(order_store, self.archived_orders, self.archived_orders_signature)
+            return self._analytics
+
+    # Function to iterate over the archived orders, which are not loaded with the order store (partitioned
+    # storage only), optionally only from the months overlapping since/until ('YYYY-MM-DD' bounds)
+    def archived_orders(self, since=None, until=None):
+        archived = getattr(self.storage, 'archived', None)
+        if archived is None:
+            return iter(())
+        return (order if isinstance(order, Order) else Order(order)
+                for order in archived('orders.json', since, until))
+
+    # Function to get a value that changes whenever the archived orders change (None without partitions)
+    def archived_orders_signature(self):
+        archived_signature = getattr(self.storage, 'archived_signature', None)
+        return archived_signature('orders.json') if archived_signature else None
+
+    # Function to iterate over every order, archived ones first, optionally only those created in [since, until];
+    # the archived months are read as the iteration reaches them, the hot orders are the ones loaded at the call
+    def order_history(self, since=None, until=None):
+        orders = chain(self.archived_orders(since, until), list(self.order_store.records))
+        if since or until:
+            orders = select_orders(orders, since=since, until=until)
+        return orders
+
+    # Function to count every order, archived ones included
+    def order_count(self):
+        archived_count = getattr(self.storage, 'archived_count', None)
+        return len(self.order_store.records) + (archived_count('orders.json') if archived_count else 0)
+
+    # Function to find an order by id, looking through the archive when it is not a recent one
+    def find_order(self, order_id):
+        order = self.order_store.get(order_id)
+        find_archived = getattr(self.storage, 'find_archived', None)
+        if order is None and find_archived is not None:
+            order = find_archived('orders.json', order_id)
+            if order is not None:
+                order = Order(order)
+        return order
+
+    # Search index over the customers, kept up to date by customer store events
+    @property
+    def customer_search(self):
+        customer_store = self.customer_store
+        with self._search_lock:
+            if self._search is None:
+                self._search = CustomerSearch(customer_store)
+            return self._search
+
+    # Background job queue for large exports and batch invoices, started on first use
+    @property
+    def jobs(self):
+        with self._jobs_lock:
+            if self._jobs is None:
+                self._jobs = JobQueue(self)
+            return self._jobs
+
+    # Function to add a new product
+    @timed('add_product')
+    def add_product(self, product_id, name, price, quantity):
+        new_product = Product({
+            'id': product_id,
+            'name': name,
+            'price': price,
+            'quantity': quantity,
+            'version': 1
+        })
+        with self.dataset_cache.locked('products.json'):
+            product_store = self.product_store
+            product_store.add(new_product)
+            self.save_change(product_store.records, 'products.json', 'put', new_product)
+        return new_product
+
+    # Function to update an existing product, optionally only if it is still at expected_version
+    @timed('update_product')
+    def update_product(self, product_id, name, price, quantity, expected_version=None):
+        with self.dataset_cache.locked('products.json'):
+            product_store = self.product_store
+            product = product_store.get(product_id)
+            if product is None:
+                return False
+            version = next_version(product, expected_version)
+            product_store.update(product_id, name=name, price=price, quantity=quantity, version=version)
+            self.save_change(product_store.records, 'products.json', 'put', product)
+        invoice_cache.invalidate('product', product_id)
+        return True
+
+    # Function to delete a product
+    @timed('delete_product')
+    def delete_product(self, product_id):
+        with self.dataset_cache.locked('products.json'):
+            product_store = self.product_store
+            product = product_store.remove(product_id)
+            if product is None:
+                return False
+            self.save_change(product_store.records, 'products.json', 'delete', product)
+        invoice_cache.invalidate('product', product_id)
+        return True
+
+    # Function to add a new customer
+    @timed('add_customer')
+    def add_customer(self, name, address, mobile, email):
+        new_customer = Customer({
+            'id': self.id_generator.new_id(),
+            'name': name,
+            'address': address,
+            'mobile': mobile,
+            'email': email,
+            'version': 1
+        })
+        with self.dataset_cache.locked('customers.json'):
+            customer_store = self.customer_store
+            customer_store.add(new_customer)
+            self.save_change(customer_store.records, 'customers.json', 'put', new_customer)
+        return new_customer
+
+    # Function to update an existing customer, optionally only if it is still at expected_version
+    @timed('update_customer')
+    def update_customer(self, customer_id, name, address, mobile, email, expected_version=None):
+        with self.dataset_cache.locked('customers.json'):
+            customer_store = self.customer_store
+            customer = customer_store.get(customer_id)
+            if customer is None:
+                return False
+            # Update customer details
+            version = next_version(customer, expected_version)
+            customer_store.update(customer_id, name=name, address=address, mobile=mobile, email=email, version=version)
+            self.save_change(customer_store.records, 'customers.json', 'put', customer)
+        invoice_cache.invalidate('customer', customer_id)
+        return True
+
+    # Function to delete a customer
+    @timed('delete_customer')
+    def delete_customer(self, customer_id):
+        with self.dataset_cache.locked('customers.json'):
+            customer_store = self.customer_store
+            customer = customer_store.remove(customer_id)
+            if customer is None:
+                return False
+            self.save_change(customer_store.records, 'customers.json', 'delete', customer)
+        invoice_cache.invalidate('customer', customer_id)
+        return True
+
+    # Function to add a new order
+    @timed('add_order')
+    def add_order(self, customer_id):
+        now = timestamp()
+        new_order = Order({
+            'order_id': self.id_generator.new_id(),
+            'customer_id': customer_id,
+            'products': [],
+            'total_amount': 0.0,
+            'created_at': now,
+            'updated_at': now,
+            'version': 1
+        })
+        with self.dataset_cache.locked('orders.json'):
+            order_store = self.order_store
+            order_store.add(new_order)
+            self.save_change(order_store.records, 'orders.json', 'put', new_order)
+        return new_order
+
+    # Function to add quantity of a product to an order, or with replace=True set the product's quantity in it;
+    # an order holds one line per product, which keeps the price it was first added at.
+    # Optionally only if the order is still at expected_version.
+    @timed('update_order')
+    def update_order(self, order_id, product_id, quantity, expected_version=None, replace=False):
+        with self.dataset_cache.locked('orders.json'):
+            order_store = self.order_store
+            order = order_store.get(order_id)
+            product = self.product_store.get(product_id)
+            if order is None or product is None:
+                return False
+            version = next_version(order, expected_version)
+            line = order_line(order, product['id'])
+            old_quantity = line['quantity'] if line else 0
+            new_quantity = quantity if replace else old_quantity + quantity
+            # An increase is reserved; a decrease gives back no more than the line has reserved
+            reserved = (line.get('reserved') or 0) if line else 0
+            if new_quantity >= old_quantity:
+                taken = new_quantity - old_quantity
+            else:
+                taken = -min(reserved, old_quantity - new_quantity)
+            # Raises OutOfStock before the order is touched
+            self.inventory.reserve({product['id']: taken})
+            if line is None:
+                line = OrderLine(product_id=product['id'], quantity=new_quantity, price=product['price'],
+                                 reserved=taken)
+                order['products'].append(line)
+            else:
+                line['quantity'] = new_quantity
+                line['reserved'] = reserved + taken
+            # Only the changed amount is added, in exact decimal arithmetic
+            total_amount = money(order['total_amount']) + money(line['price']) * (new_quantity - old_quantity)
+            order_store.update(order_id, total_amount=float(total_amount), updated_at=timestamp(), version=version)
+            self.save_change(order_store.records, 'orders.json', 'put', order)
+        invoice_cache.invalidate('order', order_id)
+        return True
+
+    # Function to delete an order
+    @timed('delete_order')
+    def delete_order(self, order_id):
+        with self.dataset_cache.locked('orders.json'):
+            order_store = self.order_store
+            order = order_store.remove(order_id)
+            if order is None:
+                return False
+            self.save_change(order_store.records, 'orders.json', 'delete', order)
+            self.inventory.release(order)
+        invoice_cache.invalidate('order', order_id)
+        return True
+
+    # Function to validate an order spec from Ingest.order_specs against the indexes and build the order,
+    # returning (order, None) or (None, (row, message))
+    def build_order(self, spec):
+        if 'error' in spec:
+            return None, spec['error']
+        if self.customer_store.get(spec['customer_id']) is None:
+            return None, (spec['row'], f'Customer {spec["customer_id"] or "(empty)"} not found')
+        if not spec['lines']:
+            return None, (spec['row'], 'Order has no lines')
+        lines = {}
+        total_amount = money(0)
+        for line in spec['lines']:
+            product = self.product_store.get(line['product_id'])
+            if product is None:
+                return None, (line['row'], f'Product {line["product_id"] or "(empty)"} not found')
+            quantity = parse_quantity(line['quantity'])
+            if quantity is None:
+                return None, (line['row'], f'Quantity {line["quantity"]!r} is not a positive whole number')
+            # Rows repeating a product add to its one line
+            if product['id'] in lines:
+                lines[product['id']]['quantity'] += quantity
+            else:
+                lines[product['id']] = OrderLine(product_id=product['id'], quantity=quantity, price=product['price'])
+            total_amount += money(product['price']) * quantity
+        now = timestamp()
+        order = Order({
+            'order_id': self.id_generator.new_id(),
+            'customer_id': spec['customer_id'],
+            'products': list(lines.values()),
+            'total_amount': float(total_amount),
+            'created_at': now,
+            'updated_at': now,
+            'version': 1
+        })
+        if spec['order_ref']:
+            order['order_ref'] = spec['order_ref']
+        return order, None
+
+    # Function to create orders from a stream of order specs, committing once per batch;
+    # a bad row only skips its own order and is reported in 'errors' as (row, message)
+    @timed('import_orders')
+    def import_orders(self, specs, batch_size=IMPORT_BATCH_SIZE):
+        result = {'created': [], 'errors': [], 'batches': 0}
+        specs = iter(specs)
+        while True:
+            batch = list(islice(specs, batch_size))
+            if not batch:
+                return result
+            with self.dataset_cache.locked('orders.json'), self.inventory.locked():
+                order_store = self.order_store
+                changes = []
+                stocked = {}
+                for spec in batch:
+                    order, error = self.build_order(spec)
+                    if error is None:
+                        demands = {}
+                        for line in order['products']:
+                            demands[line['product_id']] = demands.get(line['product_id'], 0) + line['quantity']
+                        try:
+                            for product in self.inventory.reserve(demands, save=False):
+                                stocked[product['id']] = product
+                            for line in order['products']:
+                                line['reserved'] = line['quantity']
+                        except OutOfStock as e:
+                            error = (spec['row'], str(e))
+                    if error is not None:
+                        result['errors'].append(error)
+                        continue
+                    order_store.add(order)
+                    changes.append(('put', order))
+                if changes:
+                    self.save_changes(order_store.records, 'orders.json', changes)
+                    self.save_changes(self.product_store.records, 'products.json',
+                                      [('put', product) for product in stocked.values()])
+                    result['batches'] += 1
+            result['created'].extend(order['order_id'] for _, order in changes)
+
+    # Function to list products whose stock is at or below threshold; returns (page, total)
+    def low_stock(self, threshold, offset=0, limit=None):
+        return self.inventory.low_stock(threshold, offset, limit)
+
+    # Function to get the invoice PDF of an order; returns None when the order or its customer is unknown
+    @timed('get_invoice')
+    def get_invoice(self, order_id):
+        order = self.find_order(order_id)
+        if order is None or 'customer_id' not in order:
+            return None
+        customer = self.customer_store.get(order['customer_id'])
+        if customer is None:
+            return None
+        return invoice_cache.get_invoice(order, customer, self.product_store)
+
+
+_core = None
+_core_lock = threading.Lock()
+
+
+# Function to get the process-wide core, created on first use
+def get_core():
+    global _core
+    with _core_lock:
+        if _core is None:
+            _core = OrderCore()
+            start_exporters()
+        return _core
@@ -0,0 +1,209 @@
+import argparse
+import json
+import random
+import sys
+import tracemalloc
+from collections.abc import MutableMapping
+
+# Compact in-memory record types for products, customers, orders and order lines.
+# Known fields live in __slots__ instead of a per-record dict, and product names are interned so the
+# same name is stored once however many records carry it. Records behave like the dicts they replace
+# (record['name'], record.get(...), record.update(...), dict(record)); any field outside the slots goes
+# to a small overflow dict, so the JSON files and SQLite rows keep exactly the same format.
+#
+#   python Records.py [--orders 100000]    reports the memory saved compared to plain dicts
+
+
+class Record(MutableMapping):
+    __slots__ = ('_extra',)
+    FIELDS = ()
+    # Text fields whose values are interned
+    INTERNED = ()
+
+    def __init__(self, *args, **fields):
+        self._extra = None
+        self.update(*args, **fields)
+
+    def __getitem__(self, key):
+        if key in self.FIELDS:
+            try:
+                return getattr(self, key)
+            except AttributeError:
+                raise KeyError(key) from None
+        if self._extra is None:
+            raise KeyError(key)
+        return self._extra[key]
+
+    # Same as Mapping.get, without going through __getitem__ and KeyError for every unset field
+    def get(self, key, default=None):
+        if key in self.FIELDS:
+            return getattr(self, key, default)
+        if self._extra is None:
+            return default
+        return self._extra.get(key, default)
+
+    def __setitem__(self, key, value):
+        if key in self.FIELDS:
+            if key in self.INTERNED and type(value) is str:
+                value = sys.intern(value)
+            setattr(self, key, value)
+        else:
+            if self._extra is None:
+                self._extra = {}
+            self._extra[key] = value
+
+    def __delitem__(self, key):
+        if key in self.FIELDS:
+            try:
+                delattr(self, key)
+            except AttributeError:
+                raise KeyError(key) from None
+        elif self._extra is not None and key in self._extra:
+            del self._extra[key]
+        else:
+            raise KeyError(key)
+
+    def __iter__(self):
+        for key in self.FIELDS:
+            if hasattr(self, key):
+                yield key
+        if self._extra:
+            yield from self._extra
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __contains__(self, key):
+        if key in self.FIELDS:
+            return hasattr(self, key)
+        return self._extra is not None and key in self._extra
+
+    # Function to get the fields kept outside the slots, as a dict (or None when there are none)
+    def extra_fields(self):
+        return self._extra
+
+    def __repr__(self):
+        return f'{type(self).__name__}({dict(self)!r})'
+
+    # Pickling (invoice worker processes) goes through the plain field values
+    def __reduce__(self):
+        return type(self), (dict(self),)
+
+
+class Product(Record):
+    FIELDS = ('id', 'name', 'price', 'quantity', 'version')
+    INTERNED = ('name',)
+    __slots__ = FIELDS
+
+
+class Customer(Record):
+    FIELDS = ('id', 'name', 'address', 'mobile', 'email', 'version')
+    __slots__ = FIELDS
+
+
+class OrderLine(Record):
+    # 'name' is only present on lines written before lines stopped copying the product name;
+    # 'reserved' is the stock the line took off its product (absent on lines from before stock reservation)
+    FIELDS = ('product_id', 'quantity', 'price', 'name', 'reserved')
+    INTERNED = ('product_id', 'name')
+    __slots__ = FIELDS
+
+
+class Order(Record):
+    FIELDS = ('order_id', 'customer_id', 'products', 'total_amount', 'created_at', 'updated_at', 'version')
+    INTERNED = ('customer_id',)
+    __slots__ = FIELDS
+
+    def __setitem__(self, key, value):
+        if key == 'products' and isinstance(value, list):
+            value = [line if isinstance(line, OrderLine) else OrderLine(line) for line in value]
+        super().__setitem__(key, value)
+
+
+# Record type of each data file
+RECORD_TYPES = {
+    'products.json': Product,
+    'customers.json': Customer,
+    'orders.json': Order,
+}
+
+
+# Function to convert the records of a data file as loaded from storage into record objects
+def to_records(filename, data):
+    record_type = RECORD_TYPES.get(filename)
+    if record_type is None:
+        return data
+    return [record if isinstance(record, record_type) else record_type(record) for record in data]
+
+
+# Function to build count records of record_type column by column from {field: [values]}, leaving fields whose
+# value is None unset; fills the slots directly, which is several times faster than one record_type(dict) per row
+def records_from_columns(record_type, columns, count):
+    records = [record_type.__new__(record_type) for _ in range(count)]
+    set_extra = Record._extra.__set__
+    for record in records:
+        set_extra(record, None)
+    for field, values in columns.items():
+        set_field = getattr(record_type, field).__set__
+        if field in record_type.INTERNED:
+            values = [value if type(value) is not str else sys.intern(value) for value in values]
+        for record, value in zip(records, values):
+            if value is not None:
+                set_field(record, value)
+    return records
+
+
+# json.dumps default= hook writing record objects as plain JSON objects
+def record_json(value):
+    if isinstance(value, Record):
+        return dict(value)
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+
+# Function to generate synthetic orders as plain dicts, in the format of orders.json
+def sample_orders(count, lines=3, products=1000, customers=10000, seed=0):
+    rng = random.Random(seed)
+    orders = []
+    for number in range(count):
+        orders.append({
+            'order_id': f'O{number:025d}',
+            'customer_id': f'C{rng.randrange(customers):025d}',
+            'products': [{'product_id': f'P{rng.randrange(products):05d}', 'name': f'Product {rng.randrange(products)}',
+                          'quantity': rng.randint(1, 10), 'price': round(rng.uniform(1, 500), 2)}
+                         for _ in range(lines)],
+            'total_amount': 0.0,
+            'version': 1,
+        })
+    return orders
+
+
+# Function to measure the memory (bytes) held by the result of build()
+def measure(build):
+    tracemalloc.start()
+    try:
+        value = build()
+        size = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    return size, value
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Memory of dict records compared to slotted records')
+    parser.add_argument('--orders', type=int, default=100000, help='number of synthetic orders')
+    parser.add_argument('--lines', type=int, default=3, help='lines per order')
+    args = parser.parse_args()
+
+    # Both sides are built from the JSON text, as load_data() would see them
+    text = json.dumps(sample_orders(args.orders, args.lines))
+    dict_bytes, _ = measure(lambda: json.loads(text))
+    record_bytes, _ = measure(lambda: to_records('orders.json', json.loads(text)))
+    total_lines = args.orders * args.lines
+    print(f'{args.orders} orders, {total_lines} lines')
+    print(f'dicts:   {dict_bytes / 2 ** 20:8.1f} MiB ({dict_bytes / total_lines:.0f} bytes per line)')
+    print(f'records: {record_bytes / 2 ** 20:8.1f} MiB ({record_bytes / total_lines:.0f} bytes per line)')
+    print(f'saved:   {(1 - record_bytes / dict_bytes) * 100:.0f}%')
+
+
+if __name__ == '__main__':
+    main()
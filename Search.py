@@ -0,0 +1,359 @@
+import argparse
+import heapq
+import math
+import re
+import threading
+import unicodedata
+from bisect import bisect_left, insort
+from collections import Counter
+
+# In-process search index over customer name, mobile, email, address and id.
+# Every field is split into lowercase tokens; an inverted index maps each token to the customers carrying it,
+# a sorted token list answers prefix matches and a trigram index over the words of names, emails and
+# addresses finds misspellings (ids and phone numbers match exactly or by prefix).
+# The index follows the customer store through its events, so add/update/delete_customer keep it current.
+# It also groups likely duplicate customers: same email, same mobile, or same name at a similar address.
+#
+#   python Search.py "ram ghaziabad"      search customers
+#   python Search.py --duplicates         list likely duplicate customers
+
+# Lowest trigram similarity (shared / all trigrams of two tokens) accepted as a fuzzy match
+FUZZY_SIMILARITY = 0.3
+# Most vocabulary tokens a prefix or fuzzy match may expand one query token into
+MAX_EXPANSION = 200
+# Trigrams carried by more vocabulary tokens than this are too common to look for misspellings with
+COMMON_GRAM_TOKENS = 1000
+# Score of a customer for one query token, by how the token matched
+EXACT_SCORE = 1.0
+PREFIX_SCORE = 0.8
+FUZZY_SCORE = 0.6
+# Lowest address similarity at which two customers with the same name are reported as duplicates
+DUPLICATE_ADDRESS_SIMILARITY = 0.4
+# Digits of a mobile number compared for duplicates, so country prefixes do not hide a match
+MOBILE_DIGITS = 10
+
+TOKEN_RE = re.compile(r'[^\W_]+')
+
+
+# Function to fold text to lowercase without accents
+def fold(value):
+    text = str(value or '')
+    if text.isascii():
+        return text.lower()
+    text = unicodedata.normalize('NFKD', text)
+    return ''.join(c for c in text if not unicodedata.combining(c)).casefold()
+
+
+# Function to split text into search tokens
+def tokenize(value):
+    return TOKEN_RE.findall(fold(value))
+
+
+# Function to get the trigrams of a token, padded so the start and end of a word count
+def trigrams(token):
+    padded = f'  {token} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+# Function to get the trigrams of every word of a text
+def text_trigrams(value):
+    return set().union(*(trigrams(token) for token in tokenize(value)))
+
+
+# Function to compare two trigram sets, from 0 (nothing shared) to 1 (the same trigrams)
+def similarity(grams_a, grams_b):
+    if not grams_a or not grams_b:
+        return 0.0
+    return len(grams_a & grams_b) / len(grams_a | grams_b)
+
+
+# Function to normalize a mobile number for comparison: its last MOBILE_DIGITS digits
+def mobile_key(value):
+    digits = re.sub(r'\D', '', str(value or ''))
+    return digits[-MOBILE_DIGITS:]
+
+
+# Function to normalize an email address for comparison
+def email_key(value):
+    return fold(value).strip()
+
+
+# Function to normalize a name for comparison
+def name_key(value):
+    return ' '.join(tokenize(value))
+
+
+# Function to get the search tokens of a customer, and those of them that misspellings should find
+def customer_tokens(customer):
+    words = set(tokenize(f'{customer.get("name") or ""} {customer.get("email") or ""} '
+                         f'{customer.get("address") or ""}'))
+    tokens = words | set(tokenize(customer.get('id')))
+    mobile = re.sub(r'\D', '', str(customer.get('mobile') or ''))
+    if mobile:
+        # The whole number and its local part, so a search without the country prefix still matches
+        tokens.add(mobile)
+        tokens.add(mobile[-MOBILE_DIGITS:])
+    return tokens, {word for word in words if not word.isdigit()}
+
+
+class CustomerSearch:
+    def __init__(self, customer_store):
+        self.customer_store = customer_store
+        self._lock = threading.Lock()
+        self.rebuild()
+        customer_store.subscribe(self.on_change)
+
+    # Function to rebuild the index from every customer in the store
+    def rebuild(self):
+        with self._lock:
+            self._postings = {}
+            self._tokens_by_id = {}
+            self._vocabulary = []
+            self._grams = {}
+            self._gram_counts = {}
+            # Duplicate keys: normalized email, mobile and name -> customer ids
+            self._keys_by_id = {}
+            self._by_key = {'email': {}, 'mobile': {}, 'name': {}}
+            postings = self._postings
+            words = set()
+            for customer in self.customer_store:
+                if 'id' not in customer:
+                    continue
+                customer_id = str(customer['id'])
+                tokens, customer_words = customer_tokens(customer)
+                self._tokens_by_id[customer_id] = tokens
+                for token in tokens:
+                    ids = postings.get(token)
+                    if ids is None:
+                        postings[token] = {customer_id}
+                    else:
+                        ids.add(customer_id)
+                words |= customer_words
+                self._add_keys(customer_id, customer)
+            self._vocabulary = sorted(postings)
+            for word in words:
+                self._add_grams(word)
+
+    # Store listener keeping the index in step with add_customer/update_customer/delete_customer
+    def on_change(self, event, customer):
+        if event == 'reset':
+            self.rebuild()
+            return
+        with self._lock:
+            self._remove(str(customer['id']))
+            if event != 'remove':
+                self._add(customer)
+
+    def _add(self, customer):
+        if 'id' not in customer:
+            return
+        customer_id = str(customer['id'])
+        tokens, words = customer_tokens(customer)
+        self._tokens_by_id[customer_id] = tokens
+        for token in tokens:
+            ids = self._postings.get(token)
+            if ids is None:
+                ids = self._postings[token] = set()
+                insort(self._vocabulary, token)
+            ids.add(customer_id)
+        for word in words:
+            self._add_grams(word)
+        self._add_keys(customer_id, customer)
+
+    def _add_grams(self, word):
+        if word not in self._gram_counts:
+            grams = trigrams(word)
+            self._gram_counts[word] = len(grams)
+            for gram in grams:
+                tokens = self._grams.get(gram)
+                if tokens is None:
+                    self._grams[gram] = {word}
+                else:
+                    tokens.add(word)
+
+    def _add_keys(self, customer_id, customer):
+        keys = {'email': email_key(customer.get('email')), 'mobile': mobile_key(customer.get('mobile')),
+                'name': name_key(customer.get('name'))}
+        self._keys_by_id[customer_id] = keys
+        for kind, key in keys.items():
+            if key:
+                self._by_key[kind].setdefault(key, set()).add(customer_id)
+
+    def _remove(self, customer_id):
+        for token in self._tokens_by_id.pop(customer_id, ()):
+            ids = self._postings[token]
+            ids.discard(customer_id)
+            if not ids:
+                # Last customer with this token: drop it from the vocabulary and the trigram index
+                del self._postings[token]
+                del self._vocabulary[bisect_left(self._vocabulary, token)]
+                if self._gram_counts.pop(token, None) is not None:
+                    for gram in trigrams(token):
+                        tokens = self._grams[gram]
+                        tokens.discard(token)
+                        if not tokens:
+                            del self._grams[gram]
+        for kind, key in self._keys_by_id.pop(customer_id, {}).items():
+            ids = self._by_key[kind].get(key)
+            if ids is not None:
+                ids.discard(customer_id)
+                if not ids:
+                    del self._by_key[kind][key]
+
+    # Function to find vocabulary tokens starting with prefix
+    def _prefixed(self, prefix):
+        start = bisect_left(self._vocabulary, prefix)
+        matches = []
+        for token in self._vocabulary[start:start + MAX_EXPANSION]:
+            if not token.startswith(prefix):
+                break
+            matches.append(token)
+        return matches
+
+    # Function to find vocabulary tokens similar to token, as {token: similarity}
+    def _similar(self, token):
+        grams = trigrams(token)
+        # A token similar enough shares at least min_shared trigrams, so it carries one of the query's
+        # len - min_shared + 1 rarest trigrams; candidates are only collected from those (when not too common)
+        # and then checked against the rest
+        min_shared = max(1, math.ceil(FUZZY_SIMILARITY * len(grams)))
+        ranked = sorted(grams, key=lambda gram: len(self._grams.get(gram, ())))
+        shared = Counter()
+        checked = []
+        for i, gram in enumerate(ranked):
+            tokens = self._grams.get(gram)
+            if not tokens:
+                continue
+            if i <= len(grams) - min_shared and len(tokens) <= COMMON_GRAM_TOKENS:
+                shared.update(tokens)
+            else:
+                checked.append(tokens)
+        matches = {}
+        for candidate, common in shared.items():
+            common += sum(1 for tokens in checked if candidate in tokens)
+            score = common / (len(grams) + self._gram_counts[candidate] - common)
+            if score >= FUZZY_SIMILARITY:
+                matches[candidate] = score
+        return dict(sorted(matches.items(), key=lambda item: -item[1])[:MAX_EXPANSION])
+
+    # Function to find the vocabulary tokens one query token matches, as {token: score}, best first
+    def _expand(self, token, fuzzy):
+        matches = {}
+        if fuzzy and len(token) >= 3:
+            for candidate, score in self._similar(token).items():
+                matches[candidate] = FUZZY_SCORE * score
+        for candidate in self._prefixed(token):
+            matches[candidate] = EXACT_SCORE if candidate == token else PREFIX_SCORE
+        return dict(sorted(matches.items(), key=lambda item: -item[1]))
+
+    # Function to search customers by any words of their name, mobile, email, address or id; every query word
+    # must match a word of the customer exactly, as a prefix or (with fuzzy) by spelling. Returns the best
+    # matching customers first, as [(customer, score)]
+    def search(self, query, limit=20, fuzzy=True):
+        tokens = list(dict.fromkeys(tokenize(query)))
+        if not tokens:
+            return []
+        with self._lock:
+            expansions = [self._expand(token, fuzzy) for token in tokens]
+            # Start from the query word matching the fewest customers; the other words only check those
+            expansions.sort(key=lambda matches: sum(len(self._postings[token]) for token in matches))
+            total = {}
+            for token, score in reversed(list(expansions[0].items())):
+                # Lower scores first, so a customer ends up with the best of the tokens it carries
+                total.update(dict.fromkeys(self._postings[token], score))
+            for matches in expansions[1:]:
+                if not total:
+                    break
+                narrowed = {}
+                for customer_id, score in total.items():
+                    for token, match_score in matches.items():
+                        if customer_id in self._postings[token]:
+                            narrowed[customer_id] = score + match_score
+                            break
+                total = narrowed
+        if limit is None:
+            ranked = sorted(total.items(), key=lambda item: (-item[1], item[0]))
+        else:
+            ranked = heapq.nsmallest(limit, total.items(), key=lambda item: (-item[1], item[0]))
+        results = []
+        for customer_id, score in ranked:
+            customer = self.customer_store.get(customer_id)
+            if customer is not None:
+                results.append((customer, round(score / len(tokens), 3)))
+        return results
+
+    # Function to group customers that are probably the same person: the same email, the same mobile, or the
+    # same name with a similar address. Returns [{'customers': [...], 'reasons': [...]}], largest groups first
+    def duplicates(self):
+        with self._lock:
+            pairs = []
+            for kind in ('email', 'mobile'):
+                for ids in self._by_key[kind].values():
+                    if len(ids) > 1:
+                        pairs.append((kind, sorted(ids)))
+            name_groups = [sorted(ids) for ids in self._by_key['name'].values() if len(ids) > 1]
+        for ids in name_groups:
+            addresses = []
+            for customer_id in ids:
+                customer = self.customer_store.get(customer_id)
+                if customer is not None:
+                    addresses.append((customer_id, text_trigrams(customer.get('address'))))
+            for i, (first_id, first) in enumerate(addresses):
+                for second_id, second in addresses[i + 1:]:
+                    if similarity(first, second) >= DUPLICATE_ADDRESS_SIMILARITY:
+                        pairs.append(('name', [first_id, second_id]))
+        # Union the linked customers into groups
+        parent = {}
+
+        def root(customer_id):
+            parent.setdefault(customer_id, customer_id)
+            while parent[customer_id] != customer_id:
+                parent[customer_id] = parent[parent[customer_id]]
+                customer_id = parent[customer_id]
+            return customer_id
+
+        for _, ids in pairs:
+            for customer_id in ids[1:]:
+                parent[root(customer_id)] = root(ids[0])
+        groups = {}
+        for kind, ids in pairs:
+            group = groups.setdefault(root(ids[0]), {'ids': set(), 'reasons': set()})
+            group['ids'].update(ids)
+            group['reasons'].add(kind)
+        report = []
+        for group in groups.values():
+            customers = [self.customer_store.get(customer_id) for customer_id in sorted(group['ids'])]
+            customers = [customer for customer in customers if customer is not None]
+            if len(customers) > 1:
+                report.append({'customers': customers, 'reasons': sorted(group['reasons'])})
+        report.sort(key=lambda group: (-len(group['customers']), str(group['customers'][0]['id'])))
+        return report
+
+
+def main():
+    from OrderCore import get_core
+
+    parser = argparse.ArgumentParser(description='Search customers or list likely duplicates')
+    parser.add_argument('query', nargs='?', help='words of the name, mobile, email, address or id')
+    parser.add_argument('--limit', type=int, default=20, help='most results to show')
+    parser.add_argument('--exact', action='store_true', help='only exact and prefix matches, no fuzzy matching')
+    parser.add_argument('--duplicates', action='store_true', help='list likely duplicate customers')
+    args = parser.parse_args()
+
+    search = get_core().customer_search
+    if args.duplicates:
+        for group in search.duplicates():
+            print(f'Same {", ".join(group["reasons"])}:')
+            for customer in group['customers']:
+                print(f'  {customer["id"]}  {customer.get("name", "")}  {customer.get("mobile", "")}  '
+                      f'{customer.get("email", "")}  {customer.get("address", "")}')
+    elif args.query:
+        for customer, score in search.search(args.query, args.limit, not args.exact):
+            print(f'{score:5.2f}  {customer["id"]}  {customer.get("name", "")}  {customer.get("mobile", "")}  '
+                  f'{customer.get("email", "")}')
+    else:
+        parser.error('give a query or --duplicates')
+
+
+if __name__ == '__main__':
+    main()
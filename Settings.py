@@ -0,0 +1,73 @@
+import os
+
+# Application settings, overridable through environment variables
+
+# Storage backend: 'json' keeps one JSON file per dataset, 'sqlite' keeps everything in SQLITE_PATH,
+# 'arrow' keeps one Arrow IPC snapshot per dataset ('products.arrow', ..., needs pyarrow), loaded whole like JSON
+STORAGE_BACKEND = os.environ.get('ORDERM_STORAGE', 'json')
+SQLITE_PATH = os.environ.get('ORDERM_SQLITE_PATH', 'orderm.db')
+
+# How mutations to the JSON files are persisted: 'snapshot' rewrites the whole JSON file on every change,
+# 'journal' appends each change to a JSON-lines log and compacts the snapshot in the background
+PERSISTENCE_MODE = os.environ.get('ORDERM_PERSISTENCE', 'snapshot')
+
+# Number of journal entries after which the snapshot is compacted
+JOURNAL_COMPACT_EVERY = int(os.environ.get('ORDERM_JOURNAL_COMPACT_EVERY', '500'))
+
+# Monthly order partitions for the JSON backends: with ORDERM_ORDER_PARTITIONS=1 orders live in 'orders/' as
+# one file per month of creation. The last ORDER_HOT_MONTHS months are loaded at startup; older months are
+# archived gzip-compressed and only read by reports and lookups of old orders
+ORDER_PARTITIONS = os.environ.get('ORDERM_ORDER_PARTITIONS', '0') == '1'
+ORDER_HOT_MONTHS = int(os.environ.get('ORDERM_ORDER_HOT_MONTHS', '3'))
+
+# Key field of the records stored in each data file
+DATA_KEYS = {
+    'products.json': 'id',
+    'customers.json': 'id',
+    'orders.json': 'order_id',
+}
+
+# Metrics export in the Prometheus text format: a local http://127.0.0.1:<port>/metrics endpoint (0 = off)
+# and/or a file rewritten every METRICS_FILE_INTERVAL seconds ('' = off)
+METRICS_PORT = int(os.environ.get('ORDERM_METRICS_PORT', '0'))
+METRICS_FILE = os.environ.get('ORDERM_METRICS_FILE', '')
+METRICS_FILE_INTERVAL = float(os.environ.get('ORDERM_METRICS_FILE_INTERVAL', '15'))
+
+# Generator of new customer and order ids: 'ulid' or 'snowflake' (see Ids.py). Snowflake ids embed a node id
+# that must differ between processes writing the same data; without ORDERM_NODE_ID it is derived from the pid
+ID_GENERATOR = os.environ.get('ORDERM_ID_GENERATOR', 'ulid')
+ID_NODE = int(os.environ['ORDERM_NODE_ID']) if os.environ.get('ORDERM_NODE_ID') else None
+
+# Worker processes used for batch invoice generation (0 = one per CPU)
+INVOICE_WORKERS = int(os.environ.get('ORDERM_INVOICE_WORKERS', '0'))
+
+# Rendered invoice cache: memory budget in bytes, plus an optional directory and byte budget for the disk tier
+INVOICE_CACHE_BYTES = int(os.environ.get('ORDERM_INVOICE_CACHE_BYTES', str(64 * 1024 * 1024)))
+INVOICE_CACHE_DIR = os.environ.get('ORDERM_INVOICE_CACHE_DIR', '')
+INVOICE_CACHE_DISK_BYTES = int(os.environ.get('ORDERM_INVOICE_CACHE_DISK_BYTES', str(1024 * 1024 * 1024)))
+
+# HTTP API (python Api.py): port, and threads running the blocking core calls of concurrent requests
+API_PORT = int(os.environ.get('ORDERM_API_PORT', '8502'))
+API_THREADS = int(os.environ.get('ORDERM_API_THREADS', '8'))
+
+# Orders created per commit by the bulk import
+IMPORT_BATCH_SIZE = int(os.environ.get('ORDERM_IMPORT_BATCH_SIZE', '1000'))
+
+# Default threshold of the low-stock view
+LOW_STOCK_THRESHOLD = int(os.environ.get('ORDERM_LOW_STOCK_THRESHOLD', '5'))
+
+# Most customers listed by a customer search in the UI
+CUSTOMER_SEARCH_RESULTS = int(os.environ.get('ORDERM_CUSTOMER_SEARCH_RESULTS', '20'))
+
+# Background jobs (large exports, batch invoices): directory of the job table and result files, worker threads,
+# jobs one user may run at once and have queued or running, and seconds a finished job's result is kept
+JOB_DIR = os.environ.get('ORDERM_JOB_DIR', 'jobs')
+JOB_WORKERS = int(os.environ.get('ORDERM_JOB_WORKERS', '4'))
+JOB_USER_RUNNING = int(os.environ.get('ORDERM_JOB_USER_RUNNING', '1'))
+JOB_USER_PENDING = int(os.environ.get('ORDERM_JOB_USER_PENDING', '5'))
+JOB_RESULT_TTL = float(os.environ.get('ORDERM_JOB_RESULT_TTL', str(24 * 60 * 60)))
+
+# Exports of more records than this run as background jobs in the UI, and the jobs page refreshes every
+# JOB_POLL_SECONDS while it is open
+JOB_INLINE_RECORDS = int(os.environ.get('ORDERM_JOB_INLINE_RECORDS', '5000'))
+JOB_POLL_SECONDS = float(os.environ.get('ORDERM_JOB_POLL_SECONDS', '2'))
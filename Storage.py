@@ -0,0 +1,823 @@
+import gzip
+import json
+import os
+import re
+import sqlite3
+import threading
+from collections import OrderedDict
+from collections.abc import Mapping
+from datetime import date, datetime
+from DataStore import timestamp
+from Ids import id_timestamp_ms
+from Journal import atomic_write, get_journal
+from Locking import file_lock
+from Records import RECORD_TYPES, OrderLine, Record, record_json, records_from_columns
+from Settings import (STORAGE_BACKEND, PERSISTENCE_MODE, JOURNAL_COMPACT_EVERY, DATA_KEYS, SQLITE_PATH,
+                      ORDER_PARTITIONS, ORDER_HOT_MONTHS)
+
+# Pluggable storage backends behind load_data()/save_data().
+# Every backend stores the same datasets, named after their JSON files ('products.json', ...).
+
+
+# Function to get the key field of a data file; partition files ('orders/2024-05.json') take it from their dataset
+def data_key(filename):
+    if filename in DATA_KEYS:
+        return DATA_KEYS[filename]
+    return DATA_KEYS.get(os.path.dirname(filename) + '.json', 'id')
+
+
+# Function to get the (mtime, size) of a file, or None when it does not exist
+def file_signature(path):
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+# Plain JSON files, rewritten in full on every change
+class JsonStorage:
+    # Whether save_change()/save_changes() write the data passed to them (False when they only append the changes)
+    CHANGES_WRITE_DATA = True
+
+    # Function to load a dataset
+    def load(self, filename, default_data):
+        if not os.path.exists(filename):
+            self.save(filename, default_data)
+            return default_data
+        with open(filename, 'r') as f:
+            data = json.load(f)
+        return data
+
+    # Function to save a whole dataset
+    def save(self, filename, data):
+        atomic_write(filename, json.dumps(data, indent=4, default=record_json))
+
+    # Function to persist a single added, updated ('put') or deleted ('delete') record
+    def save_change(self, filename, data, op, record):
+        self.save(filename, data)
+
+    # Function to persist a batch of (op, record) changes at once
+    def save_changes(self, filename, data, changes):
+        self.save(filename, data)
+
+    # Function to get a value that changes whenever the stored dataset changes
+    def signature(self, filename):
+        return file_signature(filename)
+
+    # Function to get the lock serializing writers of a dataset across threads and processes
+    def lock(self, filename):
+        return file_lock(filename + '.lock')
+
+
+# JSON snapshots plus an append-only change log per file
+class JournalStorage(JsonStorage):
+    CHANGES_WRITE_DATA = False
+
+    def journal(self, filename):
+        return get_journal(filename, data_key(filename), JOURNAL_COMPACT_EVERY)
+
+    def load(self, filename, default_data):
+        # Replay the change log on top of the last snapshot
+        return self.journal(filename).load(default_data)
+
+    def save(self, filename, data):
+        self.journal(filename).compact(data)
+
+    def save_change(self, filename, data, op, record):
+        journal = self.journal(filename)
+        journal.append(op, record)
+        journal.maybe_compact()
+
+    def save_changes(self, filename, data, changes):
+        journal = self.journal(filename)
+        journal.append_many(changes)
+        journal.maybe_compact()
+
+    def signature(self, filename):
+        return file_signature(filename), file_signature(self.journal(filename).log_filename)
+
+
+# Snapshot-mode JSON storage that first folds in a log left over from journal mode
+class SnapshotStorage(JournalStorage):
+    CHANGES_WRITE_DATA = True
+
+    def load(self, filename, default_data):
+        journal = self.journal(filename)
+        if os.path.exists(journal.log_filename):
+            data = journal.load(default_data)
+            journal.compact(data)
+            return data
+        return JsonStorage.load(self, filename, default_data)
+
+    def save(self, filename, data):
+        JsonStorage.save(self, filename, data)
+
+    def save_change(self, filename, data, op, record):
+        JsonStorage.save(self, filename, data)
+
+    def save_changes(self, filename, data, changes):
+        JsonStorage.save(self, filename, data)
+
+
+# Datasets split into one file per month of creation by PartitionedStorage
+PARTITIONED_DATASETS = ['orders.json']
+# Partition of records without a usable created_at (orders from before timestamps); always loaded
+UNDATED_PARTITION = 'undated'
+# Archived partitions kept decompressed in memory for repeated lookups of old records
+ARCHIVE_CACHE_PARTITIONS = 4
+PARTITION_RE = re.compile(r'^(\d{4}-\d{2}|undated)\.json(\.gz)?$')
+
+
+# Function to get the partition ('YYYY-MM') of a record from its created_at
+def partition_of(record):
+    month = str(record.get('created_at') or '')[:7]
+    return month if re.match(r'^\d{4}-\d{2}$', month) else UNDATED_PARTITION
+
+
+# Function to get the first month ('YYYY-MM') still loaded hot, hot_months months back from today
+def hot_cutoff(hot_months, today=None):
+    today = today or date.today()
+    months = today.year * 12 + today.month - 1 - (hot_months - 1)
+    return f'{months // 12:04d}-{months % 12 + 1:02d}'
+
+
+# File where Migrations.remap_legacy_ids records the legacy ids it replaced
+ID_REMAP_FILE = 'id-remap.json'
+
+
+# Function to get the order ids minted by remap-ids from its mapping file (for orders remapped before the
+# migration marked them with their 'legacy_id')
+def remapped_order_ids(mapping_path=ID_REMAP_FILE):
+    try:
+        with open(mapping_path, 'r') as f:
+            mapping = json.load(f)
+    except FileNotFoundError:
+        return set()
+    return {str(order_id) for order_id in mapping.get('orders', {}).values()}
+
+
+# Function to date records without a created_at by the creation time embedded in their generated id;
+# returns how many were dated. Legacy short ids carry no time, and the ids remap-ids gave legacy records
+# (marked with 'legacy_id', or listed in skip_ids) carry the time of the migration, so both stay undated.
+def backfill_created_at(records, key, skip_ids=()):
+    dated = 0
+    for record in records:
+        if record.get('created_at') or record.get('legacy_id') or str(record.get(key)) in skip_ids:
+            continue
+        ms = id_timestamp_ms(record.get(key))
+        if ms is None:
+            continue
+        record['created_at'] = timestamp(datetime.fromtimestamp(ms / 1000))
+        if not record.get('updated_at'):
+            record['updated_at'] = record['created_at']
+        dated += 1
+    return dated
+
+
+# JSON storage keeping the orders as one file per month of creation in an 'orders/' directory, on top of
+# a snapshot or journal backend. Only the last hot_months months (and undated orders) are loaded; older months
+# are archived as gzip-compressed JSON ('orders/2024-05.json.gz') on the next load and only read by reports
+# and lookups of old orders. Other datasets go straight to the underlying backend.
+class PartitionedStorage:
+    def __init__(self, base, hot_months=ORDER_HOT_MONTHS):
+        self.base = base
+        self.hot_months = hot_months
+        self._archive_cache = OrderedDict()
+        # Path -> (signature, number of records) of the partitions counted by archived_count()
+        self._archive_counts = {}
+        self._archive_lock = threading.Lock()
+
+    # Function to get the partition directory of a dataset
+    def directory(self, filename):
+        return filename[:-len('.json')]
+
+    def partition_path(self, filename, month, archived=False):
+        return os.path.join(self.directory(filename), f'{month}.json' + ('.gz' if archived else ''))
+
+    # Function to list a dataset's partition files as [(month, path, archived)], oldest first
+    def partitions(self, filename):
+        try:
+            names = os.listdir(self.directory(filename))
+        except FileNotFoundError:
+            return []
+        found = []
+        for name in names:
+            match = PARTITION_RE.match(name)
+            if match:
+                found.append((match.group(1), os.path.join(self.directory(filename), name), bool(match.group(2))))
+        # 'undated' sorts after the months; it holds the oldest orders but is kept hot
+        return sorted(found)
+
+    # Function to tell whether a partition is loaded at startup
+    def is_hot(self, month):
+        return month == UNDATED_PARTITION or month >= hot_cutoff(self.hot_months)
+
+    def load(self, filename, default_data):
+        if filename not in PARTITIONED_DATASETS:
+            return self.base.load(filename, default_data)
+        if not os.path.isdir(self.directory(filename)):
+            self.split(filename, default_data)
+        self.archive(filename)
+        records = []
+        for month, path, archived in self.partitions(filename):
+            if not archived and self.is_hot(month):
+                records.extend(self.base.load(path, []))
+        return records
+
+    # Function to move a dataset from its single file into monthly partitions (the file is kept as '<file>.bak');
+    # records without a creation time are dated from their ids where possible
+    def split(self, filename, default_data):
+        data = self.base.load(filename, default_data) if os.path.exists(filename) else list(default_data)
+        backfill_created_at(data, data_key(filename), remapped_order_ids())
+        self._save_partitions(filename, data)
+        for path in (filename, filename + '.log'):
+            if os.path.exists(path):
+                os.replace(path, path + '.bak')
+
+    # Function to compress the partitions that have left the hot window, merging into any existing archive
+    def archive(self, filename):
+        key = data_key(filename)
+        archived = 0
+        for month, path, is_archived in self.partitions(filename):
+            if is_archived or self.is_hot(month):
+                continue
+            records = self.base.load(path, [])
+            archive_path = self.partition_path(filename, month, archived=True)
+            if os.path.exists(archive_path):
+                newer = {str(record[key]) for record in records}
+                records = [record for record in self.load_archive(archive_path)
+                           if str(record[key]) not in newer] + records
+            self.write_archive(archive_path, records)
+            for leftover in (path, path + '.log'):
+                if os.path.exists(leftover):
+                    os.remove(leftover)
+            archived += 1
+        return archived
+
+    def write_archive(self, path, records):
+        atomic_write(path, gzip.compress(json.dumps(records, separators=(',', ':'),
+                                                    default=record_json).encode('utf-8')))
+
+    # Function to read one archived partition
+    def read_archive(self, path):
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            return json.load(f)
+
+    # Function to read one archived partition, keeping the last few read in memory (shared: not to be changed)
+    def load_archive(self, path):
+        signature = file_signature(path)
+        with self._archive_lock:
+            cached = self._archive_cache.get(path)
+            if cached is not None and cached[0] == signature:
+                self._archive_cache.move_to_end(path)
+                return cached[1]
+        records = self.read_archive(path)
+        with self._archive_lock:
+            self._archive_cache[path] = (signature, records)
+            while len(self._archive_cache) > ARCHIVE_CACHE_PARTITIONS:
+                self._archive_cache.popitem(last=False)
+        return records
+
+    # Function to iterate over the records of the partitions that are not loaded hot, oldest month first,
+    # optionally only the months overlapping since/until ('YYYY-MM-DD' or 'YYYY-MM' bounds). Only one month
+    # is in memory at a time: scans bypass the cache kept for lookups of old records.
+    def archived(self, filename, since=None, until=None):
+        for month, path, archived in self.partitions(filename):
+            if self.is_hot(month) or (since and month < since[:7]) or (until and month > until[:7]):
+                continue
+            yield from self.read_archive(path) if archived else self.base.load(path, [])
+
+    # Function to get a value that changes whenever the partitions that are not loaded hot change,
+    # including when the hot window moves past a month
+    def archived_signature(self, filename):
+        return tuple((month, file_signature(path) if archived else self.base.signature(path))
+                     for month, path, archived in self.partitions(filename) if not self.is_hot(month))
+
+    # Function to count the records of the partitions that are not loaded hot; a partition is only read
+    # again once its file has changed
+    def archived_count(self, filename):
+        total = 0
+        for month, path, archived in self.partitions(filename):
+            if self.is_hot(month):
+                continue
+            signature = file_signature(path) if archived else self.base.signature(path)
+            with self._archive_lock:
+                cached = self._archive_counts.get(path)
+            if cached is None or cached[0] != signature:
+                records = self.read_archive(path) if archived else self.base.load(path, [])
+                cached = (signature, len(records))
+                with self._archive_lock:
+                    self._archive_counts[path] = cached
+            total += cached[1]
+        return total
+
+    # Function to apply update(record) to every record of the partitions that are not loaded hot, rewriting
+    # the partitions where it returned True for some record (for migrations; hold the dataset lock).
+    # Returns the number of records changed.
+    def update_archived(self, filename, update):
+        changed = 0
+        for month, path, archived in self.partitions(filename):
+            if self.is_hot(month):
+                continue
+            records = self.read_archive(path) if archived else self.base.load(path, [])
+            updated = sum(1 for record in records if update(record))
+            if updated and archived:
+                self.write_archive(path, records)
+            elif updated:
+                self.base.save(path, records)
+            changed += updated
+        return changed
+
+    # Function to find a record that is not loaded hot by its key, newest month first
+    def find_archived(self, filename, record_id):
+        key = data_key(filename)
+        record_id = str(record_id)
+        for month, path, archived in reversed(self.partitions(filename)):
+            if self.is_hot(month):
+                continue
+            for record in (self.load_archive(path) if archived else self.base.load(path, [])):
+                if str(record.get(key)) == record_id:
+                    return record
+        return None
+
+    # Function to split records by partition, as {month: [records]}
+    def _group(self, records):
+        groups = {}
+        for record in records:
+            groups.setdefault(partition_of(record), []).append(record)
+        return groups
+
+    def _save_partitions(self, filename, data):
+        os.makedirs(self.directory(filename), exist_ok=True)
+        groups = self._group(data)
+        # Hot partitions that lost all their records are written empty
+        for month, path, archived in self.partitions(filename):
+            if not archived:
+                groups.setdefault(month, [])
+        for month, records in groups.items():
+            self.base.save(self.partition_path(filename, month), records)
+
+    def save(self, filename, data):
+        if filename not in PARTITIONED_DATASETS:
+            return self.base.save(filename, data)
+        self._save_partitions(filename, data)
+
+    def save_change(self, filename, data, op, record):
+        if filename not in PARTITIONED_DATASETS:
+            return self.base.save_change(filename, data, op, record)
+        month = partition_of(record)
+        # The month's records are only gathered (a pass over every hot record) when the base rewrites the file
+        part = [other for other in data if partition_of(other) == month] if self.base.CHANGES_WRITE_DATA else None
+        self.base.save_change(self.partition_path(filename, month), part, op, record)
+
+    def save_changes(self, filename, data, changes):
+        if filename not in PARTITIONED_DATASETS:
+            return self.base.save_changes(filename, data, changes)
+        by_month = {}
+        for op, record in changes:
+            by_month.setdefault(partition_of(record), []).append((op, record))
+        groups = self._group(data) if self.base.CHANGES_WRITE_DATA else {}
+        for month, month_changes in by_month.items():
+            self.base.save_changes(self.partition_path(filename, month), groups.get(month, []), month_changes)
+
+    # The hot partition files (and their logs) and the hot window; archives do not change what is loaded
+    def signature(self, filename):
+        if filename not in PARTITIONED_DATASETS:
+            return self.base.signature(filename)
+        directory = self.directory(filename)
+        try:
+            names = sorted(os.listdir(directory))
+        except FileNotFoundError:
+            return None
+        return hot_cutoff(self.hot_months), tuple((name, file_signature(os.path.join(directory, name)))
+                                                  for name in names if not name.endswith('.gz'))
+
+    def lock(self, filename):
+        return self.base.lock(filename)
+
+
+# Typed columns of each table; any other record field is kept in the 'extra' JSON column
+SQLITE_TABLES = {
+    'products': ('id', ['name', 'price', 'quantity']),
+    'customers': ('id', ['name', 'address', 'mobile', 'email']),
+    'orders': ('order_id', ['customer_id', 'total_amount']),
+}
+SQLITE_LINE_COLUMNS = ['product_id', 'name', 'quantity', 'price']
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS products (
+    id TEXT PRIMARY KEY,
+    name TEXT,
+    price REAL,
+    quantity INTEGER,
+    extra TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_products_quantity ON products (quantity);
+CREATE TABLE IF NOT EXISTS customers (
+    id TEXT PRIMARY KEY,
+    name TEXT,
+    address TEXT,
+    mobile TEXT,
+    email TEXT,
+    extra TEXT
+);
+CREATE TABLE IF NOT EXISTS orders (
+    order_id TEXT PRIMARY KEY,
+    customer_id TEXT,
+    total_amount REAL,
+    extra TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_orders_customer_id ON orders (customer_id);
+CREATE TABLE IF NOT EXISTS order_lines (
+    order_id TEXT NOT NULL REFERENCES orders (order_id) ON DELETE CASCADE,
+    line_no INTEGER NOT NULL,
+    product_id TEXT,
+    name TEXT,
+    quantity INTEGER,
+    price REAL,
+    extra TEXT,
+    PRIMARY KEY (order_id, line_no)
+);
+CREATE INDEX IF NOT EXISTS idx_order_lines_product_id ON order_lines (product_id);
+"""
+
+
+# SQLite database with one table per dataset and order lines in their own table
+class SqliteStorage:
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._schema_lock = threading.Lock()
+        self._schema_ready = False
+
+    # Function to get this thread's connection, opened once and reused afterwards
+    def connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('PRAGMA foreign_keys=ON')
+            with self._schema_lock:
+                if not self._schema_ready:
+                    conn.executescript(SQLITE_SCHEMA)
+                    self._schema_ready = True
+            self._local.conn = conn
+        return conn
+
+    # Function to get a value that changes whenever the database is written
+    def signature(self, filename):
+        return file_signature(self.path), file_signature(self.path + '-wal')
+
+    def lock(self, filename):
+        return file_lock(f'{self.path}.{self._table(filename)}.lock')
+
+    def _table(self, filename):
+        table = os.path.splitext(os.path.basename(filename))[0]
+        if table not in SQLITE_TABLES:
+            raise ValueError(f'No SQLite table for {filename}')
+        return table
+
+    def _row_values(self, table, record):
+        key, columns = SQLITE_TABLES[table]
+        known = {key, 'products'} | set(columns)
+        extra = {k: v for k, v in record.items() if k not in known}
+        return [str(record[key])] + [record.get(c) for c in columns] + [json.dumps(extra) if extra else None]
+
+    def _line_values(self, order_id, line_no, line):
+        extra = {k: v for k, v in line.items() if k not in SQLITE_LINE_COLUMNS}
+        return [order_id, line_no] + [line.get(c) for c in SQLITE_LINE_COLUMNS] + [json.dumps(extra) if extra else None]
+
+    def _record(self, table, row, lines=None):
+        key, columns = SQLITE_TABLES[table]
+        record = {key: row[key]}
+        for column in columns:
+            record[column] = row[column]
+            if table == 'orders' and column == 'customer_id':
+                record['products'] = lines if lines is not None else []
+        if row['extra']:
+            record.update(json.loads(row['extra']))
+        return record
+
+    def _line(self, row):
+        # Compact lines carry no name copy; leave it out instead of returning None
+        line = {c: row[c] for c in SQLITE_LINE_COLUMNS if c != 'name' or row[c] is not None}
+        if row['extra']:
+            line.update(json.loads(row['extra']))
+        return line
+
+    def _orders(self, rows):
+        rows = list(rows)
+        if not rows:
+            return []
+        conn = self.connection()
+        lines = {row['order_id']: [] for row in rows}
+        if len(rows) <= 500:
+            marks = ','.join('?' * len(rows))
+            line_rows = conn.execute(f'SELECT * FROM order_lines WHERE order_id IN ({marks}) '
+                                     'ORDER BY order_id, line_no', list(lines))
+        else:
+            line_rows = conn.execute('SELECT * FROM order_lines ORDER BY order_id, line_no')
+        for row in line_rows:
+            if row['order_id'] in lines:
+                lines[row['order_id']].append(self._line(row))
+        return [self._record('orders', row, lines[row['order_id']]) for row in rows]
+
+    def _insert(self, conn, table, record):
+        key, columns = SQLITE_TABLES[table]
+        names = [key] + columns + ['extra']
+        updates = ', '.join(f'{c} = excluded.{c}' for c in names[1:])
+        conn.execute(f'INSERT INTO {table} ({", ".join(names)}) VALUES ({", ".join("?" * len(names))}) '
+                     f'ON CONFLICT ({key}) DO UPDATE SET {updates}', self._row_values(table, record))
+        if table == 'orders':
+            order_id = str(record[key])
+            conn.execute('DELETE FROM order_lines WHERE order_id = ?', (order_id,))
+            lines = record.get('products', [])
+            conn.executemany('INSERT INTO order_lines VALUES (?, ?, ?, ?, ?, ?, ?)',
+                             [self._line_values(order_id, no, line) for no, line in enumerate(lines)])
+
+    # Function to load a dataset
+    def load(self, filename, default_data):
+        table = self._table(filename)
+        rows = self.connection().execute(f'SELECT * FROM {table} ORDER BY rowid')
+        if table == 'orders':
+            data = self._orders(rows)
+        else:
+            data = [self._record(table, row) for row in rows]
+        return data if data else list(default_data)
+
+    # Function to replace a whole dataset in one transaction
+    def save(self, filename, data):
+        table = self._table(filename)
+        key = SQLITE_TABLES[table][0]
+        conn = self.connection()
+        seen = set()
+        with conn:
+            if table == 'orders':
+                conn.execute('DELETE FROM order_lines')
+            conn.execute(f'DELETE FROM {table}')
+            for record in data:
+                # Duplicate ids keep the first record, like the in-memory indexes do
+                if key in record and str(record[key]) not in seen:
+                    seen.add(str(record[key]))
+                    self._insert(conn, table, record)
+
+    # Function to persist a single added, updated ('put') or deleted ('delete') record
+    def save_change(self, filename, data, op, record):
+        table = self._table(filename)
+        key = SQLITE_TABLES[table][0]
+        conn = self.connection()
+        with conn:
+            if op == 'delete':
+                conn.execute(f'DELETE FROM {table} WHERE {key} = ?', (str(record[key]),))
+            else:
+                self._insert(conn, table, record)
+
+    # Function to persist a batch of (op, record) changes in one transaction
+    def save_changes(self, filename, data, changes):
+        table = self._table(filename)
+        key = SQLITE_TABLES[table][0]
+        conn = self.connection()
+        with conn:
+            for op, record in changes:
+                if op == 'delete':
+                    conn.execute(f'DELETE FROM {table} WHERE {key} = ?', (str(record[key]),))
+                else:
+                    self._insert(conn, table, record)
+
+    # Function to fetch one record by id through the primary key index
+    def get(self, filename, record_id):
+        table = self._table(filename)
+        key = SQLITE_TABLES[table][0]
+        rows = self.connection().execute(f'SELECT * FROM {table} WHERE {key} = ?', (str(record_id),))
+        records = self._orders(rows) if table == 'orders' else [self._record(table, row) for row in rows]
+        return records[0] if records else None
+
+    # Function to fetch the orders of a customer through the customer_id index
+    def orders_for_customer(self, customer_id):
+        rows = self.connection().execute('SELECT * FROM orders WHERE customer_id = ? ORDER BY rowid',
+                                         (str(customer_id),))
+        return self._orders(rows)
+
+    # Function to fetch a page of records in insertion order
+    def select(self, filename, limit=None, offset=0):
+        table = self._table(filename)
+        rows = self.connection().execute(f'SELECT * FROM {table} ORDER BY rowid LIMIT ? OFFSET ?',
+                                         (-1 if limit is None else limit, offset))
+        return self._orders(rows) if table == 'orders' else [self._record(table, row) for row in rows]
+
+
+# Typed columns of each dataset in the Arrow snapshots (whole-number prices come back as floats); any other
+# field, a value of another type or an explicit null is kept in the 'extra' JSON column of its row
+ARROW_TABLES = {
+    'products': [('id', 'string'), ('name', 'string'), ('price', 'float'), ('quantity', 'int'), ('version', 'int')],
+    'customers': [('id', 'string'), ('name', 'string'), ('address', 'string'), ('mobile', 'string'),
+                  ('email', 'string'), ('version', 'int')],
+    'orders': [('order_id', 'string'), ('customer_id', 'string'), ('products', 'lines'), ('total_amount', 'float'),
+               ('created_at', 'string'), ('updated_at', 'string'), ('version', 'int')],
+}
+ARROW_LINE_COLUMNS = [('product_id', 'string'), ('quantity', 'int'), ('price', 'float'), ('name', 'string'),
+                      ('reserved', 'int')]
+
+
+# Function to get the dataset ('products', ...) of a data file
+def dataset_of(filename):
+    dataset = os.path.splitext(os.path.basename(filename))[0]
+    if dataset not in ARROW_TABLES:
+        raise ValueError(f'Unknown dataset: {filename}')
+    return dataset
+
+
+# Function to import pyarrow, which only the Arrow snapshots need
+def import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.ipc
+    except ImportError:
+        raise RuntimeError('Arrow snapshots need the pyarrow package (pip install pyarrow)')
+    return pyarrow
+
+
+# Function to get the Arrow type of a column kind
+def arrow_type(pa, kind):
+    if kind == 'lines':
+        return pa.list_(pa.struct([(name, arrow_type(pa, line_kind)) for name, line_kind in ARROW_LINE_COLUMNS]
+                                  + [('extra', pa.string())]))
+    return {'string': pa.string(), 'int': pa.int64(), 'float': pa.float64()}[kind]
+
+
+def arrow_schema(pa, columns):
+    return pa.schema([(name, arrow_type(pa, kind)) for name, kind in columns] + [('extra', pa.string())])
+
+
+# Python types each column kind takes as is (bool is not a number here)
+ARROW_VALUE_TYPES = {'string': (str,), 'int': (int,), 'float': (int, float), 'lines': (list,)}
+
+
+# Function to tell whether a value can go in a column of the given kind
+def fits_column(kind, value):
+    if type(value) not in ARROW_VALUE_TYPES[kind]:
+        return False
+    if kind == 'int':
+        return -2 ** 63 <= value < 2 ** 63
+    if kind == 'lines':
+        return all(isinstance(line, Mapping) for line in value)
+    return True
+
+
+# Function to get the fields of a record that have no column: the overflow fields of record objects whose
+# slots are exactly the columns, any other key of plain dicts
+def unknown_fields(record, names):
+    if isinstance(record, Record) and names.issuperset(record.FIELDS):
+        return record.extra_fields()
+    return {key: value for key, value in record.items() if key not in names} or None
+
+
+# Function to build the Arrow arrays of records column by column, moving whatever does not fit a column
+# (a value of another type, an explicit null, a field without a column) to the 'extra' JSON column of its row
+def arrow_arrays(pa, records, columns):
+    names = {name for name, _ in columns}
+    extras = [unknown_fields(record, names) for record in records]
+    arrays = []
+    for name, kind in columns:
+        values = [record.get(name) for record in records]
+        # Strings and floats need no check beyond their type, which is tested inline for speed
+        plain = ARROW_VALUE_TYPES[kind] if kind in ('string', 'float') else ()
+        for row, value in enumerate(values):
+            if value is None:
+                if name not in records[row]:
+                    continue
+            elif type(value) in plain or fits_column(kind, value):
+                continue
+            extras[row] = dict(extras[row] or {})
+            extras[row][name] = value
+            values[row] = None
+        if kind == 'lines':
+            # Order lines go in flat child columns, with list offsets delimiting the lines of each record
+            offsets = [0]
+            lines = []
+            for value in values:
+                if value is not None:
+                    lines.extend(value)
+                offsets.append(len(lines))
+            struct = pa.StructArray.from_arrays(arrow_arrays(pa, lines, ARROW_LINE_COLUMNS),
+                                                names=[line_name for line_name, _ in ARROW_LINE_COLUMNS] + ['extra'])
+            arrays.append(pa.ListArray.from_arrays(pa.array(offsets, pa.int32()), struct,
+                                                   mask=pa.array([value is None for value in values], pa.bool_())))
+        else:
+            arrays.append(pa.array(values, arrow_type(pa, kind)))
+    arrays.append(pa.array([json.dumps(extra, default=record_json) if extra else None for extra in extras],
+                           pa.string()))
+    return arrays
+
+
+# Function to write records as an uncompressed Arrow IPC file, which readers memory-map instead of parsing
+def write_arrow(path, filename, data):
+    pa = import_pyarrow()
+    columns = ARROW_TABLES[dataset_of(filename)]
+    schema = arrow_schema(pa, columns)
+    table = pa.Table.from_arrays(arrow_arrays(pa, data, columns), schema=schema)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_file(sink, schema) as writer:
+        writer.write_table(table)
+    atomic_write(path, sink.getvalue().to_pybytes())
+
+
+# Function to open an Arrow IPC file as a table over a memory map, so its buffers are not copied into memory
+def map_arrow(path):
+    pa = import_pyarrow()
+    return pa.ipc.open_file(pa.memory_map(path)).read_all()
+
+
+# Function to build record objects from the column values of a snapshot, adding the fields kept in 'extra'
+def arrow_records(record_type, column_values, extras, count):
+    records = records_from_columns(record_type, column_values, count)
+    for record, extra in zip(records, extras):
+        if extra is not None:
+            record.update(json.loads(extra))
+    return records
+
+
+# Function to read an Arrow snapshot back into record objects
+def read_arrow(path, filename):
+    table = map_arrow(path)
+    columns = ARROW_TABLES[dataset_of(filename)]
+    values = {name: table.column(name).to_pylist() for name, kind in columns if kind != 'lines'}
+    records = arrow_records(RECORD_TYPES[filename], values, table.column('extra').to_pylist(), table.num_rows)
+    for name, kind in columns:
+        if kind != 'lines':
+            continue
+        # Order lines are read from the flat child columns and sliced per order by the list offsets
+        lists = table.column(name).combine_chunks()
+        lines = lists.flatten()
+        line_values = {line_name: lines.field(line_name).to_pylist() for line_name, _ in ARROW_LINE_COLUMNS}
+        line_records = arrow_records(OrderLine, line_values, lines.field('extra').to_pylist(), len(lines))
+        offsets = lists.offsets.to_pylist()
+        nulls = lists.is_null().to_pylist() if lists.null_count else None
+        for row, record in enumerate(records):
+            if nulls is None or not nulls[row]:
+                setattr(record, name, line_records[offsets[row] - offsets[0]:offsets[row + 1] - offsets[0]])
+    return records
+
+
+# Snapshots in the Arrow IPC file format ('products.arrow', ...), read column by column into records on load
+# instead of parsed like JSON; the whole dataset is still loaded, as with the other backends. Every change
+# rewrites the snapshot, as in snapshot mode. On first use an existing JSON file is converted and kept as
+# '<file>.json.bak'; convert back with Convert.py.
+class ArrowStorage:
+    # Function to get the snapshot path of a data file
+    def path(self, filename):
+        return os.path.splitext(filename)[0] + '.arrow'
+
+    def load(self, filename, default_data):
+        path = self.path(filename)
+        if not os.path.exists(path):
+            legacy = SnapshotStorage()
+            data = legacy.load(filename, default_data) if os.path.exists(filename) else list(default_data)
+            self.save(filename, data)
+            for old in (filename, filename + '.log'):
+                if os.path.exists(old):
+                    os.replace(old, old + '.bak')
+            return data
+        return read_arrow(path, filename)
+
+    def save(self, filename, data):
+        write_arrow(self.path(filename), filename, data)
+
+    def save_change(self, filename, data, op, record):
+        self.save(filename, data)
+
+    def save_changes(self, filename, data, changes):
+        self.save(filename, data)
+
+    def signature(self, filename):
+        return file_signature(self.path(filename))
+
+    def lock(self, filename):
+        return file_lock(self.path(filename) + '.lock')
+
+
+_storage = None
+_storage_lock = threading.Lock()
+
+
+# Function to get the storage backend selected in Settings
+def get_storage():
+    global _storage
+    with _storage_lock:
+        if _storage is None:
+            if STORAGE_BACKEND == 'sqlite':
+                _storage = SqliteStorage(SQLITE_PATH)
+            elif STORAGE_BACKEND == 'json' and PERSISTENCE_MODE == 'journal':
+                _storage = JournalStorage()
+            elif STORAGE_BACKEND == 'json':
+                _storage = SnapshotStorage()
+            elif STORAGE_BACKEND == 'arrow':
+                _storage = ArrowStorage()
+            else:
+                raise ValueError(f'Unknown storage backend: {STORAGE_BACKEND}')
+            if ORDER_PARTITIONS and STORAGE_BACKEND == 'json':
+                _storage = PartitionedStorage(_storage)
+        return _storage
@@ -0,0 +1,53 @@
+import unittest
+from DataStore import IndexedStore
+from Records import Product
+
+# Removal from the indexed stores: python -m pytest test_datastore.py (or python -m unittest test_datastore)
+
+
+class RemoveTest(unittest.TestCase):
+    # Function to assert that the store holds exactly these record objects, in this order
+    def assertRecords(self, store, expected):
+        self.assertEqual([id(record) for record in store.records], [id(record) for record in expected])
+
+    def test_remove_promotes_the_next_record_with_a_duplicated_id(self):
+        first, other, second, third = (Product(id='1', name='first'), Product(id='2', name='other'),
+                                       Product(id='1', name='second'), Product(id='1', name='third'))
+        store = IndexedStore([first, other, second, third], sorted_fields={'name': str})
+
+        self.assertIs(store.remove('1'), first)
+        self.assertIs(store.get('1'), second)
+        self.assertRecords(store, [other, second, third])
+        self.assertIs(store.remove('1'), second)
+        self.assertIs(store.get('1'), third)
+        self.assertRecords(store, [other, third])
+        self.assertEqual(store.query(prefixes={'name': 'th'})[0], [third])
+
+    def test_remove_takes_out_the_indexed_record_and_not_an_equal_one(self):
+        # Equal field by field, but only the first is indexed
+        first, twin = Product(id='1', name='same'), Product(id='1', name='same')
+        store = IndexedStore([first, twin])
+        self.assertIs(store.remove('1'), first)
+        self.assertRecords(store, [twin])
+        self.assertIs(store.get('1'), twin)
+
+    def test_positions_stay_in_insertion_order_after_removes_and_adds(self):
+        records = [Product(id=str(number), name=f'product {number}') for number in range(20)]
+        store = IndexedStore(list(records))
+        for record_id in ('0', '5', '19'):
+            store.remove(record_id)
+        added = store.add(Product(id='20', name='product 20'))
+        store.add(Product(id='21', name='product 21'))
+        store.remove('3')
+        store.remove('21')
+
+        expected = [record for number, record in enumerate(records) if number not in (0, 3, 5, 19)] + [added]
+        self.assertRecords(store, expected)
+        self.assertEqual(store.query()[0], expected)
+        self.assertEqual(store.query(descending=True, limit=2)[0], [added, records[18]])
+        # An index-narrowed query lists its matches in insertion order too
+        self.assertEqual(store.query(equals={'id': '7'})[0], [records[7]])
+
+
+if __name__ == '__main__':
+    unittest.main()
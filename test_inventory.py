@@ -0,0 +1,58 @@
+import json
+import os
+import tempfile
+import unittest
+from OrderCore import OrderCore
+from Storage import SnapshotStorage
+
+# Stock given back by order changes: python -m pytest test_inventory.py (or python -m unittest test_inventory)
+
+
+class ReleaseTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.cwd = os.getcwd()
+        os.chdir(self.directory.name)
+        data = {
+            'products.json': [{'id': '100', 'name': 'bat', 'price': 350.0, 'quantity': 10, 'version': 1}],
+            'customers.json': [{'id': 'C1', 'name': 'Jane', 'version': 1}],
+            # An order from before stock reservation: its line never took stock
+            'orders.json': [{'order_id': '0001', 'customer_id': 'C1', 'total_amount': 1400.0,
+                             'products': [{'product_id': '100', 'quantity': 4, 'price': 350.0}]}],
+        }
+        for filename, records in data.items():
+            with open(filename, 'w') as f:
+                json.dump(records, f)
+        self.core = OrderCore(SnapshotStorage())
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.directory.cleanup()
+
+    def stock(self):
+        return self.core.product_store.get('100')['quantity']
+
+    def test_deleting_legacy_order_gives_no_stock_back(self):
+        self.assertTrue(self.core.delete_order('0001'))
+        self.assertEqual(self.stock(), 10)
+
+    def test_deleting_order_gives_back_what_it_reserved(self):
+        order = self.core.add_order('C1')
+        self.core.update_order(order['order_id'], '100', 3)
+        self.assertEqual(self.stock(), 7)
+        self.core.delete_order(order['order_id'])
+        self.assertEqual(self.stock(), 10)
+
+    def test_replace_decrease_releases_at_most_the_reserved_stock(self):
+        # 2 of the line's 6 are reserved; the 4 from before reservations never took stock
+        self.core.update_order('0001', '100', 2)
+        self.assertEqual(self.stock(), 8)
+        self.core.update_order('0001', '100', 1, replace=True)
+
+        line = self.core.order_store.get('0001')['products'][0]
+        self.assertEqual((line['quantity'], line['reserved']), (1, 0))
+        self.assertEqual(self.stock(), 10)
+
+
+if __name__ == '__main__':
+    unittest.main()
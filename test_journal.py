@@ -0,0 +1,53 @@
+import json
+import os
+import tempfile
+import unittest
+from Journal import Journal
+
+# Crash recovery of the journal: python -m pytest test_journal.py (or python -m unittest test_journal)
+
+
+class TornWriteTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.directory.name, 'orders.json')
+        with open(self.filename, 'w') as f:
+            json.dump([{'order_id': '1', 'total_amount': 1.0}], f)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    # Function to leave a half-written entry at the end of the log, as a crash mid-append does
+    def tear_log(self):
+        with open(self.filename + '.log', 'ab') as f:
+            f.write(b'{"op":"put","id":"2","record":{"order_id":"2","tot')
+
+    def test_append_after_torn_write_survives_reload(self):
+        journal = Journal(self.filename, 'order_id')
+        journal.append('put', {'order_id': '1', 'total_amount': 5.0})
+        self.tear_log()
+        self.assertEqual([order['total_amount'] for order in journal.load([])], [5.0])
+        journal.append('put', {'order_id': '3', 'total_amount': 3.0})
+
+        reloaded = Journal(self.filename, 'order_id').load([])
+        self.assertEqual([(order['order_id'], order['total_amount']) for order in reloaded], [('1', 5.0), ('3', 3.0)])
+
+    def test_append_without_reload_starts_a_new_line(self):
+        journal = Journal(self.filename, 'order_id')
+        self.tear_log()
+        journal.append('put', {'order_id': '3', 'total_amount': 3.0})
+
+        reloaded = Journal(self.filename, 'order_id').load([])
+        self.assertEqual([order['order_id'] for order in reloaded], ['1', '3'])
+
+    def test_torn_line_is_cut_on_load(self):
+        journal = Journal(self.filename, 'order_id')
+        journal.append('put', {'order_id': '1', 'total_amount': 5.0})
+        size = os.path.getsize(self.filename + '.log')
+        self.tear_log()
+        journal.load([])
+        self.assertEqual(os.path.getsize(self.filename + '.log'), size)
+
+
+if __name__ == '__main__':
+    unittest.main()